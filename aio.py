@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Convert from asyncio code (a web backend) without blocking the event
+#   loop: reading the upload or the file runs on the default thread pool
+#   and the conversion itself on a pool of worker processes
+# - A semaphore caps the conversions in flight, whoever starts them, so a
+#   burst of requests waits its turn instead of piling up work
+# - as_completed() converts a stream of sources and yields every result
+#   as soon as it is ready. It only takes the next source when a slot is
+#   free, so thousands of queued uploads are never all read, and their
+#   files never all open, at the same time.
+#
+# Example:
+#     async with aio.AsyncConverter(workers=4) as converter:
+#         text = await converter.convert("model.synergo")
+#         async for source, status, result in converter.as_completed(paths):
+#             ...
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import convert
+
+## _caches : The ConversionCache of every worker process, by its options
+_caches = {}
+
+## _convert_data : Function(data,cache_options)
+##
+## Functionality:
+##     Runs inside a worker process. Returns ("ok", text), ("structure",
+##     error fields) or ("error", message), like serve._worker_main.
+
+def _convert_data(data:bytes, cache_options):
+    try:
+        if cache_options is None:
+            return ("ok", convert.convert(data))
+        if cache_options not in _caches:
+            _caches[cache_options] = cache.ConversionCache(*cache_options)
+        return ("ok", cache.convert_cached(data, _caches[cache_options]))
+    except convert.StructureError as e:
+        return ("structure", e.fields())
+    except Exception as e:
+        return ("error", "{0}: {1}".format(type(e).__name__, e))
+
+## _read : Function(source)
+##
+## Functionality:
+##     The bytes of [source]: a path, bytes or an open binary file.
+##     Blocking, so it is run on a thread.
+
+def _read(source) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return source.read()
+
+## AsyncConverter : Converts on a process pool from asyncio code
+##     where workers = worker processes (default: number of cores)
+##           limit = conversions in flight at once, running or waiting
+##                   for a worker (default: 2 * workers)
+##           cache_options = (cache directory, size limit) or None
+##
+## Must be used on one event loop. The pool is started by the first
+## conversion and stopped by close() (or at the end of "async with").
+
+class AsyncConverter:
+    def __init__(self, workers:int = None, limit:int = None, cache_options = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.limit = limit or 2 * self.workers
+        self.cache_options = cache_options
+        self.semaphore = asyncio.Semaphore(self.limit)
+        self.executor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            ## Workers are never forked from the threads of the event loop
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["convert", "aio"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self.executor
+
+    ## convert : Function(source)
+    ##     where source = path of the .synergo file, or its bytes
+    ##                    or an open binary file
+    ##
+    ## Functionality:
+    ##     Returns the generated Python text. Raises convert.StructureError
+    ##     for a bad model and ValueError when the source is not a
+    ##     .synergo archive.
+
+    async def convert(self, source) -> str:
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            data = await loop.run_in_executor(None, _read, source)
+            status, payload = await loop.run_in_executor(self._executor(), _convert_data, data, self.cache_options)
+
+        if status == "structure":
+            raise convert.StructureError.from_fields(payload)
+        if status == "error":
+            raise ValueError(payload)
+        return payload
+
+    ## as_completed : Function(sources)
+    ##     where sources = an iterable or async iterable of sources
+    ##
+    ## Functionality:
+    ##     Async generator of (source, status, result) in the order the
+    ##     conversions finish, where status is "ok" (result = the text),
+    ##     "structure" (result = the StructureError) or "error" (result =
+    ##     the exception). At most [limit] sources are taken from [sources]
+    ##     before their results are yielded, so a slow consumer slows the
+    ##     reading down too.
+
+    async def as_completed(self, sources):
+        if hasattr(sources, "__aiter__"):
+            iterator = sources.__aiter__()
+            next_source = iterator.__anext__
+        else:
+            iterator = iter(sources)
+            async def next_source():
+                try:
+                    return next(iterator)
+                except StopIteration:
+                    raise StopAsyncIteration
+
+        tasks = {}
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(tasks) < self.limit:
+                    try:
+                        source = await next_source()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    tasks[asyncio.ensure_future(self.convert(source))] = source
+                if not tasks:
+                    return
+
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        yield source, "ok", task.result()
+                    elif isinstance(error, convert.StructureError):
+                        yield source, "structure", error
+                    else:
+                        yield source, "error", error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    ## close : Function()
+    ##
+    ## Functionality:
+    ##     Waits for the running conversions and stops the worker processes
+    ##     without blocking the event loop
+
+    async def close(self):
+        if self.executor is not None:
+            executor, self.executor = self.executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
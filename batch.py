@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Collect every .synergo file from the given directories, globs or files
+# - Spread the files across a process pool sized to the cores, so the
+#   interpreter start-up and the imports are paid once per worker
+#   instead of once per file
+# - Write the generated .py file of every model
+# - Print a summary with the successes and the failures of each file.
+#   A bad model is reported and never aborts the rest of the batch
+
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cache
+import checkpoint
+import convert
+import timeline
+
+SYNERGO_SUFFIX = ".synergo"
+
+## collect_inputs : Function(patterns)
+##     where patterns = list of directories, glob patterns or files
+##
+## Functionality:
+##     Returns the sorted list of .synergo files described by the
+##     patterns. Directories are searched recursively. Every file
+##     appears only once even if more patterns match it.
+
+def collect_inputs(patterns) -> list:
+    found = set()
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [str(p) for p in Path(pattern).rglob("*" + SYNERGO_SUFFIX)]
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            matches = [pattern]
+
+        for m in matches:
+            if os.path.isfile(m):
+                found.add(os.path.normpath(m))
+
+    return sorted(found)
+
+## output_path_for : Function(input_file_path,out_dir,root)
+##
+## Functionality:
+##     Returns the .py path for the input file. It is placed next to the
+##     input file, or inside [out_dir] when one is given, in the same
+##     folders the input file is in under [root]. So a/model.synergo and
+##     b/model.synergo never write the same file.
+
+def output_path_for(input_file_path:str, out_dir:str = None, root:str = None) -> str:
+    input_Path = Path(input_file_path)
+    basename = input_Path.name[:-len(input_Path.suffix)] if input_Path.suffix else input_Path.name
+    if not out_dir:
+        return str(input_Path.parent.joinpath(basename))
+
+    directory = Path(out_dir)
+    if root is not None:
+        relative = os.path.relpath(os.path.abspath(input_Path.parent), os.path.abspath(root))
+        if relative != os.curdir and not relative.startswith(os.pardir):
+            directory = directory.joinpath(relative)
+    return str(directory.joinpath(basename))
+
+## input_root : Function(inputs)
+##
+## Functionality:
+##     The deepest folder all the [inputs] are in, which output_path_for
+##     mirrors under the output folder
+
+def input_root(inputs) -> str:
+    return os.path.commonpath([os.path.dirname(os.path.abspath(x)) for x in inputs])
+
+## _caches, _stores : The ConversionCache and CheckpointStore of every
+##     worker process, by their options
+_caches = {}
+_stores = {}
+
+## _convert_one : Function(job)
+##     where job = (input_file_path, output_file_basename, cache_options, checkpoint_dir, profile_path,
+##                  collect_timeline)
+##           cache_options = (cache directory, size limit) or None
+##           checkpoint_dir = directory of the replay checkpoints or None
+##           profile_path = file the profile records are appended to or None
+##           collect_timeline = also collect the timeline metrics (see timeline.py)
+##
+## Functionality:
+##     Runs inside a worker process. Converts a single file and returns
+##     (input_file_path, status, message, metrics) where status is one of
+##     "ok", "structure" (StructureError) or "error" (anything else),
+##     so one bad model never aborts the batch. [metrics] are the timeline
+##     metrics, or None. The timeline needs the whole history replayed, so
+##     collecting it skips the cache and the checkpoints.
+
+def _convert_one(job):
+    input_file_path, output_file_basename, cache_options, checkpoint_dir, profile_path, collect_timeline = job
+    history = timeline.Timeline() if collect_timeline else None
+    try:
+        profiler = convert.Profiler(convert.profile_sink(profile_path)) if profile_path else None
+        lines_fn = lambda source: convert.Converter(profiler, history).iter_lines(source)
+        convert_fn = lambda source: convert.convert(source, profiler)
+        if collect_timeline:
+            cache_options = checkpoint_dir = None
+        if checkpoint_dir:
+            if checkpoint_dir not in _stores:
+                _stores[checkpoint_dir] = checkpoint.CheckpointStore(checkpoint_dir)
+            store = _stores[checkpoint_dir]
+            lines_fn = lambda source: checkpoint.iter_lines_incremental(source, store, profiler=profiler)
+            convert_fn = lambda source: checkpoint.convert_incremental(source, store, profiler=profiler)
+
+        if cache_options is None:
+            lines = lines_fn(input_file_path)
+        else:
+            if cache_options not in _caches:
+                _caches[cache_options] = cache.ConversionCache(*cache_options)
+            lines = cache.convert_cached(input_file_path, _caches[cache_options], convert_fn, profiler)
+        convert.write_output(lines, output_file_basename)
+    except convert.StructureError as e:
+        return (input_file_path, "structure", str(e), _metrics(history))
+    except Exception as e:
+        return (input_file_path, "error", "{0}: {1}".format(type(e).__name__, e), _metrics(history))
+
+    return (input_file_path, "ok", output_file_basename + ".py", _metrics(history))
+
+def _metrics(history):
+    return history.metrics() if history is not None and history.events else None
+
+## run : Function(patterns,out_dir,jobs,cache_options,checkpoint_dir,profile_path,timeline_path)
+##
+## Functionality:
+##     Converts all the files described by [patterns] on a pool of [jobs]
+##     worker processes (default: the number of cores), prints a line for
+##     every file and a summary at the end. Returns the exit status:
+##     0 when every file was converted, 1 otherwise.
+##     [cache_options] = (cache directory, size limit) turns on the
+##     conversion cache (see cache.py) and [checkpoint_dir] the incremental
+##     replay (see checkpoint.py). With [profile_path] every conversion
+##     appends its profile record there (see convert.Profiler). With
+##     [timeline_path] the timeline metrics of every file are written
+##     there as CSV, a row per file (see timeline.py).
+
+def run(patterns, out_dir:str = None, jobs:int = None, stream = sys.stdout, cache_options = None,
+        checkpoint_dir:str = None, profile_path:str = None, timeline_path:str = None) -> int:
+    inputs = collect_inputs(patterns)
+    if not inputs:
+        print("No .synergo files found.", file=stream)
+        return 1
+
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, len(inputs))
+    root = input_root(inputs)
+    work = [(x, output_path_for(x, out_dir, root), cache_options, checkpoint_dir, profile_path,
+             timeline_path is not None) for x in inputs]
+    for job in work:
+        os.makedirs(os.path.dirname(job[1]) or os.curdir, exist_ok=True)
+    rows = []
+
+    counts = {"ok": 0, "structure": 0, "error": 0}
+    if jobs == 1:
+        results = map(_convert_one, work)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        chunksize = max(1, len(work) // (jobs * 4))
+        results = executor.map(_convert_one, work, chunksize=chunksize)
+
+    try:
+        for input_file_path, status, message, metrics in results:
+            counts[status] += 1
+            if metrics is not None:
+                rows.append(dict(metrics, source=input_file_path, status=status))
+            label = {"ok": "OK", "structure": "StructureError", "error": "Error"}[status]
+            print("[{0}] {1}: {2}".format(label, input_file_path, message), file=stream)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if timeline_path is not None:
+        timeline.write_csv(rows, timeline_path)
+
+    print("", file=stream)
+    print("{0} files: {1} converted, {2} StructureError, {3} other errors".format(
+        len(inputs), counts["ok"], counts["structure"], counts["error"]), file=stream)
+
+    return 0 if counts["ok"] == len(inputs) else 1
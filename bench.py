@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Generate models of growing size (see generate.py) for a few shapes:
+#   a plain sequence, deeply nested decisions, many loops and a heavily
+#   edited history
+# - Time every phase of the conversion separately: parsing the XML,
+#   applying the events, building the elements and checking them,
+#   structuring (loops and meeting points) and building the code
+# - Check that every output is the expected program
+# - Print a table and, for every phase, the slope of log(time) against
+#   log(size): about 1 is linear, about 2 is quadratic
+
+import argparse
+import gc
+import json
+import math
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import convert
+import generate
+
+DEFAULT_SIZES = (250, 1000, 4000, 16000)
+PHASES = ("parse", "apply", "check", "structure", "build")
+
+## SHAPES : name -> (depth, loops per 1000 elements, churn)
+SHAPES = {
+    "flat": (0, 0, 0.0),
+    "nested": (40, 5, 0.0),
+    "loops": (4, 100, 0.0),
+    "churn": (4, 10, 2.0),
+}
+
+## _parse_only : Function(data)
+##
+## Functionality:
+##     Reads the history.xml of [data] with the same iterparse loop as
+##     Converter.replay, without applying the events
+
+def _parse_only(data:bytes):
+    with convert.open_history(data) as xml_f:
+        for ev, el in ET.iterparse(xml_f, events=("end",)):
+            if el.tag == "event":
+                el.findtext("action")
+                el.findtext("attribute")
+                el.clear()
+
+## time_phases : Function(data,expected)
+##
+## Functionality:
+##     Converts [data] once and returns {phase: seconds}. Raises
+##     AssertionError if the output is not [expected].
+
+def time_phases(data:bytes, expected:str = None) -> dict:
+    clock = time.perf_counter
+    times = {}
+
+    t = clock()
+    _parse_only(data)
+    times["parse"] = clock() - t
+
+    c = convert.Converter()
+    t = clock()
+    c.reset()
+    with convert.open_history(data) as xml_f:
+        c.replay(xml_f)
+    times["apply"] = max(0.0, clock() - t - times["parse"])
+
+    t = clock()
+    c.validate()
+    c.build_elements()
+    times["check"] = clock() - t
+
+    t = clock()
+    c.structure()
+    times["structure"] = clock() - t
+
+    t = clock()
+    text = "".join(c.build(c.first_el, c.last_el, 0))
+    times["build"] = clock() - t
+
+    if expected is not None and text != expected:
+        raise AssertionError("the output differs from the generated program")
+    return times
+
+## slope : Function(sizes,times)
+##
+## Functionality:
+##     The least squares slope of log(time) against log(size)
+
+def slope(sizes, times) -> float:
+    points = [(math.log(n), math.log(t)) for n, t in zip(sizes, times) if t > 0]
+    if len(points) < 2:
+        return float("nan")
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, _ in points)
+    return sum((x - mx) * (y - my) for x, y in points) / sxx if sxx else float("nan")
+
+## run : Function(sizes,shapes,repeat,seed)
+##
+## Functionality:
+##     Returns a list of result rows {shape, elements, events, bytes, phase
+##     times}, each time being the best of [repeat] runs
+
+def run(sizes = DEFAULT_SIZES, shapes = tuple(SHAPES), repeat:int = 3, seed:int = 0, stream = None):
+    rows = []
+    for shape in shapes:
+        depth, loops, churn = SHAPES[shape]
+        for n in sizes:
+            data, expected = generate.generate(n, depth, loops * n // 1000, churn, seed)
+
+            best = None
+            for _ in range(repeat):
+                gc.collect()
+                times = time_phases(data, expected)
+                best = times if best is None else {p: min(best[p], times[p]) for p in PHASES}
+
+            with convert.open_history(data) as xml_f:
+                events = sum(1 for _, el in ET.iterparse(xml_f) if el.tag == "event")
+            row = {"shape": shape, "elements": n, "events": events, "bytes": len(data)}
+            row.update(best)
+            rows.append(row)
+            if stream is not None:
+                print(_format_row(row), file=stream, flush=True)
+    return rows
+
+def _format_row(row) -> str:
+    return "{0:<8} {1:>8} {2:>9} ".format(row["shape"], row["elements"], row["events"]) + \
+        " ".join("{0:>9.4f}".format(row[p]) for p in PHASES)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every phase of the conversion on generated models.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="numbers of elements")
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per model, the best is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON lines")
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print("{0:<8} {1:>8} {2:>9} ".format("shape", "elements", "events") +
+              " ".join("{0:>9}".format(p) for p in PHASES))
+    rows = run(args.sizes, args.shapes, args.repeat, args.seed, None if args.json else sys.stdout)
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+        return 0
+
+    print("")
+    print("Scaling exponent (slope of log time / log elements):")
+    for shape in args.shapes:
+        shape_rows = [r for r in rows if r["shape"] == shape]
+        print("{0:<8} ".format(shape) + " ".join(
+            "{0}={1:.2f}".format(p, slope([r["elements"] for r in shape_rows], [r[p] for r in shape_rows]))
+            for p in PHASES))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Take a whole class as one archive (a .zip, or a .tar, .tar.gz, ...)
+#   of .synergo files, as the LMS exports it
+# - Read the .synergo members straight out of the archive in the order
+#   they are stored, without extracting anything to disk: every member is
+#   a zip itself and is converted from its bytes
+# - Convert the members on a process pool, at most a few per worker at a
+#   time, so a large class is never held in memory as a whole
+# - Write every generated .py file, and a manifest.json with the result
+#   of every member, into one output zip. The input archive is read once
+#   from start to end and the output archive is written once from start
+#   to end.
+#
+# The manifest looks like:
+#     {"source": "class.zip", "counts": {"ok": ..., "structure": ..., "error": ...},
+#      "files": [{"member": "a/b.synergo", "status": "ok", "output": "a/b.py", "message": ""}, ...]}
+
+import argparse
+import collections
+import json
+import os
+import sys
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cache
+import convert
+from batch import SYNERGO_SUFFIX
+
+MANIFEST_NAME = "manifest.json"
+
+## iter_members : Function(archive_path)
+##
+## Functionality:
+##     Generator of (member name, bytes) for every .synergo member of the
+##     zip or tar archive at [archive_path]. The zip members are read in
+##     the order of their offsets and the tar is read as a stream, so the
+##     file is read sequentially once.
+
+def iter_members(archive_path:str):
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path, "r") as zip_f:
+            infos = sorted(zip_f.infolist(), key=lambda x: x.header_offset)
+            for info in infos:
+                if not info.is_dir() and info.filename.endswith(SYNERGO_SUFFIX):
+                    yield info.filename, zip_f.read(info)
+        return
+
+    with tarfile.open(archive_path, "r|*") as tar_f:
+        for info in tar_f:
+            if info.isfile() and info.name.endswith(SYNERGO_SUFFIX):
+                yield info.name, tar_f.extractfile(info).read()
+
+## output_name_for : Function(member)
+##
+## Functionality:
+##     The name of the generated program of [member] inside the output
+##     archive: the same path with .py instead of .synergo
+
+def output_name_for(member:str) -> str:
+    return member[:-len(SYNERGO_SUFFIX)].lstrip("/") + ".py"
+
+## _caches : The ConversionCache of every worker process, by its options
+_caches = {}
+
+## _convert_member : Function(job)
+##     where job = (member name, bytes, cache_options)
+##
+## Functionality:
+##     Runs inside a worker process. Returns (member, status, text or
+##     message) where status is "ok", "structure" or "error", like
+##     batch._convert_one.
+
+def _convert_member(job):
+    member, data, cache_options = job
+    try:
+        if cache_options is None:
+            text = convert.convert(data)
+        else:
+            if cache_options not in _caches:
+                _caches[cache_options] = cache.ConversionCache(*cache_options)
+            text = cache.convert_cached(data, _caches[cache_options])
+    except convert.StructureError as e:
+        return (member, "structure", str(e))
+    except Exception as e:
+        return (member, "error", "{0}: {1}".format(type(e).__name__, e))
+    return (member, "ok", text)
+
+## run : Function(archive_path,output_path,jobs,stream,cache_options)
+##
+## Functionality:
+##     Converts every .synergo member of [archive_path] on [jobs] worker
+##     processes (default: the number of cores) and writes the programs and
+##     the manifest into the zip at [output_path]. The results are written
+##     in the order of the input archive, with at most 2 * [jobs] members
+##     read ahead. Prints a line for every member and a summary at the
+##     end. Returns 0 when every member was converted, 1 otherwise.
+
+def run(archive_path:str, output_path:str, jobs:int = None, stream = sys.stdout, cache_options = None) -> int:
+    jobs = jobs or os.cpu_count() or 1
+    counts = {"ok": 0, "structure": 0, "error": 0}
+    files = []
+
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    pending = collections.deque()
+
+    def write_result(out_f, result):
+        member, status, payload = result
+        entry = {"member": member, "status": status, "output": "", "message": ""}
+        if status == "ok":
+            entry["output"] = output_name_for(member)
+            out_f.writestr(entry["output"], payload.encode("utf-8"))
+        else:
+            entry["message"] = payload
+        files.append(entry)
+        counts[status] += 1
+        label = {"ok": "OK", "structure": "StructureError", "error": "Error"}[status]
+        print("[{0}] {1}: {2}".format(label, member, entry["output"] or payload), file=stream)
+
+    try:
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as out_f:
+            for member, data in iter_members(archive_path):
+                job = (member, data, cache_options)
+                if executor is None:
+                    write_result(out_f, _convert_member(job))
+                    continue
+                pending.append(executor.submit(_convert_member, job))
+                if len(pending) >= 2 * jobs:
+                    write_result(out_f, pending.popleft().result())
+            while pending:
+                write_result(out_f, pending.popleft().result())
+
+            manifest = {"source": os.path.basename(archive_path), "counts": counts, "files": files}
+            out_f.writestr(MANIFEST_NAME, json.dumps(manifest, indent=1).encode("utf-8"))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    print("", file=stream)
+    print("{0} files: {1} converted, {2} StructureError, {3} other errors".format(
+        len(files), counts["ok"], counts["structure"], counts["error"]), file=stream)
+    return 0 if files and counts["ok"] == len(files) else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert every model of a zip/tar archive into one output zip.")
+    parser.add_argument("archive", help=".zip or .tar(.gz, .bz2, .xz) of .synergo files")
+    parser.add_argument("output", help="output .zip with the .py files and " + MANIFEST_NAME)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+    return run(args.archive, args.output, args.jobs)
+
+if __name__ == "__main__":
+    sys.exit(main())
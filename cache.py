@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Hash the history.xml member of the model together with the converter
+#   version. The hash is the key of the conversion in the cache
+# - On a hit the stored Python text (or StructureError) is returned
+#   straight away, without any event replay, structuring or building
+# - On a miss the model is converted and the result is stored. The lines
+#   can be streamed into the entry while they are written out
+# - The cache directory has a size limit. When it is exceeded the entries
+#   which were used least recently are removed first (LRU)
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import convert
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+## STALE_SECONDS : A .tmp file not written to for this long was left by a
+##     writer which was killed, and is counted and evicted like an entry
+STALE_SECONDS = 3600
+
+## default_cache_dir : Function()
+##
+## Functionality:
+##     Returns $XDG_CACHE_HOME/synergo2python, or ~/.cache/synergo2python
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "synergo2python")
+
+## history_digest : Function(source)
+##     where source = path of the .synergo file, or its bytes
+##                    or an open binary file (see convert.open_history)
+##
+## Functionality:
+##     Returns the hex sha256 of the converter version and the bytes of the
+##     history.xml member. The member is streamed, never held in memory.
+
+def history_digest(source) -> str:
+    h = hashlib.sha256()
+    h.update(b"synergo2python\0" + convert.CONVERTER_VERSION.encode("ascii") + b"\0")
+
+    with convert.open_history(source) as xml_f:
+        for chunk in iter(lambda: xml_f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+    return h.hexdigest()
+
+## ConversionCache : An on-disk cache of conversions
+##     where directory = where the entries are stored, "~" is expanded
+##                       (default: default_cache_dir())
+##           max_bytes = the size limit of all the entries together
+##
+## Every entry is a file named after its key, <key>.py for a generated
+## program, <key>.pyc for its bytecode and <key>.err for a StructureError
+## (as JSON). The modification
+## time of a file is its last use, so the least recently used entries
+## are found by sorting on it.
+
+class ConversionCache:
+    def __init__(self, directory:str = None, max_bytes:int = DEFAULT_MAX_BYTES):
+        self.directory = os.path.expanduser(directory) if directory else default_cache_dir()
+        self.max_bytes = max_bytes
+        self._size = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key:str, suffix:str) -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    ## get : Function(key)
+    ##
+    ## Functionality:
+    ##     Returns the stored text, or raises the stored StructureError.
+    ##     Returns None when there is no entry for [key].
+
+    def get(self, key:str):
+        path = self._path(key, ".py")
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                text = f.read()
+        except FileNotFoundError:
+            pass
+        else:
+            self._touch(path)
+            return text
+
+        path = self._path(key, ".err")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                error = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        self._touch(path)
+        raise convert.StructureError.from_fields(error)
+
+    ## put : Function(key,result)
+    ##     where result = the generated text or a StructureError
+    ##
+    ## Functionality:
+    ##     Stores the entry atomically and evicts old entries if the cache
+    ##     became larger than [max_bytes]
+
+    def put(self, key:str, result):
+        if isinstance(result, convert.StructureError):
+            path = self._path(key, ".err")
+            data = json.dumps(result.fields())
+        else:
+            path = self._path(key, ".py")
+            data = result
+
+        self._write(path, data.encode("utf-8"))
+
+    ## put_lines : Function(key,lines)
+    ##
+    ## Functionality:
+    ##     Generator which yields every line of [lines] and writes it to the
+    ##     entry of [key] on the way, so a program is stored without joining
+    ##     its text. The entry is only stored once [lines] is exhausted, a
+    ##     failure or an unfinished iteration stores nothing.
+
+    def put_lines(self, key:str, lines):
+        path = self._path(key, ".py")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+                for line in lines:
+                    f.write(line)
+                    yield line
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self._commit(temp_path, path)
+
+    def _write(self, path:str, data:bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self._commit(temp_path, path)
+
+    ## _commit : Function(temp_path,path)
+    ##
+    ## Functionality:
+    ##     Moves the written [temp_path] over the entry at [path], keeps the
+    ##     size of the cache and evicts when it became too large
+
+    def _commit(self, temp_path:str, path:str):
+        size = os.path.getsize(temp_path)
+        ## The size of the entry being replaced, if any
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(temp_path, path)
+
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += size - replaced
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    ## get_code, put_code : Function(key), Function(key,data)
+    ##
+    ## Functionality:
+    ##     The same as get and put, for marshalled bytecode (see codegen.py).
+    ##     get_code returns the bytes, raises the stored StructureError or
+    ##     returns None.
+
+    def get_code(self, key:str):
+        path = self._path(key, ".pyc")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self.get(key)
+
+        self._touch(path)
+        return data
+
+    def put_code(self, key:str, data:bytes):
+        self._write(self._path(key, ".pyc"), data)
+
+    ## evict : Function()
+    ##
+    ## Functionality:
+    ##     Removes the least recently used entries until the cache fits in
+    ##     [max_bytes]. The directory is scanned again first, so entries
+    ##     written by other processes sharing the cache are counted too.
+
+    def evict(self):
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._size = 0
+
+    ## _entries : Function()
+    ##
+    ## Functionality:
+    ##     Returns (last use, size, path) for every entry of the cache, and
+    ##     for every stale .tmp file
+
+    def _entries(self):
+        entries = []
+        stale = time.time() - STALE_SECONDS
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                is_temp = entry.name.endswith(".tmp")
+                if is_temp or entry.name.endswith((".py", ".pyc", ".err")):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if is_temp and st.st_mtime > stale:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _touch(self, path:str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+## lookup : Function(source,cache,profiler)
+##
+## Functionality:
+##     Returns (key, stored text or None) of [source], or raises the stored
+##     StructureError. With a [profiler] (see convert.Profiler) a hit emits
+##     a record of its own, {"source": ..., "cache": "hit", "phases":
+##     {"lookup": ...}}, as the conversion it saves would have. On a miss
+##     the record is left open with "cache": "miss", and the conversion
+##     adds its own phases to it (see convert.Profiler.start).
+
+def lookup(source, cache:ConversionCache, profiler = None):
+    if profiler is None:
+        key = history_digest(source)
+        return key, cache.get(key)
+
+    profiler.start(source)
+    try:
+        with profiler.phase("lookup"):
+            key = history_digest(source)
+            text = cache.get(key)
+    except BaseException as e:
+        ## A cached StructureError is a hit too
+        if isinstance(e, convert.StructureError):
+            profiler.count(cache="hit")
+        profiler.fail(e)
+        raise
+
+    if text is not None:
+        profiler.count(cache="hit")
+        profiler.finish()
+    else:
+        profiler.count(cache="miss")
+    return key, text
+
+## convert_cached : Function(source,cache,convert_fn,profiler)
+##     where convert_fn = the conversion used on a miss (convert.convert by
+##                        default, e.g. checkpoint.convert_incremental)
+##           profiler = the Profiler of [convert_fn], if any (see lookup)
+##
+## Functionality:
+##     Same as convert.convert, but the result is looked up in [cache] first
+##     and stored there on a miss. Only StructureErrors are cached, any
+##     other failure (e.g. a broken archive) is raised every time.
+
+def convert_cached(source, cache:ConversionCache, convert_fn = convert.convert, profiler = None) -> str:
+    key, text = lookup(source, cache, profiler)
+    if text is not None:
+        return text
+
+    try:
+        text = convert_fn(source)
+    except convert.StructureError as e:
+        cache.put(key, e)
+        raise
+
+    cache.put(key, text)
+    return text
+
+## iter_lines_cached : Function(source,cache,lines_fn,profiler)
+##     where lines_fn = the conversion used on a miss (convert.iter_lines by
+##                      default, e.g. checkpoint.iter_lines_incremental)
+##           profiler = the Profiler of [lines_fn], if any (see lookup)
+##
+## Functionality:
+##     Same as convert.iter_lines, but looked up in [cache] first. On a hit
+##     the stored text is returned as the only line, on a miss the lines
+##     are written to the cache entry while they are read (see
+##     ConversionCache.put_lines), so the program is never joined.
+##     The lookup and the checks of the model happen before this returns,
+##     so a StructureError (cached like in convert_cached) is raised
+##     before any line is written.
+
+def iter_lines_cached(source, cache:ConversionCache, lines_fn = convert.iter_lines, profiler = None):
+    key, text = lookup(source, cache, profiler)
+    if text is not None:
+        return iter((text,))
+
+    try:
+        lines = lines_fn(source)
+    except convert.StructureError as e:
+        cache.put(key, e)
+        raise
+
+    return cache.put_lines(key, lines)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - history.xml is an append-only log of <event> elements. When a student
+#   saves again, the new history.xml starts with exactly the same bytes
+#   as the old one, up to the closing </events> tag
+# - After every replay a checkpoint is kept: the replay state, the last
+#   applied id_event, the length and sha256 of those leading bytes, and
+#   the bytes of the document header (everything up to <events>)
+# - Converting a newer version of the same file checks the hash of its
+#   leading bytes. If they match, the parser is given the header followed
+#   by the new bytes only, and just the new events are applied on top of
+#   the restored state
+# - If the earlier part changed (or the events are not in order) the
+#   history is replayed from the beginning
+
+import codecs
+import hashlib
+import marshal
+import os
+
+import convert
+
+CHECKPOINT_VERSION = 1
+CHUNK_SIZE = 64 * 1024
+
+## TAIL_SIZE : Bytes held back from the hash while streaming, so the
+##     closing </events> tag can still be found (and left out of the
+##     hash) when the end of the document is reached
+TAIL_SIZE = 4096
+
+## _encoding_of : Function(first_bytes)
+##
+## Functionality:
+##     Returns the codec of the document from its byte order mark
+##     (history.xml is written as UTF-16)
+
+def _encoding_of(first_bytes:bytes) -> str:
+    if first_bytes.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be"
+    if first_bytes.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le"
+    return "utf-8"
+
+## Checkpoint : The replay state of a history.xml and where it stopped
+##     where header = the bytes of the document up to and including <events>
+##           prefix_len = the number of bytes before </events>
+##           prefix_sha256 = the sha256 digest of those bytes
+##           last_id_event = the id_event of the last applied event
+##           state = the replay state (see Converter.snapshot)
+
+class Checkpoint:
+    def __init__(self, header:bytes, prefix_len:int, prefix_sha256:bytes, last_id_event, state):
+        self.header = header
+        self.prefix_len = prefix_len
+        self.prefix_sha256 = prefix_sha256
+        self.last_id_event = last_id_event
+        self.state = state
+
+    def dumps(self) -> bytes:
+        return marshal.dumps((CHECKPOINT_VERSION, convert.CONVERTER_VERSION, self.header,
+                              self.prefix_len, self.prefix_sha256, self.last_id_event, self.state))
+
+    ## loads : Function(data)
+    ##
+    ## Functionality:
+    ##     Returns the Checkpoint stored in [data], or None if it was made
+    ##     by another version of the converter or cannot be read
+
+    @classmethod
+    def loads(cls, data:bytes):
+        try:
+            version, converter_version, *fields = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+        if version != CHECKPOINT_VERSION or converter_version != convert.CONVERTER_VERSION:
+            return None
+        return cls(*fields)
+
+## CheckpointStore : Checkpoints on disk, one file per model
+##
+## The key of a model is any string which stays the same between its
+## versions, by default the absolute path of the .synergo file.
+
+class CheckpointStore:
+    def __init__(self, directory:str):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".ckpt")
+
+    def get(self, key:str):
+        try:
+            with open(self._path(key), "rb") as f:
+                return Checkpoint.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, key:str, checkpoint:Checkpoint):
+        path = self._path(key)
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(checkpoint.dumps())
+        os.replace(temp_path, path)
+
+## _ScanReader : A binary stream for the parser which also keeps the
+##               hash and the length of everything before </events>
+##     where stream = the history.xml member
+##           hasher = sha256 object of the bytes already consumed
+##           consumed = the number of bytes already consumed
+##           synthetic = bytes given to the parser first but which are
+##                       not part of [stream] (the header, when resuming)
+##           prefetched = bytes already read from [stream]
+
+class _ScanReader:
+    def __init__(self, stream, hasher, consumed:int, synthetic:bytes = b"", prefetched:bytes = b""):
+        self.stream = stream
+        self.hasher = hasher
+        self.consumed = consumed
+        self.synthetic = synthetic
+        self.pending = b""
+        self.prefetched = b""
+        if prefetched:
+            self._scan(prefetched)
+            self.prefetched = prefetched
+
+    def _scan(self, data:bytes):
+        self.consumed += len(data)
+        self.pending += data
+        if len(self.pending) > 2 * TAIL_SIZE:
+            self.hasher.update(self.pending[:-TAIL_SIZE])
+            self.pending = self.pending[-TAIL_SIZE:]
+
+    def read(self, size:int = -1) -> bytes:
+        if self.synthetic:
+            data, self.synthetic = self.synthetic, b""
+            return data
+        if self.prefetched:
+            data, self.prefetched = self.prefetched, b""
+            return data
+
+        data = self.stream.read(size)
+        self._scan(data)
+        return data
+
+    ## finish : Function(closing_tag)
+    ##
+    ## Functionality:
+    ##     Called once the stream is exhausted. Returns (prefix_len, digest)
+    ##     of the bytes before the last [closing_tag], or None if it was
+    ##     not found.
+
+    def finish(self, closing_tag:bytes):
+        index = self.pending.rfind(closing_tag)
+        if index < 0:
+            return None
+        self.hasher.update(self.pending[:index])
+        return self.consumed - len(self.pending) + index, self.hasher.digest()
+
+## replay : Function(converter,source,checkpoint)
+##     where converter = a convert.Converter
+##           checkpoint = the Checkpoint of an earlier version, or None
+##
+## Functionality:
+##     Leaves the replay state of [source] in [converter], resuming from
+##     [checkpoint] when its bytes are still the start of the history.
+##     Returns (new checkpoint or None, number of events applied, resumed)
+
+def replay(converter, source, checkpoint:Checkpoint = None):
+    if checkpoint is not None:
+        result = _resume(converter, source, checkpoint)
+        if result is not None:
+            return result
+
+    converter.reset()
+    with convert.open_history(source) as xml_f:
+        first = xml_f.read(CHUNK_SIZE)
+        encoding = _encoding_of(first)
+        reader = _ScanReader(xml_f, hashlib.sha256(), 0, prefetched=first)
+        converter.replay(reader)
+
+    ## The header ends after the <events> start tag
+    opening_tag = "<events>".encode(encoding)
+    index = first.find(opening_tag)
+    found = reader.finish("</events>".encode(encoding))
+    if index < 0 or found is None:
+        return None, converter.events_applied, False
+
+    header = first[:index + len(opening_tag)]
+    prefix_len, digest = found
+    new_checkpoint = Checkpoint(header, prefix_len, digest, converter.last_id_event, converter.snapshot())
+    return new_checkpoint, converter.events_applied, False
+
+## _resume : Function(converter,source,checkpoint)
+##
+## Functionality:
+##     The resuming part of replay. Returns None when the history does
+##     not start with the bytes of [checkpoint], so a full replay is needed.
+
+def _resume(converter, source, checkpoint:Checkpoint):
+    with convert.open_history(source) as xml_f:
+        hasher = hashlib.sha256()
+        left = checkpoint.prefix_len
+        while left > 0:
+            data = xml_f.read(min(left, CHUNK_SIZE))
+            if not data:
+                return None
+            hasher.update(data)
+            left -= len(data)
+
+        if hasher.digest() != checkpoint.prefix_sha256:
+            return None
+
+        converter.reset()
+        converter.restore(checkpoint.state)
+        encoding = _encoding_of(checkpoint.header)
+        reader = _ScanReader(xml_f, hasher, checkpoint.prefix_len, synthetic=checkpoint.header)
+        converter.replay(reader)
+
+    ## The events must continue after the checkpoint, otherwise the
+    ## history was not simply appended to
+    if converter.first_id_event is not None and checkpoint.last_id_event is not None \
+            and converter.first_id_event <= checkpoint.last_id_event:
+        return None
+
+    found = reader.finish("</events>".encode(encoding))
+    if found is None:
+        return None, converter.events_applied, True
+
+    prefix_len, digest = found
+    new_checkpoint = Checkpoint(checkpoint.header, prefix_len, digest, converter.last_id_event, converter.snapshot())
+    return new_checkpoint, converter.events_applied, True
+
+## source_key : Function(source)
+##
+## Functionality:
+##     The default checkpoint key of a source: its absolute path
+
+def source_key(source) -> str:
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.abspath(source)
+    raise ValueError("a checkpoint key is needed for sources which are not paths")
+
+## iter_lines_incremental, convert_incremental : Function(source,store,key,profiler)
+##
+## Functionality:
+##     Same as convert.iter_lines and convert.convert, but the replay resumes
+##     from the checkpoint of [key] in [store] (see replay) and a new
+##     checkpoint is stored.
+
+def iter_lines_incremental(source, store:CheckpointStore, key:str = None, profiler:convert.Profiler = None):
+    key = key or source_key(source)
+    converter = convert.Converter(profiler)
+
+    if profiler is None:
+        new_checkpoint, _, _ = replay(converter, source, store.get(key))
+    else:
+        profiler.start(source)
+        try:
+            with profiler.phase("replay"):
+                new_checkpoint, _, resumed = replay(converter, source, store.get(key))
+        except BaseException as e:
+            profiler.fail(e)
+            raise
+        profiler.count(resumed=resumed)
+    if new_checkpoint is not None:
+        store.put(key, new_checkpoint)
+
+    return converter.lines()
+
+def convert_incremental(source, store:CheckpointStore, key:str = None, profiler:convert.Profiler = None) -> str:
+    return "".join(iter_lines_incremental(source, store, key, profiler))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Build the program as a Python syntax tree (ast.Module) straight from
+#   the structured Elements, instead of as text: a Decision becomes an
+#   ast.If, a Loop an ast.While, and the text of every element is parsed
+#   on its own
+# - Text which is not valid Python raises a StructureError naming the
+#   element it was written in
+# - The line numbers are the lines of the text backend (build), so a
+#   traceback points at the same line as in the written .py file
+# - Compile the tree to a code object, ready for exec, and keep the
+#   marshalled bytecode in the conversion cache under the hash of the
+#   history.xml, so the same model is never built or compiled twice
+
+import ast
+import importlib.util
+import marshal
+
+import cache
+import convert
+from convert import Kind, StructureError
+
+## _parse : Function(text,mode,element_id)
+##
+## Functionality:
+##     Parses the text of an element, raising StructureError(5) for the
+##     element when it is not valid Python
+
+def _parse(text:str, mode:str, element_id):
+    try:
+        return ast.parse(text, mode=mode)
+    except SyntaxError as e:
+        raise StructureError(5, [element_id, e.msg, text.replace("\n", " / ")], [element_id])
+
+## _locate : Function(nodes,line)
+##
+## Functionality:
+##     Moves parsed [nodes], whose lines start at 1, to start at [line]
+
+def _locate(nodes, line:int):
+    for node in nodes:
+        ast.increment_lineno(node, line - 1)
+    return nodes
+
+## build_module : Function(converter)
+##     where converter = a Converter after structure() (see Converter.lines)
+##
+## Functionality:
+##     Returns the ast.Module of the program. Walks the Elements like
+##     Converter.build, with an explicit stack whose items are either
+##     (start,end,body) roads still to be built into the statement list
+##     [body], or a line count to skip (the "else:" lines of the text).
+##     An empty "if" or "while" body gets a "pass". An element reached
+##     again raises StructureError(8), as in Converter.build.
+
+def build_module(converter) -> ast.Module:
+    return _build(converter)[0]
+
+## _build : Function(converter)
+##
+## Functionality:
+##     build_module, also returning {first line: element id}
+
+def _build(converter):
+    Elements = converter.Elements
+    module = ast.Module(body=[], type_ignores=[])
+    blocks = []
+    line_elements = {}
+    written = set()
+    line = 1
+    stack = [(converter.first_el, converter.last_el, module.body)]
+
+    while stack:
+        item = stack.pop()
+        if type(item) is int:
+            line += item
+            continue
+
+        start, end, body = item
+        while True:
+            if start == converter.first_el:
+                start = Elements[converter.first_el].to
+            el = Elements[start]
+            kind = el.kind
+            if start == end or kind == Kind.START_END:
+                break
+            if kind != Kind.CONNECTOR:
+                if el.id in written:
+                    raise StructureError(8, [el.id], [el.id])
+                written.add(el.id)
+                line_elements[line] = el.id
+
+            if kind == Kind.LOOP:
+                test = _locate([_parse(el.text, "eval", el.id).body], line)[0]
+                node = ast.While(test=test, body=[], orelse=[], lineno=line, col_offset=0)
+                body.append(node)
+                blocks.append(node)
+                line += 1
+                stack.append((el.no,end,body))
+                stack.append((el.to,start,node.body))
+                break
+            elif kind == Kind.DECISION:
+                test = _locate([_parse(el.text, "eval", el.id).body], line)[0]
+                node = ast.If(test=test, body=[], orelse=[], lineno=line, col_offset=0)
+                body.append(node)
+                blocks.append(node)
+                line += 1
+                stack.append((el.meet,end,body))
+                if el.meet != el.no:
+                    stack.append((el.no,el.meet,node.orelse))
+                    stack.append(1)
+                stack.append((el.to,el.meet,node.body))
+                break
+            elif kind != Kind.CONNECTOR:
+                body.extend(_locate(_parse(el.text, "exec", el.id).body, line))
+                line += el.text.count("\n") + 1
+                start = el.to
+            else:
+                start = el.to
+
+    ## Inner blocks were made after outer ones, so they are done first
+    for node in reversed(blocks):
+        if not node.body:
+            node.body.append(ast.Pass(lineno=node.lineno, col_offset=0, end_lineno=node.lineno, end_col_offset=0))
+        node.end_lineno = max(x.end_lineno for x in node.body + node.orelse + [node.test])
+        node.end_col_offset = 0
+
+    return ast.fix_missing_locations(module), line_elements
+
+## compile_converter : Function(converter,filename)
+##
+## Functionality:
+##     Builds the module of a structured Converter and compiles it.
+##     Statements which are only wrong in their place (e.g. a "break"
+##     outside of a loop) are reported as StructureError(5) as well.
+
+def compile_converter(converter, filename:str = "<flowchart>"):
+    module, line_elements = _build(converter)
+    try:
+        return compile(module, filename, "exec")
+    except SyntaxError as e:
+        lines = [x for x in line_elements if x <= (e.lineno or 0)]
+        element_id = line_elements[max(lines)] if lines else "?"
+        raise StructureError(5, [element_id, e.msg, _element_text(converter, element_id)],
+                             [element_id] if lines else [])
+
+def _element_text(converter, element_id) -> str:
+    el = converter.Elements.get(element_id)
+    return el.text.replace("\n", " / ") if el is not None else ""
+
+## compile_flowchart : Function(source,filename)
+##     where source = path of the .synergo file, or its bytes
+##                    or an open binary file (see convert.open_history)
+##
+## Functionality:
+##     Converts the model to a code object, ready for exec()
+
+def compile_flowchart(source, filename:str = None):
+    c = convert.Converter()
+    c.reset()
+    with convert.open_history(source) as xml_f:
+        c.replay(xml_f)
+    c.lines()
+
+    if filename is None:
+        filename = str(source) if isinstance(source, str) else "<flowchart>"
+    return compile_converter(c, filename)
+
+## code_key : Function(source)
+##
+## Functionality:
+##     The cache key of the bytecode of [source]: the history digest
+##     together with the magic number of this Python, whose bytecode
+##     differs from other versions
+
+def code_key(source) -> str:
+    return cache.history_digest(source) + "-" + importlib.util.MAGIC_NUMBER.hex()
+
+## compile_cached : Function(source,conversion_cache,filename)
+##
+## Functionality:
+##     Same as compile_flowchart, but the marshalled bytecode is looked up
+##     in [conversion_cache] first and stored there on a miss, like
+##     cache.convert_cached does for the text
+
+def compile_cached(source, conversion_cache:cache.ConversionCache, filename:str = None):
+    key = code_key(source)
+
+    data = conversion_cache.get_code(key)
+    if data is not None:
+        return marshal.loads(data)
+
+    try:
+        code = compile_flowchart(source, filename)
+    except StructureError as e:
+        conversion_cache.put(key, e)
+        raise
+
+    conversion_cache.put_code(key, marshal.dumps(code))
+    return code
+
+## pyc_bytes : Function(code)
+##
+## Functionality:
+##     The contents of a .pyc file holding [code], which python and
+##     runpy.run_path can run without the source
+
+def pyc_bytes(code) -> bytes:
+    return importlib.util.MAGIC_NUMBER + bytes(12) + marshal.dumps(code)
@@ -4,86 +4,144 @@
 
 import xml.etree.ElementTree as ET
 import zipfile
+import io
 import os
-import tempfile
-import shutil
 import sys
 import re
-from pathlib import Path, PurePath
-
-# - Get the synergo file path
-# - Create a temporary directory where we will store the copied files
-# - Create a copy in .zip format
-# - Extract the contents of the zip file and read the contents of the history.xml file
+import argparse
+import functools
+import marshal
+import enum
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+
+# - Get the synergo file (a path, its bytes or an open binary file)
+# - Open it in place as a .zip archive, no copies are made on disk
+# - Stream the contents of the history.xml member straight into the parser
 # - Parse the content of the history.xml file using the xml.etree module
 # TODO support for do-while
 
-Args = sys.argv
-input_file_path = Args[1]
-input_file_name = Path(input_file_path).parts[-1]
-output_file_basename = Args[2] if len(Args)>2 else ".".join(input_file_name.split(".")[:-1])
-use_temp = Args[3] if len(Args)>3 else True
-
-def open_synergo_xml(filepath:str, use_temp:bool = True) -> str:
-    # Create the temp path
-    temp_path = ""
-    if use_temp:
-        temp_path = tempfile.mkdtemp()
-    else:
-        if "tmp00" not in os.listdir("./"):
-            os.mkdir("tmp00")
-        temp_path = "tmp00"
-        
-    print("Temp_path:", temp_path)
-    
-    file_Path = Path(filepath)
-    filename = file_Path.parts[-1]
-    
-    # Make copy in .zip format and place it in the temporary directory
-    zip_copy_path = PurePath(temp_path).joinpath(filename + ".zip")
-    shutil.copy2(filepath, zip_copy_path)
-
-    # Extract contents of history.xml file in the temporary directory
-    zip_f = zipfile.ZipFile(zip_copy_path, "r")
-    zip_contents_filenames = zip_f.namelist()
-    xml_filename = [x for x in zip_contents_filenames if "xml" in x.split(".")][0]
-    zip_f.extract(xml_filename, temp_path)
-    zip_f.close()
-    
-    # Read xml file contents
-    xml_file_temppath = PurePath(temp_path).joinpath(xml_filename)
-    xml_fileIO = open(xml_file_temppath, "r", encoding="utf16")
-    xml_file_text = xml_fileIO.read()
-    xml_fileIO.close()
-    xml_file_parsed = ET.fromstring(xml_file_text)
-
-    ## - Remove the contents of the temporary directory so it can be deleted
-    ## - Delete the temporary directory
-    os.unlink(zip_copy_path)
-    os.unlink(xml_file_temppath)
-    os.rmdir(temp_path)  
-    
-    return xml_file_parsed
+## CONVERTER_VERSION : Part of the key of every cached conversion (see cache.py).
+##     Change it whenever the generated text, or the StructureError, of a
+##     model may change.
+CONVERTER_VERSION = "6"
+
+## open_history : Function(source)
+##     where source = path of the .synergo file, its contents as bytes
+##                    or a seekable binary file-like object
+##
+## Functionality:
+##     Context manager which opens the archive in place and yields the
+##     history.xml member as a binary stream. Nothing is extracted or
+##     copied to disk, and callers that already hold the file in memory
+##     never touch the filesystem.
+
+@contextmanager
+def open_history(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with zipfile.ZipFile(source, "r") as zip_f:
+        zip_contents_filenames = zip_f.namelist()
+        xml_filename = [x for x in zip_contents_filenames if "xml" in x.split(".")][0]
+        with zip_f.open(xml_filename, "r") as xml_f:
+            yield xml_f
+
+## open_synergo_xml : Function(source)
+##
+## Functionality:
+##     Returns the parsed history.xml document of the [source] (see open_history).
+##     The history.xml starts with a UTF-16 byte order mark, so the bytes
+##     are handed to the parser undecoded.
+
+def open_synergo_xml(source) -> ET.Element:
+    with open_history(source) as xml_f:
+        return ET.parse(xml_f).getroot()
 
-doc = open_synergo_xml(input_file_path)
+## iter_events : Function(xml_f)
+##     where xml_f = binary stream of the history.xml document
+##
+## Functionality:
+##     Streams the document with iterparse and yields every <event>
+##     element as soon as it has been read. The event is dropped from the
+##     tree once the caller is done with it, so the whole history is never
+##     held in memory.
+
+def iter_events(xml_f):
+    events_el = None
+    for ev, el in ET.iterparse(xml_f, events=("start", "end")):
+        if ev == "start":
+            if el.tag == "events":
+                events_el = el
+        elif el.tag == "event":
+            yield el
+            el.clear()
+            if events_el is not None:
+                events_el.clear()
 
 ## Errors Interface
 class StructureError(BaseException):
     Errors = [
         "There is no {0} element.",
         "There are more than 1 {0} elements.\nId's: {1}",
-        "Decision ({0}) misses a Yes/No connection.",
+        "Decision ({0}) does not have exactly one Yes and one No connection.",
         "{0} Element is of not type 'Start-End'",
-        "Element ({0}) is connected to more than 1 Elements but is not of type 'Decision'."
+        "Element ({0}) is connected to more than 1 Elements but is not of type 'Decision'.",
+        "Element ({0}) is not valid Python: {1}\n    {2}",
+        "Elements ({0}) never reach the ending element, as in a loop without a 'Decision'.",
+        "The loop back to element ({0}) has no 'Decision' whose 'No' road leaves it.",
+        "Element ({0}) is reached again, a loop must start with its 'Decision' (do-while loops are not supported).",
+        "The connection from element ({0}) leads to element ({1}), which was deleted."
     ]
     
-    def __init__(self,erid, obj):
+    def __init__(self,erid, obj, elements = None):
         self.er_id = erid
         self.format = obj
+        self.elements = list(elements) if elements is not None else []
 
     def __str__(self):
         return self.Errors[self.er_id].format(*self.format)
-    
+
+    ## fields, from_fields : Function(), Function(fields)
+    ##
+    ## Functionality:
+    ##     The error as a dict which can be written as JSON (by cache.py
+    ##     and serve.py), and the error back from such a dict
+
+    def fields(self) -> dict:
+        return {"er_id": self.er_id, "format": list(self.format), "elements": self.elements}
+
+    @staticmethod
+    def from_fields(fields):
+        if "errors" in fields:
+            return StructureErrors([StructureError.from_fields(x) for x in fields["errors"]])
+        return StructureError(fields["er_id"], fields["format"], fields.get("elements"))
+
+## StructureErrors : Every StructureError of a model, found by
+##                   Converter.validate
+##     where errors = list of StructureError, each with the ids of the
+##                    elements it is about in [elements]
+##
+## It is a StructureError itself, whose er_id and format are those of
+## the first error, so code which handles a single StructureError keeps
+## working. Its message has one line (or more) per error.
+
+class StructureErrors(StructureError):
+    def __init__(self, errors):
+        super().__init__(errors[0].er_id, errors[0].format, errors[0].elements)
+        self.errors = list(errors)
+
+    def __str__(self):
+        return "\n".join(str(x) for x in self.errors)
+
+    def fields(self) -> dict:
+        fields = super().fields()
+        fields["errors"] = [x.fields() for x in self.errors]
+        return fields
+
 ## affirmative : list containing all the possible
 ##               [Yes-Like] inputs the user can give
 ##
@@ -115,16 +173,19 @@ class StructureError(BaseException):
 ##              where :
 ##                  id = [connector id]
 ##                  to = [connector destination]
+##
+## incoming : The reverse of sxeseis, kept in step with connectors
+##      where :
+##          key = [element id]
+##          value = Structure containing {id:from} pairs
+##              where :
+##                  id = [connector id]
+##                  from = [connector root]
 
 
 affirmative = ["Yes","YES","yes","YeS","YEs","yeS","yES","NAI",u'\u039d\u0391\u0399']
 negative = ["No","NO","no","nO","OXI",u'\u039f\u03a7\u0399']
 
-elements = {}
-contents = {}
-connectors = {}
-sxeseis = {}
-
 ## Iterate through all <event> elements in the .xml file
 ## Each <event> element contains sub-elements which describe
 ## every kind of action concerning it
@@ -166,9 +227,6 @@ sxeseis = {}
 ##      of actions are done and it finally builds a Elements structure which contains
 ##      every element, which is present at the final form of the diagram, and their properties.
 
-ev = doc.find("events")
-events = ev.findall("event")
-
 def get_cont(string,a,b):
     in_a = string.find(a)
     in_b = string.find(b)
@@ -183,230 +241,55 @@ def is_note(str):
 def is_text(str):
     return str.find("text_")>-1
 
-def get_attr_elid(attr_str):
-    regx = re.compile(r'\((\d+)\)')
-    findall = regx.findall(attr_str)
-    
-    return findall[0]
-
-def get_attr_text(attr_str):
-    start_index = re.search(r',\s', attr_str).end()
-    end_index = re.search(r',\s(\(x=\d+,y=\d+,w=\d+,h=\d+\)\]$)', attr_str).start()
-    
-    return attr_str[start_index:end_index]
-
-for i in events:
-    action = i.findtext("action")
-    attr_str = i.findtext("attribute")
-    atr = attr_str.strip("[]").rsplit(",")
-     
-    if action == "Insert Entity":
-        kind = atr[0]
-        idd = int(atr[len(atr)-1].lstrip())
-        elements[idd] = [idd,kind] 
-    elif action == "Change Concept Entity text":
-        idd = int(get_cont(atr[0],"(",")"))
-        contents[idd] = get_attr_text(attr_str)  
-    elif action == "Change Concept Relationship text":
-        connector_id = get_id(atr[0])
-        text = atr[1].lstrip()
-        if len((connectors)[connector_id])==3:
-            connectors[connector_id][2] = text
-        else:
-            connectors[connector_id].append(text)       
-    elif action == "Insert Concept Relationship":
-        connector_id = get_id(atr[1])
-        first = get_id(atr[5])
-        last = get_id(atr[6])
-        connectors[connector_id] = [first,last]
-        if first not in sxeseis:
-            sxeseis[first] = {connector_id:last}
-        else:
-            sxeseis[first][connector_id]=last       
-    elif action == "Concept arrow added":
-        con_id = get_id(atr[0])
-        root_id = connectors[con_id][0]
-        dest_id = get_id(atr[1])
-        connectors[con_id][1] = dest_id
-        sxeseis[root_id][con_id] = dest_id
-    elif action == "Concept link added":
-        con_id = get_id(atr[0])
-        prev_root = connectors[con_id][0]
-        new_root = get_id(atr[1])
-
-        if len(sxeseis[prev_root])==1:
-            del sxeseis[prev_root]
-        else:
-            del sxeseis[prev_root][con_id]
-
-        if new_root not in sxeseis:
-            sxeseis[new_root] = {}
-        sxeseis[new_root][con_id] = connectors[con_id][1]
-        connectors[con_id][0] = new_root               
-    elif action == "Delete objects":
-        conn_ids = []
-        els = []
-
-        for x in range(len(atr)):
-            obj = atr[x]
-            is_conn = atr[x].find("qualitative") > -1
-            is_t = is_text(atr[x])
-            is_n = is_note(atr[x])
-            if is_conn:
-                conn_ids.append(get_id(atr[x]))
-            elif not (is_n or is_t):
-                els.append(get_id(atr[x]))
-            
-        for x in conn_ids:
-            if x in connectors:
-                fir = connectors[x][0]
-                las = connectors[x][1]
-
-                del connectors[x]
-                
-                del sxeseis[fir][x]
-
-                if len(sxeseis[fir].values()) == 0:
-                    del sxeseis[fir]
-
-        for x in els:
-            if x in contents:
-                del contents[x]
-            
-            if x in sxeseis:
-                del sxeseis[x]
-
-            del elements[x]               
-    elif action == "Delete object":
-        is_con = atr[0].find("qualitative")
-        is_n = is_note(atr[0])
-        is_t = is_text(atr[0])
-
-        if not (is_n or is_t):
-            id = get_id(atr[0])
-            if is_con > -1:
-                el = connectors[id][0]
-                del connectors[id]
-                del sxeseis[el][id]
-            else:
-                if id in contents:
-                    del contents[id]
-
-                if id in sxeseis:
-                    del sxeseis[id]
-                del elements[id]
-
-Elements = {}
-for x in elements:
-    if x in contents:
-        elements[x].append(contents[x])
-    else:
-        elements[x].append("")
-
-## - Build the basic Element structure ##
-for x in elements:
-    el = elements[x]
-    Elements[x] = {}
-    Elements[x]["id"] = el[0]
-    Elements[x]["kind"] = el[1]
-    Elements[x]["text"] = el[2]
-    Elements[x]["To"] = []
-    
-# for x, y in Elements.items():
-#     print(x, y)
-##===========================================##
-
-## - Append the next element to the 'To'
-##  attribute and find Yes/No Roads
-for x in sxeseis:
-    el = Elements[x]
-    r = sxeseis[x]
-    kind = el["kind"]
-
-    if kind == "Decision":
-        el["To"] = {}
-        for y in r:
-            try:
-                con_text = connectors[y][2]
-                if con_text == "":
-                    raise StructureError(2,[x])
-            except:
-                raise StructureError(2,[x])
-            is_negative = con_text in negative
-            if not is_negative:
-                el["To"]["Yes"] = r[y]
-            else:
-                el["To"]["No"] = r[y]
-    else:
-        el["To"] = list(r.values())[0]
-##================================================##
-
-## - Find first element ##
-first_el = [];
-
-for x in Elements:
-    el = Elements[x]
-    is_first = True
-    for y in connectors:
-        if connectors[y][1] == x:
-            is_first = False
-            break
-
-    if is_first:
-        first_el.append(x);
-
-if len(first_el)>1:
-    if Elements[first_el[0]]["kind"] != "Start-End":
-        raise StructureError(3,["Starting"])
-    
-    str_first_el = [str(x) for x in first_el]
-    raise StructureError(1,["starting",",".join(str_first_el)])
-elif len(first_el)==0:
-    raise StructureError(0,["starting"]);
-
-first_el = first_el[0]
-
-if Elements[first_el]["kind"] != "Start-End":
-    raise StructureError(3,["Starting"])
-
-##===================================##
-
-## - Find last element ##
-last_el = [x for x in Elements if x not in sxeseis]
-
-if len(last_el)>1:
-    if Elements[last_el[0]]["kind"] != "Start-End":
-        raise StructureError(3,["Ending"])
-    str_last_el = [str(x) for x in last_el]
-    raise StructureError(1,["ending",",".join(str_last_el)])
-elif len(last_el)==0:
-    raise StructureError(0,["ending"])
-
-last_el = last_el[0]
-
-## Add this to avoid confusion in further functions
-Elements[last_el]["To"] = last_el;
-
-if Elements[last_el]["kind"] != "Start-End":
-    raise StructureError(3,["Ending"])
-##====================================##
-
+## The <attribute> formats, compiled once
+##
+##     _ENTITY : [Kind, (x=,y=,w=,h=), Kind (id), id]
+##               -> kind, id
+##     _TEXT : [Kind (id), text, (x=,y=,w=,h=)] or [qualitative (id), text, (x=,y=,w=,h=)]
+##             -> id, text. The text is everything between the object and
+##                the trailing geometry, commas and new lines included
+##     _RELATIONSHIP : [qualitative, qualitative (id), (x=,y=), id, Kind (from), Kind (to)]
+##                     -> id, from, to
+##     _PAIR : [qualitative (id), Kind (id)]
+##             -> connector id, element id
+##     _OBJECT : Kind (id), one object of a Delete object(s) list
+##               -> name, id
+
+_ELID = re.compile(r'\((\d+)\)')
+_ENTITY = re.compile(r'\[([^,]*),.*, *(\d+)\]$', re.S)
+_TEXT = re.compile(r'\[[^,]*?\((\d+)\), (.*), \(x=-?\d+,y=-?\d+,w=-?\d+,h=-?\d+\)\]$', re.S)
+_RELATIONSHIP = re.compile(r'\[[^,]*, [^,]*?\((\d+)\), \([^)]*\), *\d+, [^,]*?\((\d+)\), [^,]*?\((\d+)\)\]$')
+_PAIR = re.compile(r'\[[^,]*?\((\d+)\), [^,]*?\((\d+)\)\]$')
+_OBJECT = re.compile(r'\s*([^(,\[]*?)\s*\((\d+)\)')
+
+## _match : Function(pattern,action,attr_str)
+##
+## Functionality:
+##     Returns the match of [pattern] on the whole [attr_str], or raises
+##     ValueError naming the event which could not be read
 
-## Check for proper connections
-for x in Elements:
-    if Elements[x]["kind"]!="Decision" and x in sxeseis and len(sxeseis[x]) > 1:
-        raise StructureError(4,[x]);
+def _match(pattern, action:str, attr_str:str):
+    m = pattern.match(attr_str)
+    if m is None:
+        raise ValueError("Cannot read the attribute of a '{0}' event: {1}".format(action, attr_str))
+    return m
 
+def get_attr_elid(attr_str):
+    return _ELID.findall(attr_str)[0]
 
-## previous,key_of,_print : Unused until now
-def previous(index):
-    roots = []
+def get_attr_text(attr_str):
+    return _match(_TEXT, "Change Concept Entity text", attr_str).group(2)
 
-    for x in Elements:
-        if Elements[x]["To"] == index:
-            roots.append(x)
+## indent : Function(levels)
+##     where levels = depth level
+##
+## Functionality:
+##     Returns a number of tabs equals the number of levels.
+##     Every prefix is made once and then reused for every line.
 
-    return roots
+@functools.lru_cache(maxsize=None)
+def indent(levels):
+    return "\t"*levels
 
 def key_of(value,dic):
     for x in dic:
@@ -416,264 +299,1098 @@ def key_of(value,dic):
 def _print(obj):
     for x in obj:
         print(x," : ",obj[x])
-##
 
-## gen_skip : Function(index)
-##     where index argument is the Element Id
+## dominators : Function(entry,succ)
+##     where entry = the element every road starts from
+##           succ = {element id: [next element ids]}
 ##
 ## Functionality:
-##     It goes through all the elements after the element given
-##     until it finds a decision element where it stops
+##     Iterative dominator algorithm of Cooper, Harvey and Kennedy.
+##     Returns (idom, rpo) where idom = {element id: immediate dominator}
+##     for every element reachable from [entry] (idom[entry] = entry) and
+##     rpo = those elements in reverse post-order.
+##     Called with the predecessors and the last element instead, it
+##     gives the immediate post-dominators.
+
+def dominators(entry, succ):
+    postorder = []
+    visited = {entry}
+    stack = [(entry, iter(succ[entry]))]
+    while stack:
+        node, it = stack[-1]
+        for y in it:
+            if y not in visited:
+                visited.add(y)
+                stack.append((y, iter(succ[y])))
+                break
+        else:
+            stack.pop()
+            postorder.append(node)
+
+    rpo = postorder[::-1]
+    order = {x:i for i, x in enumerate(rpo)}
+    pred = {x:[] for x in rpo}
+    for x in rpo:
+        for y in succ[x]:
+            pred[y].append(x)
+
+    idom = {entry:entry}
+    changed = True
+    while changed:
+        changed = False
+        for x in rpo[1:]:
+            new_idom = None
+            for p in pred[x]:
+                if p not in idom:
+                    continue
+                if new_idom is None:
+                    new_idom = p
+                    continue
+                ## intersect
+                a, b = p, new_idom
+                while a != b:
+                    while order[a] > order[b]:
+                        a = idom[a]
+                    while order[b] > order[a]:
+                        b = idom[b]
+                new_idom = a
+            if idom.get(x) != new_idom:
+                idom[x] = new_idom
+                changed = True
+
+    return idom, rpo
+
+## DominatorTree : The tree made by an idom structure (see dominators)
+##
+## Every element gets an entry and an exit number from a walk of the tree,
+## so dominates(a,b) is answered in constant time.
+
+class DominatorTree:
+    def __init__(self, idom):
+        children = {x:[] for x in idom}
+        root = None
+        for x in idom:
+            if idom[x] == x:
+                root = x
+            else:
+                children[idom[x]].append(x)
+
+        self.enter = {}
+        self.exit = {}
+        clock = 0
+        stack = [(root, False)]
+        while stack:
+            x, done = stack.pop()
+            if done:
+                self.exit[x] = clock
+            else:
+                self.enter[x] = clock
+                stack.append((x, True))
+                stack.extend((y, False) for y in children[x])
+            clock += 1
+
+    def dominates(self, a, b):
+        return self.enter[a] <= self.enter[b] and self.exit[b] <= self.exit[a]
+
+## Kind : The kind of a node of the final structure, as a small integer
+##     START_END = the starting and the ending element
+##     DECISION = an "If"
+##     LOOP = a Decision found to be the condition of a "While" (see structure)
+##     CONNECTOR = an element which only joins roads, it writes nothing
+##     STATEMENT = every other element (Process, Alternate process, ...),
+##                 its text is written as it is
+
+class Kind(enum.IntEnum):
+    START_END = 0
+    DECISION = 1
+    LOOP = 2
+    CONNECTOR = 3
+    STATEMENT = 4
+
+## KINDS : Synergo element kind -> Kind
+KINDS = {"Start-End": Kind.START_END, "Decision": Kind.DECISION, "Connector": Kind.CONNECTOR}
+
+## Node : An element of the final structure
+##     where id = [element id]
+##           kind = the Kind of the element
+##           text = [element content]
+##           to = the next element id, the Yes road of a Decision/Loop
+##           no = the No road of a Decision/Loop, None otherwise
+##           meet = the meeting point of a Decision (see structure)
+##
+## The last element has itself as [to]. A road which is missing is None.
+
+class Node:
+    __slots__ = ("id", "kind", "text", "to", "no", "meet")
+
+    def __init__(self, idd, kind:Kind, text:str = ""):
+        self.id = idd
+        self.kind = kind
+        self.text = text
+        self.to = None
+        self.no = None
+        self.meet = None
+
+    def __repr__(self):
+        return "Node({0}, {1}, {2!r}, to={3}, no={4}, meet={5})".format(
+            self.id, self.kind.name, self.text, self.to, self.no, self.meet)
+
+## Profiler : Records what every phase of a conversion costs
+##     where sink = where the records go: a callable taking the record
+##                  (a dict), or a text stream which gets one JSON line
+##                  per conversion
+##           memory = also record the peak allocations of every phase
+##                    with tracemalloc (which slows the conversion down)
+##
+## A record looks like:
+##     {"source": ..., "events": ..., "nodes": ..., "edges": ..., "lines": ...,
+##      "phases": {"open": {"seconds": ..., "peak_bytes": ...}, "replay": ...,
+##                 "elements": ..., "structure": ..., "build": ...}}
+##
+## A conversion which failed also has "error", one whose lines were not
+## all read "stopped": true. The record is emitted either way. Through the
+## cache (see cache.lookup) it also has "cache": "hit" or "miss" and a
+## "lookup" phase.
+##
+## peak_bytes is the highest memory allocated during the phase above what
+## was allocated when it started. tracemalloc traces the whole process, so
+## peak_bytes is only meaningful with one conversion at a time. A Converter
+## without a Profiler only checks for one once per phase.
+
+class Profiler:
+    def __init__(self, sink = sys.stderr, memory:bool = True):
+        self.sink = sink
+        self.memory = memory
+        self.record = None
+        self._started_tracing = False
+
+    ## start : Function(source)
+    ##
+    ## Functionality:
+    ##     Opens the record of [source]. A record already open for the same
+    ##     source is kept, so the conversion after a cache miss adds its
+    ##     phases to the record of the lookup (see cache.lookup).
+
+    def start(self, source):
+        if isinstance(source, (str, os.PathLike)):
+            name = os.fspath(source)
+        else:
+            name = "<{0}>".format(type(source).__name__)
+        if self.record is not None and self.record["source"] == name:
+            return
+        self.record = {"source": name, "phases": {}}
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def phase(self, name:str):
+        base = 0
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self.record["phases"].setdefault(name, {"seconds": 0.0})
+            stats["seconds"] += time.perf_counter() - t
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                stats["peak_bytes"] = max(stats.get("peak_bytes", 0), peak)
+
+    def count(self, **counts):
+        self.record.update(counts)
+
+    ## timed : Function(lines)
+    ##
+    ## Functionality:
+    ##     Passes the generated [lines] through, adding the time spent
+    ##     making them to the "build" phase, and emits the record once
+    ##     they are exhausted
+
+    def timed(self, lines):
+        count = 0
+        try:
+            while True:
+                with self.phase("build"):
+                    line = next(lines, None)
+                if line is None:
+                    break
+                count += 1
+                yield line
+        except GeneratorExit:
+            self.count(stopped=True)
+            raise
+        except BaseException as e:
+            self.count(error=error_text(e))
+            raise
+        finally:
+            self.count(lines=count)
+            self.finish()
+
+    ## fail : Function(e)
+    ##
+    ## Functionality:
+    ##     Records the error [e] and emits the record, for a conversion
+    ##     which stops before its lines are built
+
+    def fail(self, e:BaseException):
+        self.count(error=error_text(e))
+        self.finish()
+
+    def finish(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        record, self.record = self.record, None
+        if record is None:
+            return
+        if callable(self.sink):
+            self.sink(record)
+        else:
+            self.sink.write(json.dumps(record) + "\n")
+            self.sink.flush()
+
+## error_text : Function(e)
 ##
-##     It returns a list with all the elements passed through (trace)
-        
-def gen_skip(index):
-    el = Elements[index]
-    kind = el["kind"]
-    if kind=="Decision" or kind=="Loop":
-        return [index]
-    tr = []
-    next = Elements[el["To"]]
+## Functionality:
+##     The text of [e] in a profile record: the message of a
+##     StructureError, "<type>: <message>" for anything else
+
+def error_text(e:BaseException) -> str:
+    if isinstance(e, StructureError):
+        return str(e)
+    return "{0}: {1}".format(type(e).__name__, e)
 
-    while next["kind"]!="Decision" and next["kind"]!="Loop" and next["id"]!=last_el:
-        tr.append(next["id"])
-        next = Elements[next["To"]]
+## profile_sink : Function(path)
+##
+## Functionality:
+##     Returns a Profiler sink which appends every record as a JSON line
+##     to the file at [path] ("-" for stderr). The file is opened for each
+##     record, so the worker processes of a batch can share it.
 
-    tr.append(next["id"])
-    return tr
+def profile_sink(path:str):
+    if path == "-":
+        return sys.stderr
 
-##=======================================================================##
+    def append(record):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return append
 
-## been : Structure consisting of {key:value} pairs
-##     where key = [The Decision Element Id]
-##     and value = True: [If element has been marked(met) before]
-##                 False: [If not ^^]
+## Converter : The conversion of a single model
 ##
-## levels : Structure consisting of {key:value} pairs
-##     where key = [The level of depth inside the tree]
-##     and value = [A list with all the Decision Elements inside that level]
+## Every structure used during the conversion lives on the object
+## instead of the module, so any number of conversions can run one
+## after the other or at the same time (one Converter per thread).
 ##
-## decisions : List consisting of all the Decision Elements ("Loops" and "If")
+## Attributes:
+##     elements, contents, connectors, sxeseis, incoming : See above
 ##
-## indent : Function(levels)
-##     where levels = depth level
+##     first_id_event, last_id_event : The id_event of the first and the
+##                                     last event applied by replay
 ##
-## Functionality:
-##     Returns a number of tabs equals the number of levels
+##     events_applied : The number of events applied by replay
 ##
-## find_level : Function(index)
-##     where index = Element Id
+##     Elements : The final structure built from the above,
+##                {element id: Node}, see build_elements
 ##
-## Functionality:
-##     Returns the level of the Decision Element
-##     defined by the [index] argument
+##     first_el, last_el : The starting and ending element ids
+##
+##     profiler : A Profiler, or None (see Profiler)
+##
+##     timeline : A timeline.Timeline which replay hands every event to,
+##                or None
+
+class Converter:
+    def __init__(self, profiler:Profiler = None, timeline = None):
+        self.profiler = profiler
+        self.timeline = timeline
+        self.reset()
+
+    def reset(self):
+        if self.timeline is not None:
+            self.timeline.reset()
+        self.elements = {}
+        self.contents = {}
+        self.connectors = {}
+        self.sxeseis = {}
+        self.incoming = {}
+        self.last_id_event = None
+        self.first_id_event = None
+        self.events_applied = 0
+        self.Elements = {}
+        self.first_el = None
+        self.last_el = None
+
+    ## snapshot, restore : The replay state
+    ##
+    ## Functionality:
+    ##     snapshot returns a deep copy of the elements, contents, connectors,
+    ##     sxeseis and incoming structures and the last applied id_event,
+    ##     which restore puts back later (see checkpoint.py).
+
+    def snapshot(self):
+        state = (self.elements, self.contents, self.connectors, self.sxeseis, self.incoming, self.last_id_event)
+        return marshal.loads(marshal.dumps(state))
+
+    def restore(self, state):
+        state = marshal.loads(marshal.dumps(state))
+        self.elements, self.contents, self.connectors, self.sxeseis, self.incoming, self.last_id_event = state
+
+    ## apply_event : Function(action,attr_str)
+    ##     where action = the text of the <action> element
+    ##           attr_str = the text of the <attribute> element
+    ##
+    ## Functionality:
+    ##     Applies a single <event> to the elements, contents,
+    ##     connectors and sxeseis structures, with the handler of its
+    ##     action in HANDLERS. Other actions (moving, resizing, ...)
+    ##     change nothing and their attribute is never read.
+
+    def apply_event(self, action:str, attr_str:str):
+        handler = self.HANDLERS.get(action)
+        if handler is not None:
+            handler(self, attr_str)
+
+    ## The handlers : Function(attr_str)
+    ##
+    ## Functionality:
+    ##     Each one reads the attribute of its action with one of the
+    ##     patterns above and applies it
+
+    def _insert_entity(self, attr_str):
+        kind, idd = _match(_ENTITY, "Insert Entity", attr_str).groups()
+        idd = int(idd)
+        self.elements[idd] = [idd,kind]
+
+    def _change_entity_text(self, attr_str):
+        idd, text = _match(_TEXT, "Change Concept Entity text", attr_str).groups()
+        self.contents[int(idd)] = text
+
+    def _change_relationship_text(self, attr_str):
+        connector_id, text = _match(_TEXT, "Change Concept Relationship text", attr_str).groups()
+        connector_id = int(connector_id)
+        if len((self.connectors)[connector_id])==3:
+            self.connectors[connector_id][2] = text
+        else:
+            self.connectors[connector_id].append(text)
+
+    def _insert_relationship(self, attr_str):
+        connector_id, first, last = map(int, _match(_RELATIONSHIP, "Insert Concept Relationship", attr_str).groups())
+        if connector_id in self.connectors:
+            self._unlink_incoming(connector_id)
+        self.connectors[connector_id] = [first,last]
+        self._link_incoming(connector_id)
+        if first not in self.sxeseis:
+            self.sxeseis[first] = {connector_id:last}
+        else:
+            self.sxeseis[first][connector_id]=last
+
+    def _arrow_added(self, attr_str):
+        con_id, dest_id = map(int, _match(_PAIR, "Concept arrow added", attr_str).groups())
+        root_id = self.connectors[con_id][0]
+        self._unlink_incoming(con_id)
+        self.connectors[con_id][1] = dest_id
+        self._link_incoming(con_id)
+        self.sxeseis[root_id][con_id] = dest_id
+
+    def _link_added(self, attr_str):
+        con_id, new_root = map(int, _match(_PAIR, "Concept link added", attr_str).groups())
+        prev_root = self.connectors[con_id][0]
+
+        if len(self.sxeseis[prev_root])==1:
+            del self.sxeseis[prev_root]
+        else:
+            del self.sxeseis[prev_root][con_id]
 
-been = {}
-levels = {}
-decisions = [x for x in Elements if Elements[x]["kind"]=="Decision"]
-    
-for y in decisions:
-    been[y] = False
+        if new_root not in self.sxeseis:
+            self.sxeseis[new_root] = {}
+        self.sxeseis[new_root][con_id] = self.connectors[con_id][1]
+        self.connectors[con_id][0] = new_root
+        self.incoming[self.connectors[con_id][1]][con_id] = new_root
 
-def indent(levels):
-    return "\t"*levels
+    def _delete_objects(self, attr_str):
+        conn_ids = []
+        els = []
 
-def find_level(index):
-    for x in levels:
-        if index in levels[x]:
-            return x
-        
-##=======================================================================##
+        for name, idd in _OBJECT.findall(attr_str):
+            if name.find("qualitative") > -1:
+                conn_ids.append(int(idd))
+            elif not (is_note(name) or is_text(name)):
+                els.append(int(idd))
 
-## ================ Traverse ==================##
-## Traverse is the basic function which traverses
-## through all the element tree to look for loops
+        for x in conn_ids:
+            if x in self.connectors:
+                fir = self.connectors[x][0]
 
-def traverse(st,end,level):
-    global been,levels,Elements
-    
-    el = Elements[st]
-    next = el["To"]
-    kind = el["kind"]
-    
-    if level not in levels:
-        levels[level] = []
+                self._unlink_incoming(x)
+                del self.connectors[x]
 
-    if st==end:
-        return 0
-    
-    if st!=end:
-        if kind == "Decision":
-            if been[st]==True:
-                Elements[st]["kind"]="Loop"
-                return -1
-                
-            if been[st] == False:
-                levels[level].append(st)
-                been[st]=True
-
-            yes_road = gen_skip(next["Yes"])
-            no_road = gen_skip(next["No"])
-            meet = [y for y in yes_road if y in no_road]
-
-            if len(meet)>0:
-                return traverse(meet[0],end,level)
-            else:
-                l = traverse(next["Yes"],end,level+1)
-                if l!=-1:
-                    return traverse(next["No"],end,level-1)
-                else:
-                    return traverse(next["No"],end,level+1)
-        elif kind == "Loop":
-            return traverse(next["No"],end,level)
-        else:
-            return traverse(next,end,level)
+                del self.sxeseis[fir][x]
 
-## Call the traverse function to go through all
-## the elements and identify the loops
-        
-traverse(first_el,last_el,0)
+                if len(self.sxeseis[fir].values()) == 0:
+                    del self.sxeseis[fir]
 
-## _next : Function(id)
-##     where id = element id
+        for x in els:
+            if x in self.contents:
+                del self.contents[x]
+
+            if x in self.sxeseis:
+                del self.sxeseis[x]
+
+            del self.elements[x]
+
+    def _delete_object(self, attr_str):
+        m = _OBJECT.match(attr_str.strip("[]"))
+        if m is None:
+            return
+        name, id = m.group(1), int(m.group(2))
+
+        if not (is_note(name) or is_text(name)):
+            if name.find("qualitative") > -1:
+                el = self.connectors[id][0]
+                self._unlink_incoming(id)
+                del self.connectors[id]
+                del self.sxeseis[el][id]
+                if len(self.sxeseis[el]) == 0:
+                    del self.sxeseis[el]
+            else:
+                if id in self.contents:
+                    del self.contents[id]
+
+                if id in self.sxeseis:
+                    del self.sxeseis[id]
+                del self.elements[id]
+
+    ## HANDLERS : action -> handler
+    HANDLERS = {
+        "Insert Entity": _insert_entity,
+        "Change Concept Entity text": _change_entity_text,
+        "Change Concept Relationship text": _change_relationship_text,
+        "Insert Concept Relationship": _insert_relationship,
+        "Concept arrow added": _arrow_added,
+        "Concept link added": _link_added,
+        "Delete objects": _delete_objects,
+        "Delete object": _delete_object,
+    }
+
+    ## _link_incoming, _unlink_incoming : Function(con_id)
+    ##
+    ## Functionality:
+    ##     Add/remove the connector defined by [con_id] to/from the incoming
+    ##     index of its destination, using its current connectors entry
+
+    def _link_incoming(self, con_id):
+        first, last = self.connectors[con_id][0], self.connectors[con_id][1]
+        if last not in self.incoming:
+            self.incoming[last] = {con_id:first}
+        else:
+            self.incoming[last][con_id] = first
+
+    def _unlink_incoming(self, con_id):
+        last = self.connectors[con_id][1]
+        del self.incoming[last][con_id]
+        if len(self.incoming[last]) == 0:
+            del self.incoming[last]
+
+    ## replay : Function(xml_f)
+    ##     where xml_f = binary stream of the history.xml document
+    ##
+    ## Functionality:
+    ##     Applies every <event> of the document with step, as soon as it
+    ##     has been read (see iter_events), so the memory used depends on
+    ##     the size of the final diagram and not on the length of the
+    ##     editing history.
+    ##
+    ##     The id_event of the first and the last event applied are kept in
+    ##     [first_id_event] and [last_id_event], their number in [events_applied].
+    ##     With a [timeline] every event is handed to it as well.
+
+    def replay(self, xml_f):
+        self.first_id_event = None
+        self.events_applied = 0
+        for el in iter_events(xml_f):
+            self.step(el)
+
+    ## step : Function(el)
+    ##     where el = an <event> element
+    ##
+    ## Functionality:
+    ##     Applies a single <event> the way replay does and returns
+    ##     (action, attribute, id_event). The attribute is None for an action
+    ##     which changes nothing, the id_event None for an event without one.
+
+    def step(self, el):
+        action = el.findtext("action")
+        attr_str = None
+        handler = self.HANDLERS.get(action)
+        if handler is not None:
+            attr_str = el.findtext("attribute")
+            handler(self, attr_str)
+        if self.timeline is not None:
+            self.timeline.event(el, action, self)
+        self.events_applied += 1
+        id_event = el.findtext("id_event")
+        if id_event:
+            id_event = self.last_id_event = int(id_event)
+            if self.first_id_event is None:
+                self.first_id_event = id_event
+        else:
+            id_event = None
+        return action, attr_str, id_event
+
+    ## validate : Function()
+    ##
+    ## Functionality:
+    ##     Checks the replayed diagram in a single pass over its elements,
+    ##     before anything is built or structured, and raises
+    ##     StructureErrors with every problem found instead of only the
+    ##     first one:
+    ##
+    ##     - a Decision without exactly a Yes and a No road (2)
+    ##     - no, or more than 1, starting/ending elements (0, 1)
+    ##     - a starting/ending element which is not a 'Start-End' (3)
+    ##     - any other element connected to more than 1 elements (4)
+    ##     - elements from which no road leads to the ending element, such
+    ##       as a loop without a Decision or a part drawn apart (6)
+    ##     - roads to an element which was deleted (9)
+    ##
+    ##     It is the only check of the model: on success it sets first_el
+    ##     and last_el, and build_elements and successors cannot fail.
+
+    def validate(self):
+        decisions, fan_outs, dangling = [], [], []
+        starting, ending = [], []
+
+        for x in self.elements:
+            kind = KINDS.get(self.elements[x][1], Kind.STATEMENT)
+            roads = self.sxeseis.get(x)
+            if x not in self.incoming:
+                starting.append(x)
+            for y in (roads or {}).values():
+                if y not in self.elements:
+                    dangling.append(StructureError(9,[x,y],[x,y]))
+
+            if not roads:
+                ending.append(x)
+            elif kind == Kind.DECISION:
+                ## True for a No road, False for a Yes road, None for
+                ## a connector without a label
+                labels = set()
+                for y in roads:
+                    try:
+                        con_text = self.connectors[y][2].split(",")[0].lstrip()
+                    except:
+                        con_text = ""
+                    labels.add(con_text in negative if con_text != "" else None)
+                if len(roads) != 2 or labels != {True, False}:
+                    decisions.append(StructureError(2,[x],[x]))
+            elif len(roads) > 1:
+                fan_outs.append(StructureError(4,[x],[x]))
+
+        errors = decisions
+        errors.extend(self._end_errors(starting, "starting", "Starting"))
+        errors.extend(self._end_errors(ending, "ending", "Ending"))
+        errors.extend(fan_outs)
+        errors.extend(dangling)
+        if len(ending) == 1:
+            stuck = self._unreachable_from(ending[0])
+            if stuck:
+                errors.append(StructureError(6,[",".join(str(x) for x in stuck)],stuck))
+        if errors:
+            raise StructureErrors(errors)
+
+        self.first_el = starting[0]
+        self.last_el = ending[0]
+
+    ## _unreachable_from : Function(last)
+    ##
+    ## Functionality:
+    ##     Walks the roads backwards from [last] and returns the elements
+    ##     it never reaches, the ones whose roads never end
+
+    def _unreachable_from(self, last):
+        reached = {last}
+        stack = [last]
+        while stack:
+            for x in self.incoming.get(stack.pop(), {}).values():
+                if x not in reached:
+                    reached.add(x)
+                    stack.append(x)
+        return [x for x in self.elements if x not in reached]
+
+    def _end_errors(self, found, name, title):
+        if not found:
+            return [StructureError(0,[name])]
+
+        errors = []
+        if len(found) > 1:
+            errors.append(StructureError(1,[name,",".join(str(x) for x in found)],found))
+        wrong = [x for x in found if KINDS.get(self.elements[x][1]) != Kind.START_END]
+        if wrong:
+            errors.append(StructureError(3,[title],wrong))
+        return errors
+
+    ## - Build the basic Element structure of a validated model ##
+    ##   Elements : {element id: Node}
+    def build_elements(self):
+        self.Elements = {}
+        for x in self.elements:
+            el = self.elements[x]
+            self.Elements[x] = Node(el[0], KINDS.get(el[1], Kind.STATEMENT), self.contents.get(x, ""))
+
+        ## - Set the next element and find Yes/No Roads
+        for x in self.sxeseis:
+            el = self.Elements[x]
+            r = self.sxeseis[x]
+
+            if el.kind == Kind.DECISION:
+                for y in r:
+                    ## Only the first word of the label decides the road,
+                    ## so "no, stop" is a No road
+                    con_text = self.connectors[y][2].split(",")[0].lstrip()
+                    is_negative = con_text in negative
+                    if not is_negative:
+                        el.to = r[y]
+                    else:
+                        el.no = r[y]
+            else:
+                el.to = list(r.values())[0]
+
+        ## Add this to avoid confusion in further functions
+        self.Elements[self.last_el].to = self.last_el
+    ##================================================##
+
+    ## previous, fan_in : Function(index)
+    ##     where index = Element Id
+    ##
+    ## Functionality:
+    ##     Return the elements connected to the element defined by [index]
+    ##     and their number, straight from the incoming index
+
+    def previous(self, index):
+        return list(self.incoming.get(index, {}).values())
+
+    def fan_in(self, index):
+        return len(self.incoming.get(index, {}))
+    ##
+
+    ## successors : Function()
+    ##
+    ## Functionality:
+    ##     Returns {element id: [next element ids]} for the whole diagram.
+    ##     A Decision lists its Yes road before its No road, the last
+    ##     element has no successors.
+
+    def successors(self):
+        succ = {}
+        for x, el in self.Elements.items():
+            if x == self.last_el:
+                succ[x] = []
+            elif el.kind == Kind.DECISION:
+                if el.to is None or el.no is None:
+                    raise StructureError(2,[x])
+                succ[x] = [el.to, el.no]
+            else:
+                succ[x] = [el.to]
+        return succ
+
+    ##=======================================================================##
+
+    ## ================ Structure ==================##
+    ## structure : Function()
+    ##
+    ## Functionality:
+    ##     Identifies the loops and the meeting point of every "If"
+    ##     from the dominator trees of the diagram:
+    ##
+    ##     - An edge (u -> v) where v dominates u is a back edge and v is
+    ##       the entry of a loop. The loop is every element which reaches
+    ##       the u of one of its back edges without passing through v.
+    ##       Searching it backwards from the u's, the
+    ##       first Decision whose No road leaves the loop is the condition
+    ##       of the loop and is marked as a "Loop", whose Yes road is the
+    ##       body. A loop without one raises StructureError(7).
+    ##
+    ##     - Only Connectors may come between v and the condition, anything
+    ##       else would be written before the loop and again in its body,
+    ##       as in a do-while, and raises StructureError(8).
+    ##
+    ##     - The meeting point ("meet") of every remaining Decision is its
+    ##       immediate post-dominator, the first element which every road
+    ##       out of the Decision has to pass through.
+
+    def structure(self):
+        succ = self.successors()
+        pred = {x:[] for x in succ}
+        for x in succ:
+            for y in succ[x]:
+                pred[y].append(x)
+
+        idom, _ = dominators(self.first_el, succ)
+        dom_tree = DominatorTree(idom)
+
+        ## The sources of the back edges of every loop entry
+        back = {}
+        for u in idom:
+            for v in succ[u]:
+                if v in idom and dom_tree.dominates(v, u):
+                    back.setdefault(v, []).append(u)
+
+        Elements = self.Elements
+        for v, sources in back.items():
+            x = self._loop_condition(v, sources, pred)
+            Elements[x].kind = Kind.LOOP
+
+            y = v
+            while y != x:
+                if Elements[y].kind != Kind.CONNECTOR:
+                    raise StructureError(8,[y],[y])
+                y = Elements[y].to
+
+        ipdom, _ = dominators(self.last_el, pred)
+
+        for x, el in Elements.items():
+            if el.kind == Kind.DECISION:
+                ## Roads which never reach the end have no post-dominator
+                el.meet = ipdom.get(x, self.last_el)
+                if el.meet == x:
+                    el.meet = self.last_el
+
+    ## _loop_condition : Function(v,sources,pred)
+    ##     where v = the entry of a loop
+    ##           sources = the elements of its back edges (u -> v)
+    ##           pred = {element id: [previous element ids]}
+    ##
+    ## Functionality:
+    ##     Returns the condition of the loop (see structure)
+
+    def _loop_condition(self, v, sources, pred):
+        loop = {v}
+        loop.update(sources)
+        order = list(dict.fromkeys(sources))
+        for x in order:
+            if x == v:
+                continue
+            for y in pred[x]:
+                if y not in loop:
+                    loop.add(y)
+                    order.append(y)
+        if v not in order:
+            order.append(v)
+
+        for x in order:
+            el = self.Elements[x]
+            if el.kind in (Kind.DECISION, Kind.LOOP) and el.no not in loop:
+                return x
+        raise StructureError(7,[v],sorted(loop))
+
+    ##=======================================================================##
+
+    ## build : Function(start,end,level)
+    ##     where start = [starting element id]
+    ##           end = [ending element id]
+    ##           level = [current depth level]
+    ##
+    ## Functionality:
+    ##     Generator which yields the lines of text (each ending in "\n")
+    ##     between the [start] and the [end] elements, as the walk reaches
+    ##     them, so the output never has to be held in memory as a whole.
+    ##
+    ##     The walk uses an explicit stack instead of recursion, so long or
+    ##     deeply nested flowcharts never reach the recursion limit. Every
+    ##     item of the stack is either a line to yield, or a
+    ##     (start,end,level) road still to be built. Roads are pushed in
+    ##     reverse order so they are popped in the order they are written.
+    ##
+    ##     Every element but a Connector is written once. One reached again
+    ##     raises StructureError(8) instead of writing it forever.
+
+    def build(self, start,end,level):
+        Elements = self.Elements
+        stack = [(start,end,level)]
+        written = set()
+
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                yield item
+                continue
+
+            start, end, level = item
+            while True:
+                if start == self.first_el:
+                    start = Elements[self.first_el].to
+                el = Elements[start]
+                kind = el.kind
+                if start == end or kind == Kind.START_END:
+                    break
+                if kind != Kind.CONNECTOR:
+                    if start in written:
+                        raise StructureError(8,[start],[start])
+                    written.add(start)
+
+                if kind == Kind.LOOP:
+                    yield indent(level) + "while " + el.text + ":\n"
+                    stack.append((el.no,end,level))
+                    stack.append((el.to,start,level+1))
+                    break
+                elif kind == Kind.DECISION:
+                    meet = el.meet
+                    yield indent(level) + "if " + el.text + ":\n"
+                    stack.append((meet,end,level))
+                    if meet != el.no:
+                        stack.append((el.no,meet,level+1))
+                        stack.append(indent(level) + "else:\n")
+                    stack.append((el.to,meet,level+1))
+                    break
+                elif kind != Kind.CONNECTOR:
+                    prefix = indent(level)
+                    for x in el.text.split("\n"):
+                        yield prefix + x + "\n"
+                    start = el.to
+                else:
+                    start = el.to
+
+    ##=======================================================================##
+
+    ## iter_lines : Function(source)
+    ##     where source = path of the .synergo file, or its bytes
+    ##                    or an open binary file (see open_history)
+    ##
+    ## Functionality:
+    ##     Runs the whole analysis of a single model and returns a generator
+    ##     of the lines of generated Python text. The structures are reset
+    ##     first, so the same Converter can be used again for the next model.
+    ##
+    ##     Everything which can raise a StructureError happens before this
+    ##     returns, so nothing has been written yet when a model is rejected.
+
+    def iter_lines(self, source):
+        self.reset()
+
+        if self.profiler is None:
+            with open_history(source) as xml_f:
+                self.replay(xml_f)
+            return self.lines()
+
+        self.profiler.start(source)
+        try:
+            with ExitStack() as stack:
+                with self.profiler.phase("open"):
+                    xml_f = stack.enter_context(open_history(source))
+                with self.profiler.phase("replay"):
+                    self.replay(xml_f)
+        except BaseException as e:
+            self.profiler.fail(e)
+            raise
+        return self.lines()
+
+    ## lines : Function()
+    ##
+    ## Functionality:
+    ##     The part of iter_lines after the replay: builds the Elements
+    ##     structure from the current replay state, checks and structures it
+    ##     and returns the generator of lines
+
+    def lines(self):
+        profiler = self.profiler
+        if profiler is None:
+            ## Reject an invalid model with all of its problems before
+            ## any of the costly work
+            self.validate()
+            self.build_elements()
+
+            ## Identify the loops and add an attribute
+            ## defining the meeting point of every decision
+            self.structure()
+
+            ## Build with starting element the first element and ending
+            ## element the last element, so it will pass through all
+            ## the elements
+            return self.build(self.first_el, self.last_el, 0)
+
+        if profiler.record is None:
+            profiler.start("<replayed>")
+        profiler.count(events=self.events_applied)
+        try:
+            with profiler.phase("elements"):
+                self.validate()
+                self.build_elements()
+            profiler.count(nodes=len(self.Elements), edges=len(self.connectors))
+
+            with profiler.phase("structure"):
+                self.structure()
+        except BaseException as e:
+            profiler.fail(e)
+            raise
+
+        return profiler.timed(self.build(self.first_el, self.last_el, 0))
+
+    ## convert : Function(source)
+    ##
+    ## Functionality:
+    ##     Same as iter_lines, but returns the generated text as one string
+
+    def convert(self, source) -> str:
+        return "".join(self.iter_lines(source))
+
+## convert, iter_lines : Function(source,profiler)
 ##
 ## Functionality:
-##     returns the element after the element defined by the [id] argument
-
-def _next(id):
-    el = Elements[id]
-    kind = el["kind"]
+##     Convert a single model with a new Converter and return the
+##     generated Python text as one string or as a generator of lines.
+##     Safe to call from several threads at once.
+##     A [profiler] (see Profiler) gets the cost of every phase.
 
-    if kind=="Decision":
-        return _meet(el["To"]["Yes"],el["To"]["No"],id)
-    elif kind=="Loop":
-        return el["To"]["No"]
-    if id==last_el:
-        return id
-    return el["To"]
+def convert(source, profiler:Profiler = None) -> str:
+    return Converter(profiler).convert(source)
 
-##====================================================================#
+def iter_lines(source, profiler:Profiler = None):
+    return Converter(profiler).iter_lines(source)
 
-
-## meet : Function(el1,el2,start)
+## convert_to : Function(source,sink,profiler)
+##     where sink = any object with a write(str) method, e.g. an open text file
 ##
 ## Functionality:
-##     Returns the meeting point of the (el1,el2) elements which are
-##     sub-elements of the Decision element defined by the [start] argument
-
-def _meet(el1,el2,start):
-    start_level = find_level(start)
-    trace1 = _trace(el1,start_level)
-    trace2 = _trace(el2,start_level)
+##     Converts a single model and writes the lines to [sink] as they are made
 
-    common = [y for y in trace1 if y in trace2]
-    return common[0]
+def convert_to(source, sink, profiler:Profiler = None):
+    for line in iter_lines(source, profiler):
+        sink.write(line)
 
-##====================================================================#
-
-
-## Trace : Function(el,level)
-##     where el = element id
-##     and level = depth level
-##
-## Functionality:
-##     Passes through all the elements after the element defined by the
-##     [el] argument until it finds a decision which is is in the same
-##     depth level defined by the [level] argument
-
-def _trace(el,level):
-    global last_el
-    next = _next(el)
-    found = False
-    tr = [el,next]
-    if Elements[next]["kind"]=="Decision":
-        if find_level(next) == level:
-            found=True
-    while next!=last_el and found==False:
-        next = _next(next)
-        tr.append(next)
-        if Elements[next]["kind"]=="Decision":
-            if find_level(next) == level:
-                found=True
-
-    return tr
-
-##=======================================================================##
-
-## final_decisions : list containing all the Decision ("If") Elements
-final_decisions = [x for x in decisions if Elements[x]["kind"]=="Decision"]
-
-## Loop through all the decisions and add
-## an attribute defining their meeting point
-for x in final_decisions:
-    el = Elements[x]
-    el["meet"] = _meet(el["To"]["Yes"],el["To"]["No"],el)
-    
-## build : Function(start,end,level)
-##     where start = [starting element id]
-##           end = [ending element id]
-##           level = [current depth level]
-##
-## Functionality:
-##     Builds the corresponding text between the [start] and the [end]
-##     elements and adds it to the Global [Text] variable
-##
-## Note:
-##      If you un-comment the comments inside you will see the debug
-##      process which prints every information passed through.
-
-current = first_el
-
-Text = ""
-def build(start,end,level):
-    global Text,last_el,first_el
-    if start == first_el:
-        start = Elements[first_el]["To"]
-    el = Elements[start]
-    kind = el["kind"]
-    if start!=end:
-        if kind !="Start-End":
-            if kind=="Loop":
-                #print 
-                #print indent(level),"--Loop--",start," No: ",el["To"]["No"]," - ",end
-                Text += indent(level) + "while " + el["text"] + ":\n"
-                #print indent(level+1)," Yes-> ", el["To"]["Yes"]
-                build(el["To"]["Yes"],start,level+1)
-                #print indent(level)," No-> ", el["To"]["No"]
-                build(el["To"]["No"],end,level)
-            elif kind=="Decision":
-                yes = el["To"]["Yes"]
-                no = el["To"]["No"]
-                meet = el["meet"]
-                #print indent(level),"meet ",meet
-                Text += indent(level) + "if " + el["text"] + ":\n"
-                #print indent(level+1)," Yes-> ", el["To"]["Yes"]
-                build(yes,meet,level+1)
-                if meet!=no:
-                    Text += indent(level) + "else:\n"
-                    #print indent(level+1)," No-> ", el["To"]["No"]
-                    build(no,meet,level+1)
-                # Text += "\n"
-                #print indent(level)," Decision-> ", meet
-                build(meet,end,level)
-            elif kind!="Connector":
-                for x in el["text"].split("\n"):
-                    Text += indent(level) + x + "\n"
-                #print indent(level)," Element-> ", el["To"]
-                build(el["To"],end,level)
+## - Create the final file and add the final text
+##   [text] is a string or any iterable of lines (e.g. from iter_lines)
+##   A file left half written by a failure is removed
+def write_output(text, output_file_basename:str):
+    path = output_file_basename + ".py"
+    try:
+        with open(path, "w", encoding="utf-8") as ret:
+            if isinstance(text, str):
+                ret.write(text)
             else:
-                #print indent(level)," Connector-> ", el["To"]
-                build(el["To"],end,level)
-
-##=======================================================================##
+                ret.writelines(text)
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert Synergo algorithmic flowcharts to Python code.")
+    parser.add_argument("input_file_path", nargs="?")
+    parser.add_argument("output_file_basename", nargs="?")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="convert every .synergo file found in the given directories, globs or files")
+    parser.add_argument("--bundle", nargs=2, metavar=("ARCHIVE", "OUTPUT"),
+                        help="convert every .synergo member of a zip/tar ARCHIVE into the OUTPUT zip, with a manifest")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="convert the .synergo files of DIR again whenever they are saved")
+    parser.add_argument("--serve", nargs="?", const="127.0.0.1:8765", metavar="ADDRESS",
+                        help="run the conversion server on host:port or on a Unix socket path (default: 127.0.0.1:8765)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="serve mode: requests which may wait for a free worker (default: 16)")
+    parser.add_argument("--timeout", type=float, default=None, metavar="SECONDS",
+                        help="serve mode: time limit of a single conversion (default: 30)")
+    parser.add_argument("--debounce", type=float, default=None, metavar="SECONDS",
+                        help="watch mode: wait until a file has not changed for this long (default: 0.5)")
+    parser.add_argument("--out-dir", help="batch/watch mode: directory for the generated .py files (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="batch/bundle/watch/serve mode: number of worker processes (default: number of cores)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the conversion cache")
+    parser.add_argument("--cache-dir", help="directory of the conversion cache (default: ~/.cache/synergo2python)")
+    parser.add_argument("--cache-size", type=float, default=None, metavar="MB",
+                        help="size limit of the conversion cache in MB (default: 64)")
+    parser.add_argument("--checkpoint-dir",
+                        help="keep replay checkpoints here, so a newer version of a file only replays its new events")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                        help="append the time, counts and peak memory of every phase as JSON lines to FILE (default: stderr)")
+    parser.add_argument("--save-ir", nargs="?", const=True, metavar="FILE",
+                        help="single mode: also save the structured graph as IR (default: the output name with .sgir, see ir.py)")
+    parser.add_argument("--timeline", metavar="FILE",
+                        help="single/batch mode: write the editing timeline metrics of every model as CSV to FILE ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    cache_options = None
+    if not args.no_cache:
+        import cache
+        max_bytes = int(args.cache_size * 1024 * 1024) if args.cache_size is not None else cache.DEFAULT_MAX_BYTES
+        cache_options = (args.cache_dir or cache.default_cache_dir(), max_bytes)
+
+    if args.batch:
+        import batch
+        return batch.run(args.batch, out_dir=args.out_dir, jobs=args.jobs, cache_options=cache_options,
+                         checkpoint_dir=args.checkpoint_dir, profile_path=args.profile, timeline_path=args.timeline)
+
+    if args.bundle:
+        ## A bundle only reads the archive and writes the output zip, the
+        ## cache is used when --cache-dir or --cache-size asks for it
+        import bundle
+        if args.cache_dir is None and args.cache_size is None:
+            cache_options = None
+        return bundle.run(args.bundle[0], args.bundle[1], jobs=args.jobs, cache_options=cache_options)
+
+    if args.watch:
+        import watch
+        options = {}
+        if args.debounce is not None:
+            options["debounce"] = args.debounce
+        return watch.run(args.watch, out_dir=args.out_dir, jobs=args.jobs, cache_options=cache_options,
+                         checkpoint_dir=args.checkpoint_dir, profile_path=args.profile, **options)
+
+    if args.serve:
+        import serve
+        options = {}
+        if args.queue_size is not None:
+            options["queue_size"] = args.queue_size
+        if args.timeout is not None:
+            options["timeout"] = args.timeout
+        return serve.serve(args.serve, workers=args.jobs, cache_options=cache_options, **options)
+
+    if args.input_file_path is None:
+        parser.error("input_file_path is required unless --batch, --bundle, --watch or --serve is given")
+
+    input_file_name = Path(args.input_file_path).parts[-1]
+    output_file_basename = args.output_file_basename or ".".join(input_file_name.split(".")[:-1])
+    profiler = Profiler(profile_sink(args.profile)) if args.profile else None
+    lines_fn = lambda source: iter_lines(source, profiler)
+    if args.timeline or args.save_ir:
+        ## The timeline needs the whole history replayed and the IR the
+        ## structured Elements: no cache or checkpoints
+        import timeline
+        history = timeline.Timeline() if args.timeline else None
+        converter = Converter(profiler, history)
+        status = "structure"
+        try:
+            write_output(converter.iter_lines(args.input_file_path), output_file_basename)
+            status = "ok"
+        finally:
+            if history is not None and history.events:
+                timeline.write_csv([dict(history.metrics(), source=args.input_file_path, status=status)], args.timeline)
+        if args.save_ir:
+            import ir
+            ir.save(converter, output_file_basename + ir.IR_SUFFIX if args.save_ir is True else args.save_ir)
+        return 0
+    if args.checkpoint_dir:
+        import checkpoint
+        store = checkpoint.CheckpointStore(args.checkpoint_dir)
+        lines_fn = lambda source: checkpoint.iter_lines_incremental(source, store, profiler=profiler)
 
-## Call the build function with starting element the first element
-## and ending element the last element, so it will pass through all
-## the elements and build the final Text
+    if cache_options is None:
+        write_output(lines_fn(args.input_file_path), output_file_basename)
+    else:
+        write_output(cache.iter_lines_cached(args.input_file_path, cache.ConversionCache(*cache_options), lines_fn, profiler), output_file_basename)
+    return 0
 
-build(first_el, last_el, 0)
+if __name__ == "__main__":
+    ## Run the imported module instead of __main__, so there is a single
+    ## StructureError class for this script and the modules it uses
+    ## (cache.py, batch.py, ...)
+    import convert
+    sys.exit(convert.main())
 
-## - Create the final file and add the final text
-ret = open( output_file_basename + ".py", "w", encoding="utf-8")
-ret.write(Text)
-ret.close()
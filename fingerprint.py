@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Fingerprint the final structure of a model, not its file: the kinds of
+#   the elements, their normalized text and the Yes/No roads. Element ids,
+#   positions, sizes and Connector elements (which only join roads) make
+#   no difference
+# - The elements are numbered by a walk from the starting element which
+#   always takes the Yes road first, so the same flowchart gets the same
+#   numbers however it was drawn. The exact fingerprint is the sha256 of
+#   the structure written with these numbers
+# - For near duplicates every element is described by its neighbourhood
+#   (Weisfeiler-Lehman relabelling), and the set of descriptions is
+#   summarised by a MinHash signature. Signatures are split into bands
+#   and models sharing a band are candidates (locality sensitive hashing),
+#   so a class is grouped in about linear time instead of pair by pair
+# - The index is kept as JSON, so new submissions are checked against the
+#   earlier ones without fingerprinting those again
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+
+import convert
+from convert import Kind
+
+## INDEX_VERSION : 2 since invalid models are no longer indexed
+INDEX_VERSION = 2
+WL_ROUNDS = 2
+NUM_HASHES = 64
+BANDS = 16
+DEFAULT_THRESHOLD = 0.6
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+## _PERMUTATIONS : The (a, b) pairs of the MinHash functions (a*x + b) mod p,
+##     made from a fixed seed so signatures stay comparable between runs
+_PERMUTATIONS = []
+for i in range(NUM_HASHES):
+    digest = hashlib.sha256(b"synergo2python minhash " + str(i).encode("ascii")).digest()
+    a, b = struct.unpack_from("<QQ", digest)
+    _PERMUTATIONS.append((a % (_PRIME - 1) + 1, b % _PRIME))
+
+_SPACES = re.compile(r"\s+")
+
+## normalize_text : Function(text)
+##
+## Functionality:
+##     The text of an element without its whitespace and in lower case,
+##     so "w = w*w" and "W=w * w" are the same
+
+def normalize_text(text:str) -> str:
+    return _SPACES.sub("", text).lower()
+
+## _hash64 : Function(text)
+##
+## Functionality:
+##     A stable 64 bit hash of [text] (unlike hash(), the same in every process)
+
+def _hash64(text:str) -> int:
+    return struct.unpack("<Q", hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())[0]
+
+## canonical_graph : Function(converter)
+##     where converter = a Converter with its Elements, first_el and last_el
+##
+## Functionality:
+##     Returns a list with one (kind, text, [successor numbers]) entry per
+##     element, numbered by a depth first walk from the starting element
+##     (Yes road before No road). Connector elements are skipped over.
+
+def canonical_graph(converter) -> list:
+    Elements = converter.Elements
+
+    def skip(x):
+        seen = set()
+        while Elements[x].kind == Kind.CONNECTOR and x not in seen and Elements[x].to is not None:
+            seen.add(x)
+            x = Elements[x].to
+        return x
+
+    def successors(x):
+        el = Elements[x]
+        if x == converter.last_el:
+            return []
+        if el.kind in (Kind.DECISION, Kind.LOOP):
+            return [skip(y) for y in (el.to, el.no) if y is not None]
+        return [skip(el.to)] if el.to is not None else []
+
+    number = {}
+    order = []
+    stack = [skip(converter.first_el)]
+    while stack:
+        x = stack.pop()
+        if x in number:
+            continue
+        number[x] = len(order)
+        order.append(x)
+        ## pushed in reverse so the Yes road is walked first
+        stack.extend(reversed(successors(x)))
+
+    nodes = []
+    for x in order:
+        el = Elements[x]
+        kind = Kind.DECISION if el.kind == Kind.LOOP else el.kind
+        nodes.append((int(kind), normalize_text(el.text), [number[y] for y in successors(x)]))
+    return nodes
+
+## exact_fingerprint : Function(nodes)
+##
+## Functionality:
+##     The hex sha256 of the canonical graph
+
+def exact_fingerprint(nodes) -> str:
+    return hashlib.sha256(json.dumps(nodes, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+## wl_features : Function(nodes,rounds)
+##
+## Functionality:
+##     Returns the set of Weisfeiler-Lehman labels of the canonical graph:
+##     the label of an element is its kind and text, then for every round
+##     its label together with the labels of its successors (in road order)
+##     and of its predecessors. Labels of every round are kept, so small
+##     edits change only part of the set.
+
+def wl_features(nodes, rounds:int = WL_ROUNDS) -> set:
+    pred = [[] for _ in nodes]
+    for i, (_, _, succ) in enumerate(nodes):
+        for j in succ:
+            pred[j].append(i)
+
+    labels = [_hash64("{0}:{1}".format(kind, text)) for kind, text, _ in nodes]
+    features = set(labels)
+    for r in range(rounds):
+        labels = [_hash64("{0}|{1}|{2}|{3}".format(r, labels[i], [labels[j] for j in nodes[i][2]],
+                                                   sorted(labels[j] for j in pred[i])))
+                  for i in range(len(nodes))]
+        features.update(labels)
+    return features
+
+## minhash : Function(features)
+##
+## Functionality:
+##     The MinHash signature of a set of 64 bit features: NUM_HASHES
+##     minimums, one per hash function
+
+def minhash(features) -> list:
+    if not features:
+        return [_MASK] * NUM_HASHES
+    values = [x % _PRIME for x in features]
+    return [min((a * x + b) % _PRIME for x in values) for a, b in _PERMUTATIONS]
+
+def similarity(sig1, sig2) -> float:
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+## Fingerprint : The fingerprints of one model
+##     where exact = the hex sha256 of its canonical graph
+##           signature = its MinHash signature
+##           nodes = the number of elements (Connectors left out)
+
+class Fingerprint:
+    def __init__(self, exact:str, signature, nodes:int):
+        self.exact = exact
+        self.signature = list(signature)
+        self.nodes = nodes
+
+    def to_json(self) -> dict:
+        return {"exact": self.exact, "signature": self.signature, "nodes": self.nodes}
+
+    @classmethod
+    def from_json(cls, fields:dict):
+        return cls(fields["exact"], fields["signature"], fields["nodes"])
+
+## fingerprint_of : Function(source)
+##
+## Functionality:
+##     Replays and validates the model and returns its Fingerprint.
+##     Raises convert.StructureErrors with every problem of an invalid
+##     model, like a conversion would.
+
+def fingerprint_of(source) -> Fingerprint:
+    c = convert.Converter()
+    with convert.open_history(source) as xml_f:
+        c.replay(xml_f)
+    c.validate()
+    c.build_elements()
+
+    nodes = canonical_graph(c)
+    return Fingerprint(exact_fingerprint(nodes), minhash(wl_features(nodes)), len(nodes))
+
+## FingerprintIndex : The fingerprints of a class of submissions
+##     where path = the JSON file the index is kept in (None: memory only)
+##           threshold = the estimated similarity from which two models
+##                       are near duplicates
+##
+## Every entry has a name (by default the path of the file) and the sha256
+## of the file, so a file which did not change is not fingerprinted again.
+
+class FingerprintIndex:
+    def __init__(self, path:str = None, threshold:float = DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.entries = {}
+        self.file_digests = {}
+        self.exact = {}
+        self.buckets = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("converter") == convert.CONVERTER_VERSION:
+                for name, fields in data["entries"].items():
+                    self._insert(name, Fingerprint.from_json(fields), fields.get("file_sha256"))
+
+    def _bands(self, signature):
+        rows = NUM_HASHES // BANDS
+        for band in range(BANDS):
+            yield (band,) + tuple(signature[band * rows:(band + 1) * rows])
+
+    def _insert(self, name:str, fp:Fingerprint, file_digest:str = None):
+        self.remove(name)
+        self.entries[name] = fp
+        self.file_digests[name] = file_digest
+        self.exact.setdefault(fp.exact, set()).add(name)
+        for key in self._bands(fp.signature):
+            self.buckets.setdefault(key, set()).add(name)
+
+    def remove(self, name:str):
+        fp = self.entries.pop(name, None)
+        if fp is None:
+            return
+        self.file_digests.pop(name, None)
+        self.exact[fp.exact].discard(name)
+        if not self.exact[fp.exact]:
+            del self.exact[fp.exact]
+        for key in self._bands(fp.signature):
+            self.buckets[key].discard(name)
+            if not self.buckets[key]:
+                del self.buckets[key]
+
+    ## matches : Function(fp,exclude)
+    ##
+    ## Functionality:
+    ##     Returns [(name, similarity, identical)] of the entries identical
+    ##     to or near [fp], the most similar first
+
+    def matches(self, fp:Fingerprint, exclude:str = None) -> list:
+        found = {}
+        for name in self.exact.get(fp.exact, ()):
+            found[name] = 1.0
+
+        candidates = set()
+        for key in self._bands(fp.signature):
+            candidates.update(self.buckets.get(key, ()))
+        for name in candidates:
+            if name in found:
+                continue
+            s = similarity(fp.signature, self.entries[name].signature)
+            if s >= self.threshold:
+                found[name] = s
+
+        found.pop(exclude, None)
+        return sorted(((name, s, name in self.exact.get(fp.exact, ())) for name, s in found.items()),
+                      key=lambda item: (-item[1], item[0]))
+
+    ## check : Function(source,name)
+    ##
+    ## Functionality:
+    ##     Fingerprints [source] (unless the file is unchanged since it was
+    ##     added), adds it under [name] and returns its matches among the
+    ##     other entries. An invalid model is not added, and an earlier
+    ##     entry under [name] is removed, before its StructureError is
+    ##     raised.
+
+    def check(self, source, name:str = None) -> list:
+        if name is None:
+            name = os.path.normpath(source) if isinstance(source, (str, os.PathLike)) else None
+        if name is None:
+            raise ValueError("a name is needed for sources which are not paths")
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            file_digest = hashlib.sha256(source).hexdigest()
+        else:
+            with open(source, "rb") as f:
+                file_digest = hashlib.sha256(f.read()).hexdigest()
+
+        if name in self.entries and self.file_digests.get(name) == file_digest:
+            fp = self.entries[name]
+        else:
+            try:
+                fp = fingerprint_of(source)
+            except convert.StructureError:
+                self.remove(name)
+                raise
+            self._insert(name, fp, file_digest)
+        return self.matches(fp, exclude=name)
+
+    ## groups : Function()
+    ##
+    ## Functionality:
+    ##     Returns the groups (sorted lists of names) of two or more entries
+    ##     which are identical or near each other, directly or through
+    ##     other entries of the group
+
+    def groups(self) -> list:
+        parent = {name: name for name in self.entries}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(a, b):
+            a, b = find(a), find(b)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+        for names in self.exact.values():
+            first = min(names)
+            for name in names:
+                union(first, name)
+
+        ## Within a bucket every entry is compared with one entry of each
+        ## group found so far, not with every other entry
+        for names in self.buckets.values():
+            heads = []
+            for a in sorted(names):
+                for b in heads:
+                    if find(a) == find(b):
+                        break
+                    if similarity(self.entries[a].signature, self.entries[b].signature) >= self.threshold:
+                        union(a, b)
+                        break
+                else:
+                    heads.append(a)
+
+        groups = {}
+        for name in self.entries:
+            groups.setdefault(find(name), []).append(name)
+        return sorted(sorted(g) for g in groups.values() if len(g) > 1)
+
+    def save(self, path:str = None):
+        path = path or self.path
+        entries = {}
+        for name, fp in self.entries.items():
+            fields = fp.to_json()
+            fields["file_sha256"] = self.file_digests.get(name)
+            entries[name] = fields
+        temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "converter": convert.CONVERTER_VERSION, "entries": entries}, f)
+        os.replace(temp_path, path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find identical and near identical models in a class.")
+    parser.add_argument("index", help="JSON file of the index (created if missing)")
+    parser.add_argument("inputs", nargs="*", help=".synergo files, directories or globs to add and check")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="similarity from which models are near duplicates (default: 0.6)")
+    parser.add_argument("--groups", action="store_true", help="print the groups of the whole index")
+    args = parser.parse_args(argv)
+
+    import batch
+    index = FingerprintIndex(args.index, args.threshold)
+    for path in batch.collect_inputs(args.inputs):
+        try:
+            found = index.check(path)
+        except convert.StructureError as e:
+            print("[StructureError] {0}: {1}".format(path, e))
+            continue
+        except Exception as e:
+            print("[Error] {0}: {1}: {2}".format(path, type(e).__name__, e))
+            continue
+        for name, s, identical in found:
+            print("[{0}] {1} ~ {2}".format("Identical" if identical else "{0:.2f}".format(s), path, name))
+    index.save()
+
+    if args.groups:
+        for i, group in enumerate(index.groups()):
+            print("Group {0}: {1}".format(i + 1, ", ".join(group)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
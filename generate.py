@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Make a random structured program: statements, if/else and while loops,
+#   with a given number of elements, decision nesting depth and loops
+# - Turn it into a flowchart (Start-End, Process, Decision and Connector
+#   elements joined by Yes/No labelled relationships)
+# - Write the edit history which draws that flowchart as a valid .synergo
+#   archive (zip with a UTF-16 history.xml), with as much editing churn
+#   (elements inserted and deleted again, arrows moved and moved back,
+#   texts rewritten, objects moved around) as asked for
+# - The program the flowchart should convert to is returned as well, so
+#   tests and benchmarks can check the output
+
+import argparse
+import codecs
+import io
+import random
+import sys
+import zipfile
+from xml.sax.saxutils import escape
+
+## _Statement : One statement of the random program
+##     where kind = "s" (Process), "if" or "while"
+##           text = the statement or the condition
+##           blocks = the inner blocks, [then, else] or [body]
+
+class _Statement:
+    __slots__ = ("kind", "text", "blocks")
+
+    def __init__(self, kind:str, text:str, blocks = ()):
+        self.kind = kind
+        self.text = text
+        self.blocks = list(blocks)
+
+## random_program : Function(rnd,elements,depth,loops)
+##
+## Functionality:
+##     Returns the top block (a list of _Statement) of a random program
+##     with about [elements] flowchart elements, decisions nested exactly
+##     [depth] deep (when the size allows it) and [loops] while loops.
+##     Raises ValueError for loops with a [depth] of 0, which has no room
+##     for them.
+
+def random_program(rnd:random.Random, elements:int, depth:int = 3, loops:int = 1):
+    if loops > 0 and depth < 1:
+        raise ValueError("loops need a depth of 1 or more")
+    top = []
+    ## blocks : (block, depth of the block) pairs new statements can go into
+    blocks = [(top, 0)]
+    count = [2]
+
+    def statement(kind, level):
+        count[0] += 1
+        if kind == "s":
+            return _Statement("s", "x{0} = {1}".format(rnd.randint(0, 9), rnd.randint(0, 999)))
+        if kind == "while":
+            body = [statement("s", level + 1)]
+            blocks.append((body, level + 1))
+            return _Statement("while", "w{0} > {1}".format(rnd.randint(0, 9), rnd.randint(0, 99)), [body])
+        then, other = [statement("s", level + 1)], [statement("s", level + 1)]
+        blocks.append((then, level + 1))
+        blocks.append((other, level + 1))
+        return _Statement("if", "x{0} > {1}".format(rnd.randint(0, 9), rnd.randint(0, 99)), [then, other])
+
+    ## A chain of nested decisions reaching the requested depth,
+    ## the first [loops] of them being loops
+    block, loops_left = top, loops
+    for level in range(depth):
+        if count[0] + 3 > elements and level > 0:
+            break
+        kind = "while" if loops_left > 0 else "if"
+        loops_left -= kind == "while"
+        st = statement(kind, level)
+        block.append(st)
+        block = st.blocks[0]
+
+    ## The rest of the loops and then statements and ifs anywhere
+    ## above the maximum depth
+    shallow = [b for b in blocks if b[1] < depth]
+    while loops_left > 0:
+        block, level = rnd.choice(shallow)
+        block.append(statement("while", level))
+        shallow.append(blocks[-1])
+        loops_left -= 1
+
+    while count[0] < elements:
+        block, level = rnd.choice(blocks)
+        if level < depth and rnd.random() < 0.15:
+            block.append(statement("if", level))
+        else:
+            block.append(statement("s", level))
+
+    return top
+
+## program_text : Function(block)
+##
+## Functionality:
+##     Returns the Python text of the program, the same as convert.py writes it
+
+def program_text(block) -> str:
+    out = []
+    ## stack : lines still to write, or (block, level) still to expand
+    stack = [(block, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        block, level = item
+        prefix = "\t" * level
+        for st in reversed(block):
+            if st.kind == "s":
+                stack.append(prefix + st.text + "\n")
+            elif st.kind == "while":
+                stack.append((st.blocks[0], level + 1))
+                stack.append(prefix + "while " + st.text + ":\n")
+            else:
+                stack.append((st.blocks[1], level + 1))
+                stack.append(prefix + "else:\n")
+                stack.append((st.blocks[0], level + 1))
+                stack.append(prefix + "if " + st.text + ":\n")
+    return "".join(out)
+
+## Flowchart : The elements and relationships of a program
+##     where kinds = {element id: kind}
+##           texts = {element id: text}
+##           edges = list of (from, to, label) where label is "yes", "no" or None
+##           start, end = the Start-End element ids
+
+class Flowchart:
+    def __init__(self):
+        self.kinds = {}
+        self.texts = {}
+        self.edges = []
+        self.start = None
+        self.end = None
+
+    def add(self, kind:str, text:str = "") -> int:
+        idd = len(self.kinds) + 1
+        self.kinds[idd] = kind
+        self.texts[idd] = text
+        return idd
+
+## flowchart_of : Function(rnd,block,connectors)
+##     where connectors = the probability of a Connector element at a merge
+##
+## Functionality:
+##     Wires the program into a Flowchart. The blocks are wired from their
+##     last statement backwards, with generators standing in for recursion
+##     so any nesting depth can be wired.
+
+def flowchart_of(rnd:random.Random, block, connectors:float = 0.3) -> Flowchart:
+    fc = Flowchart()
+    fc.start = fc.add("Start-End", "Start")
+    fc.end = fc.add("Start-End", "End")
+
+    def wire(block, nxt):
+        entry = nxt
+        for st in reversed(block):
+            if st.kind == "s":
+                x = fc.add("Process", st.text)
+                fc.edges.append((x, entry, None))
+                entry = x
+            elif st.kind == "if":
+                d = fc.add("Decision", st.text)
+                join = entry
+                if rnd.random() < connectors:
+                    join = fc.add("Connector")
+                    fc.edges.append((join, entry, None))
+                yes = yield (st.blocks[0], join)
+                no = yield (st.blocks[1], join)
+                fc.edges.append((d, yes, "yes"))
+                fc.edges.append((d, no, "no"))
+                entry = d
+            else:
+                d = fc.add("Decision", st.text)
+                head = d
+                if rnd.random() < connectors:
+                    head = fc.add("Connector")
+                    fc.edges.append((head, d, None))
+                body = yield (st.blocks[0], head)
+                fc.edges.append((d, body, "yes"))
+                fc.edges.append((d, entry, "no"))
+                entry = head
+        return entry
+
+    stack = [wire(block, fc.end)]
+    value = None
+    while stack:
+        try:
+            inner = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+        else:
+            stack.append(wire(*inner))
+            value = None
+
+    fc.edges.append((fc.start, value, None))
+    return fc
+
+## _History : Writes the <event> elements of the edit history
+
+class _History:
+    def __init__(self, rnd:random.Random):
+        self.rnd = rnd
+        self.events = []
+        self.seconds = 8 * 3600
+        self.next_connector = 1
+        self.next_element = 1
+
+    def _geometry(self, w:int = 90, h:int = 60) -> str:
+        return "(x={0},y={1},w={2},h={3})".format(self.rnd.randint(0, 1500), self.rnd.randint(0, 3000), w, h)
+
+    def event(self, action:str, attribute:str):
+        self.seconds += self.rnd.choice((1, 1, 2, 3, 5, 8, 30))
+        clock = "{0:02d} : {1:02d} : {2:02d}".format(self.seconds // 3600 % 24, self.seconds // 60 % 60, self.seconds % 60)
+        self.events.append(
+            "<event>\n<id_event>{0}</id_event><time>{1}</time><time2>{1}</time2><user>generator</user>"
+            "<action>{2}</action><attribute>{3}</attribute><typology /><comments />"
+            "<added_by_user>false</added_by_user>\n</event>\n".format(
+                len(self.events) + 1, clock, escape(action), escape(attribute)))
+
+    def insert_entity(self, kind:str, idd:int):
+        self.event("Insert Entity", "[{0}, {1}, {0} ({2}), {2}]".format(kind, self._geometry(), idd))
+
+    def entity_text(self, kind:str, idd:int, text:str):
+        self.event("Change Concept Entity text", "[{0} ({1}), {2}, {3}]".format(kind, idd, text, self._geometry()))
+
+    def insert_relationship(self, cid:int, kind1:str, id1:int, kind2:str, id2:int):
+        xy = "(x={0},y={1})".format(self.rnd.randint(0, 1500), self.rnd.randint(0, 3000))
+        self.event("Insert Concept Relationship", "[qualitative, qualitative ({0}), {1}, {0}, {2} ({3}), {4} ({5})]".format(
+            cid, xy, kind1, id1, kind2, id2))
+
+    def relationship_text(self, cid:int, text:str):
+        self.event("Change Concept Relationship text", "[qualitative ({0}), {1}, {2}]".format(cid, text, self._geometry(41, 33)))
+
+    def arrow_added(self, cid:int, kind:str, idd:int):
+        self.event("Concept arrow added", "[qualitative ({0}), {1} ({2})]".format(cid, kind, idd))
+
+    def move(self, kind:str, idd:int):
+        self.event("Move object", "[{0} ({1}), {2}]".format(kind, idd, self._geometry()))
+
+    def delete_objects(self, objects):
+        self.event("Delete objects", "[" + ", ".join("{0} ({1})".format(k, i) for k, i in objects) + "]")
+
+    def xml(self) -> str:
+        return "<log_file>\n<events>\n" + "".join(self.events) + "</events>\n</log_file>\n"
+
+## history_of : Function(rnd,fc,churn)
+##     where churn = extra editing episodes per element
+##
+## Functionality:
+##     Returns the history.xml text which draws the Flowchart. The elements
+##     and relationships are drawn in a random order, with churn episodes
+##     mixed in which leave the final diagram unchanged.
+
+def history_of(rnd:random.Random, fc:Flowchart, churn:float = 0.0) -> str:
+    h = _History(rnd)
+    ids = {}
+    drawn = []
+    order = list(fc.kinds)
+    rnd.shuffle(order)
+
+    def churn_episode():
+        if not drawn:
+            return
+        x = rnd.choice(drawn)
+        choice = rnd.random()
+        if choice < 0.4:
+            h.move(fc.kinds[x], ids[x])
+        elif choice < 0.7:
+            ## A scratch element with a relationship, deleted again
+            h.next_element += 1
+            scratch = h.next_element
+            h.insert_entity("Process", scratch)
+            h.entity_text("Process", scratch, "tmp = {0}".format(rnd.randint(0, 99)))
+            cid = h.next_connector
+            h.next_connector += 1
+            h.insert_relationship(cid, "Process", scratch, fc.kinds[x], ids[x])
+            h.delete_objects([("Process", scratch), ("qualitative", cid)])
+        elif choice < 0.85 and drawn_edges:
+            ## An arrow moved to another element and back
+            cid, target = rnd.choice(drawn_edges)
+            other = rnd.choice(drawn)
+            h.arrow_added(cid, fc.kinds[other], ids[other])
+            h.arrow_added(cid, fc.kinds[target], ids[target])
+        elif fc.texts[x]:
+            ## A text written wrong first
+            h.entity_text(fc.kinds[x], ids[x], "draft")
+            h.entity_text(fc.kinds[x], ids[x], fc.texts[x])
+
+    drawn_edges = []
+    episodes = churn * (len(fc.kinds) + len(fc.edges))
+    per_step = episodes / max(1, len(fc.kinds) + len(fc.edges))
+
+    def maybe_churn():
+        n = int(per_step) + (rnd.random() < per_step - int(per_step))
+        for _ in range(n):
+            churn_episode()
+
+    for x in order:
+        h.next_element += 1
+        ids[x] = h.next_element
+        drawn.append(x)
+        h.insert_entity(fc.kinds[x], ids[x])
+        if fc.texts[x]:
+            h.entity_text(fc.kinds[x], ids[x], fc.texts[x])
+        maybe_churn()
+
+    edges = list(fc.edges)
+    rnd.shuffle(edges)
+    for a, b, label in edges:
+        cid = h.next_connector
+        h.next_connector += 1
+        h.insert_relationship(cid, fc.kinds[a], ids[a], fc.kinds[b], ids[b])
+        if label is not None:
+            h.relationship_text(cid, label)
+        drawn_edges.append((cid, b))
+        maybe_churn()
+
+    return h.xml()
+
+## synergo_bytes : Function(xml_text,name)
+##
+## Functionality:
+##     Returns the .synergo archive holding [xml_text] as <name>.history.xml,
+##     encoded like Synergo does (UTF-16 big endian with a byte order mark)
+
+def synergo_bytes(xml_text:str, name:str = "model") -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zip_f:
+        zip_f.writestr(name + ".history.xml", codecs.BOM_UTF16_BE + xml_text.encode("utf-16-be"))
+    return out.getvalue()
+
+## generate : Function(elements,depth,loops,churn,seed)
+##
+## Functionality:
+##     Returns (the .synergo archive as bytes, the expected Python text)
+##     of a random model (see random_program and history_of)
+
+def generate(elements:int = 50, depth:int = 3, loops:int = 1, churn:float = 0.0, seed:int = 0,
+             name:str = "model"):
+    rnd = random.Random(seed)
+    program = random_program(rnd, elements, depth, loops)
+    fc = flowchart_of(rnd, program)
+    return synergo_bytes(history_of(rnd, fc, churn), name), program_text(program)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write random, valid .synergo models.")
+    parser.add_argument("output", help="path of the .synergo file to write")
+    parser.add_argument("-n", "--elements", type=int, default=50, help="number of flowchart elements (default: 50)")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="decision nesting depth (default: 3)")
+    parser.add_argument("-l", "--loops", type=int, default=1, help="number of while loops (default: 1)")
+    parser.add_argument("-c", "--churn", type=float, default=0.0,
+                        help="extra editing episodes per element and relationship (default: 0)")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("--expected", help="also write the expected Python text to this path")
+    args = parser.parse_args(argv)
+    if args.loops > 0 and args.depth < 1:
+        parser.error("--loops needs a --depth of 1 or more")
+
+    data, expected = generate(args.elements, args.depth, args.loops, args.churn, args.seed)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    if args.expected:
+        with open(args.expected, "w", encoding="utf-8") as f:
+            f.write(expected)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Take the submissions: converted .py programs, or .synergo models which
+#   are converted first
+# - Run every program once for every test case: the case's stdin is fed
+#   to the program and what it prints is compared with the case's stdout
+# - Every run is its own process with limits on CPU time, memory and
+#   output size, and a wall clock timeout after which the whole process
+#   group is killed, so an endless "while" never holds up the others.
+#   It runs in an empty temporary folder of its own, never next to the
+#   other submissions
+# - The runs go in parallel, [jobs] at a time
+# - The prompts of input() are not printed, so the expected stdout only
+#   holds what the program prints itself
+# - Report pass/fail for every submission, and why every failed case failed
+#
+# The cases file is JSON, a list of
+#     {"name": "positive", "stdin": "1\n2\n3\n", "stdout": "W:  6\n"}
+
+import argparse
+import errno
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import codegen
+import convert
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_CPU_SECONDS = 2
+DEFAULT_MEMORY_MB = 256
+DEFAULT_OUTPUT_KB = 1024
+
+## _BOOTSTRAP : Runs inside the child process before the program:
+##     sets the limits, replaces input() with one which does not print
+##     its prompt, then runs the program as __main__
+##     argv = [program path, cpu seconds, memory bytes, output bytes, echo prompts]
+
+_BOOTSTRAP = """
+import builtins, resource, runpy, sys
+path, cpu, memory, output, echo = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), sys.argv[5] == "1"
+resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+if memory > 0:
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+resource.setrlimit(resource.RLIMIT_FSIZE, (output, output))
+def _input(prompt=""):
+    if echo:
+        sys.stdout.write(str(prompt))
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError("EOF when reading a line")
+    return line.rstrip("\\n")
+builtins.input = _input
+sys.argv = [path]
+runpy.run_path(path, run_name="__main__")
+"""
+
+## Limits : The limits of every run
+##     where timeout = wall clock seconds
+##           cpu = CPU seconds
+##           memory_mb = address space in MB (0 for no limit)
+##           output_kb = size of the output in KB
+##           echo_prompts = print the prompts of input() like a terminal would
+
+class Limits:
+    def __init__(self, timeout:float = DEFAULT_TIMEOUT, cpu:int = DEFAULT_CPU_SECONDS,
+                 memory_mb:int = DEFAULT_MEMORY_MB, output_kb:int = DEFAULT_OUTPUT_KB, echo_prompts:bool = False):
+        self.timeout = timeout
+        self.cpu = cpu
+        self.memory_mb = memory_mb
+        self.output_kb = output_kb
+        self.echo_prompts = echo_prompts
+
+## load_cases : Function(path)
+##
+## Functionality:
+##     Returns the list of cases of the JSON file at [path]. Every case
+##     gets a name ("case N") if it has none.
+
+def load_cases(path:str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        cases = json.load(f)
+    if not isinstance(cases, list):
+        raise ValueError("{0}: the cases must be a JSON list".format(path))
+    for i, case in enumerate(cases):
+        case.setdefault("name", "case {0}".format(i + 1))
+        case.setdefault("stdin", "")
+        if "stdout" not in case:
+            raise ValueError("{0}: {1} has no stdout".format(path, case["name"]))
+    return cases
+
+## same_output : Function(actual,expected)
+##
+## Functionality:
+##     Compares the outputs ignoring the whitespace at the end of every
+##     line and the empty lines at the end
+
+def same_output(actual:str, expected:str) -> bool:
+    def lines(text):
+        return [x.rstrip() for x in text.rstrip().splitlines()]
+    return lines(actual) == lines(expected)
+
+## run_case : Function(program_path,case,limits)
+##
+## Functionality:
+##     Runs the program once on the stdin of [case] and returns
+##     {"name", "status", "detail"} where status is "pass", "fail"
+##     (wrong output), "timeout", "cpu" (CPU limit), "memory", "output"
+##     (too much output) or "error" (the program raised)
+
+def run_case(program_path:str, case:dict, limits:Limits) -> dict:
+    result = {"name": case["name"], "status": "pass", "detail": ""}
+    output_bytes = limits.output_kb * 1024
+    argv = [sys.executable, "-I", "-S", "-c", _BOOTSTRAP, os.path.abspath(program_path), str(limits.cpu),
+            str(limits.memory_mb * 1024 * 1024), str(output_bytes), "1" if limits.echo_prompts else "0"]
+
+    with tempfile.TemporaryFile() as stdin_f, tempfile.TemporaryFile() as stdout_f, \
+            tempfile.TemporaryFile() as stderr_f, tempfile.TemporaryDirectory() as run_dir:
+        stdin_f.write(case["stdin"].encode("utf-8"))
+        stdin_f.seek(0)
+
+        ## A session of its own, so the whole group can be killed
+        process = subprocess.Popen(argv, stdin=stdin_f, stdout=stdout_f, stderr=stderr_f,
+                                   start_new_session=True, cwd=run_dir)
+        try:
+            returncode = process.wait(timeout=limits.timeout)
+        except subprocess.TimeoutExpired:
+            _kill_group(process)
+            result.update(status="timeout", detail="killed after {0}s".format(limits.timeout))
+            return result
+        _kill_group(process)
+
+        stdout_f.seek(0)
+        stdout = stdout_f.read(output_bytes + 1).decode("utf-8", "replace")
+        stderr_f.seek(0)
+        stderr = stderr_f.read(64 * 1024).decode("utf-8", "replace")
+
+    if returncode == -signal.SIGXCPU or returncode == -signal.SIGKILL:
+        result.update(status="cpu", detail="over {0}s of CPU".format(limits.cpu))
+    elif returncode != 0:
+        last = stderr.strip().splitlines()[-1] if stderr.strip() else "exit status {0}".format(returncode)
+        if last.startswith("MemoryError"):
+            result.update(status="memory", detail="over {0} MB".format(limits.memory_mb))
+        elif returncode == -signal.SIGXFSZ or "[Errno {0}]".format(errno.EFBIG) in last:
+            ## Python ignores SIGXFSZ, the write fails with EFBIG instead
+            result.update(status="output", detail="printed more than {0} KB".format(limits.output_kb))
+        else:
+            result.update(status="error", detail=last)
+    elif not same_output(stdout, case["stdout"]):
+        result.update(status="fail", detail="expected {0!r}, got {1!r}".format(case["stdout"], stdout))
+    return result
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    process.wait()
+
+## prepare : Function(path,work_dir)
+##
+## Functionality:
+##     Returns the path of the program to run for the submission at
+##     [path]: the file itself for a .py file, the compiled program
+##     (a .pyc written in [work_dir], see codegen.py) for a .synergo
+##     model. Raises convert.StructureError when the model cannot be
+##     converted or an element is not valid Python.
+
+def prepare(path:str, work_dir:str) -> str:
+    if not path.endswith(".synergo"):
+        return path
+    code = codegen.compile_flowchart(path)
+    fd, program_path = tempfile.mkstemp(suffix=".pyc", dir=work_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(codegen.pyc_bytes(code))
+    return program_path
+
+## grade : Function(submissions,cases,limits,jobs)
+##
+## Functionality:
+##     Runs every case of every submission on [jobs] parallel runs
+##     (default: number of cores) and returns one report per submission:
+##     {"submission", "passed", "total", "status", "cases"} where status
+##     is "pass", "fail" or "structure" (the model did not convert)
+
+def grade(submissions, cases, limits:Limits = None, jobs:int = None) -> list:
+    limits = limits or Limits()
+    reports = []
+    with tempfile.TemporaryDirectory() as work_dir, \
+            ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        runs = []
+        for path in submissions:
+            report = {"submission": path, "passed": 0, "total": len(cases), "status": "pass", "cases": []}
+            reports.append(report)
+            try:
+                program_path = prepare(path, work_dir)
+            except convert.StructureError as e:
+                report.update(status="structure", detail=str(e))
+                continue
+            except Exception as e:
+                report.update(status="structure", detail="{0}: {1}".format(type(e).__name__, e))
+                continue
+            for case in cases:
+                runs.append((report, executor.submit(run_case, program_path, case, limits)))
+
+        for report, future in runs:
+            result = future.result()
+            report["cases"].append(result)
+            if result["status"] == "pass":
+                report["passed"] += 1
+            else:
+                report["status"] = "fail"
+    return reports
+
+## unique_submissions : Function(paths)
+##
+## Functionality:
+##     Keeps one submission per student: when both x.synergo and x.py
+##     are given (the batch conversion writes x.py next to x.synergo),
+##     only the model x.synergo is kept
+
+def unique_submissions(paths) -> list:
+    models = {x[:-len(".synergo")] for x in paths if x.endswith(".synergo")}
+    return [x for x in paths if not (x.endswith(".py") and x[:-len(".py")] in models)]
+
+## print_report : Function(reports,stream)
+
+def print_report(reports, stream = sys.stdout):
+    for report in reports:
+        if report["status"] == "structure":
+            print("[StructureError] {0}: {1}".format(report["submission"], report["detail"]), file=stream)
+            continue
+        label = "PASS" if report["status"] == "pass" else "FAIL"
+        print("[{0}] {1}: {2}/{3}".format(label, report["submission"], report["passed"], report["total"]), file=stream)
+        for result in report["cases"]:
+            if result["status"] != "pass":
+                print("    {0}: {1} {2}".format(result["name"], result["status"], result["detail"]), file=stream)
+
+    passed = sum(1 for r in reports if r["status"] == "pass")
+    print("", file=stream)
+    print("{0} submissions: {1} passed, {2} failed".format(len(reports), passed, len(reports) - passed), file=stream)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run converted programs against test cases.")
+    parser.add_argument("cases", help="JSON file with the cases: [{\"name\", \"stdin\", \"stdout\"}, ...]")
+    parser.add_argument("submissions", nargs="+", help=".py programs, .synergo models, directories or globs")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="parallel runs (default: number of cores)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="wall clock seconds per run (default: 5)")
+    parser.add_argument("--cpu", type=int, default=DEFAULT_CPU_SECONDS, help="CPU seconds per run (default: 2)")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_MB, help="MB of memory per run, 0 for no limit (default: 256)")
+    parser.add_argument("--output", type=int, default=DEFAULT_OUTPUT_KB, help="KB of output per run (default: 1024)")
+    parser.add_argument("--echo-prompts", action="store_true", help="the expected stdout includes the prompts of input()")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    import batch
+    submissions = []
+    for pattern in args.submissions:
+        if os.path.isdir(pattern):
+            found = sorted(set(batch.collect_inputs([pattern])) |
+                           {os.path.join(d, f) for d, _, files in os.walk(pattern) for f in files if f.endswith(".py")})
+        else:
+            found = batch.collect_inputs([pattern])
+        submissions.extend(x for x in found if x not in submissions)
+    submissions = unique_submissions(submissions)
+    if not submissions:
+        print("No submissions found.", file=sys.stderr)
+        return 1
+
+    limits = Limits(args.timeout, args.cpu, args.memory, args.output, args.echo_prompts)
+    reports = grade(submissions, load_cases(args.cases), limits, args.jobs)
+    if args.json:
+        print(json.dumps(reports, indent=1))
+    else:
+        print_report(reports)
+    return 0 if all(r["status"] == "pass" for r in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
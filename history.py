@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Read the history of a model once and keep its events, so the diagram
+#   (and its program) can be rebuilt as it was after any event N
+# - While the history is read, a snapshot of the replay state is kept
+#   (see Converter.snapshot) every [interval] events which change the
+#   diagram, or every as many changes as the diagram has elements and
+#   connectors if that is more, so the snapshots never cost more than the
+#   replay itself. Going to event N restores the last snapshot before it
+#   and applies the few changes after it, instead of replaying from the
+#   start
+# - Moving, resizing and the other events which change nothing are only
+#   counted, never kept
+# - programs() steps through the history once and yields every different
+#   valid program the student had on the way
+#
+# Event numbers count every <event> of the history from 1, event 0 is
+# the empty diagram before the first one.
+
+import argparse
+import bisect
+import sys
+from array import array
+
+import convert
+
+SNAPSHOT_INTERVAL = 64
+
+## History : The seekable history of a single model
+##     where source = path of the .synergo file, or its bytes
+##                    or an open binary file (see convert.open_history)
+##           interval = the fewest changing events between two snapshots
+##
+## Attributes:
+##     events : number of <event> elements in the history
+##     changes : [(action, attribute)] of the events which change the diagram
+##     positions : the event number of every change, in order
+##     ids : the id_event of every event (0 when it has none)
+##     snapshots : the replay states kept
+##     snapshot_changes : the number of changes applied in every snapshot
+
+class History:
+    def __init__(self, source, interval:int = SNAPSHOT_INTERVAL):
+        self.interval = interval
+        self.changes = []
+        self.positions = array("l")
+        self.ids = array("l")
+
+        converter = convert.Converter()
+        self.snapshots = [converter.snapshot()]
+        self.snapshot_changes = array("l", [0])
+        with convert.open_history(source) as xml_f:
+            for el in convert.iter_events(xml_f):
+                action, attr_str, id_event = converter.step(el)
+                self.ids.append(id_event or 0)
+                if attr_str is not None:
+                    self.changes.append((action, attr_str))
+                    self.positions.append(len(self.ids))
+                    size = len(converter.elements) + len(converter.connectors)
+                    if len(self.changes) - self.snapshot_changes[-1] >= max(interval, size):
+                        self.snapshots.append(converter.snapshot())
+                        self.snapshot_changes.append(len(self.changes))
+        self.events = len(self.ids)
+
+    def __len__(self):
+        return self.events
+
+    ## index_of : Function(id_event)
+    ##
+    ## Functionality:
+    ##     The event number of the event with [id_event]. Raises KeyError
+    ##     when there is none.
+
+    def index_of(self, id_event:int) -> int:
+        for n, x in enumerate(self.ids):
+            if x == id_event:
+                return n + 1
+        raise KeyError(id_event)
+
+    ## converter_at : Function(n)
+    ##
+    ## Functionality:
+    ##     Returns a new Converter holding the replay state after event [n]:
+    ##     the closest snapshot, and the changes after it up to [n]
+
+    def converter_at(self, n:int):
+        if not 0 <= n <= self.events:
+            raise IndexError("event {0} is not in 0..{1}".format(n, self.events))
+
+        applied = bisect.bisect_right(self.positions, n)
+        base = bisect.bisect_right(self.snapshot_changes, applied) - 1
+        converter = convert.Converter()
+        converter.restore(self.snapshots[base])
+        for action, attr_str in self.changes[self.snapshot_changes[base]:applied]:
+            converter.apply_event(action, attr_str)
+        converter.last_id_event = self.ids[n - 1] if n else None
+        converter.events_applied = n
+        return converter
+
+    ## convert_at : Function(n)
+    ##
+    ## Functionality:
+    ##     The generated Python text of the diagram after event [n]. Raises
+    ##     StructureError when the diagram is not a valid flowchart then.
+
+    def convert_at(self, n:int) -> str:
+        return "".join(self.converter_at(n).lines())
+
+    ## programs : Function()
+    ##
+    ## Functionality:
+    ##     Generator of (event number, id_event, text) for every event after
+    ##     which the diagram is a valid flowchart with a program different
+    ##     from the one before. The changes are applied one after the other
+    ##     on a single Converter. A diagram with more than one element
+    ##     without incoming, or without outgoing, connectors is skipped by
+    ##     counting alone, any other invalid one is rejected by
+    ##     Converter.validate before anything is built.
+
+    def programs(self):
+        converter = convert.Converter()
+        previous = None
+        for (action, attr_str), n in zip(self.changes, self.positions):
+            converter.apply_event(action, attr_str)
+            count = len(converter.elements)
+            if count - len(converter.incoming) > 1 or count - len(converter.sxeseis) > 1:
+                continue
+            try:
+                text = "".join(converter.lines())
+            except convert.StructureError:
+                continue
+            if text != previous:
+                previous = text
+                yield n, self.ids[n - 1], text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the program of a model as it was at any point of its history.")
+    parser.add_argument("input_file_path")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--at", type=int, metavar="N", help="the program after event number N")
+    group.add_argument("--id", type=int, metavar="ID", help="the program after the event with id_event ID")
+    group.add_argument("--steps", action="store_true", help="every different valid program on the way (default)")
+    parser.add_argument("--interval", type=int, default=SNAPSHOT_INTERVAL,
+                        help="fewest changes between two snapshots (default: 64)")
+    args = parser.parse_args(argv)
+
+    history = History(args.input_file_path, args.interval)
+    if args.at is not None or args.id is not None:
+        n = args.at if args.at is not None else history.index_of(args.id)
+        try:
+            sys.stdout.write(history.convert_at(n))
+        except convert.StructureError as e:
+            print("[StructureError] event {0}: {1}".format(n, e), file=sys.stderr)
+            return 1
+        return 0
+
+    for n, id_event, text in history.programs():
+        print("## event {0} (id_event {1})".format(n, id_event))
+        sys.stdout.write(text)
+        print("")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Save the structured Elements graph of a model (kinds after the loops
+#   were found, Yes/No roads and meeting points) as a small binary file,
+#   so grading, similarity and drawing tools can load it without the
+#   archive, the replay or the structuring
+# - The file is a header followed by columns of fixed size integers and
+#   a table of the element texts, each text stored once. Loading only
+#   reads the header: the columns are memoryviews over the bytes, or over
+#   a memory mapped file, and a text is decoded when it is asked for
+# - The file carries its format version and the converter version, and
+#   a file of another version is refused
+#
+# Layout (little endian):
+#     header   : "SGIR", format version, 0, node count, first node,
+#                last node, string count, string bytes
+#     columns  : id (int32), kind (uint8), text (uint32 string number),
+#                to, no, meet (int32 node numbers, -1 for none)
+#                every column padded to a multiple of 4 bytes
+#     strings  : offsets (uint32, string count + 1), then the UTF-8 bytes.
+#                String 0 is the CONVERTER_VERSION.
+#
+# Nodes are referred to by their number (0 .. node count - 1), not by
+# their element id, so following a road never needs a lookup.
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+import convert
+from convert import Kind
+
+MAGIC = b"SGIR"
+IR_VERSION = 1
+HEADER = struct.Struct("<4sHHIiiII")
+IR_SUFFIX = ".sgir"
+
+def _padded(size:int) -> int:
+    return (size + 3) & ~3
+
+## dumps : Function(converter)
+##     where converter = a Converter after structure() (see Converter.lines)
+##
+## Functionality:
+##     Returns the IR of the structured graph of [converter] as bytes
+
+def dumps(converter) -> bytes:
+    Elements = converter.Elements
+    ids = list(Elements)
+    index = {x: i for i, x in enumerate(ids)}
+    strings = {convert.CONVERTER_VERSION: 0}
+
+    id_col, kind_col, text_col = array("i"), array("B"), array("I")
+    to_col, no_col, meet_col = array("i"), array("i"), array("i")
+    for x in ids:
+        el = Elements[x]
+        id_col.append(x)
+        kind_col.append(int(el.kind))
+        text_col.append(strings.setdefault(el.text, len(strings)))
+        to_col.append(index[el.to] if el.to is not None else -1)
+        no_col.append(index[el.no] if el.no is not None else -1)
+        meet_col.append(index[el.meet] if el.meet is not None else -1)
+
+    encoded = [x.encode("utf-8") for x in strings]
+    offsets = array("I", [0])
+    for x in encoded:
+        offsets.append(offsets[-1] + len(x))
+
+    parts = [HEADER.pack(MAGIC, IR_VERSION, 0, len(ids), index[converter.first_el], index[converter.last_el],
+                         len(encoded), offsets[-1])]
+    columns = (id_col, kind_col, text_col, to_col, no_col, meet_col, offsets)
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+    for column in columns:
+        data = column.tobytes()
+        parts.append(data + bytes(_padded(len(data)) - len(data)))
+    parts.extend(encoded)
+    return b"".join(parts)
+
+## save : Function(converter,path)
+##
+## Functionality:
+##     Writes the IR of [converter] to [path], atomically
+
+def save(converter, path:str):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(dumps(converter))
+    os.replace(temp_path, path)
+
+## structured, compile_ir : Function(source)
+##
+## Functionality:
+##     Converts the model [source] (see convert.open_history) as far as
+##     the structured graph and returns the Converter, or its IR
+
+def structured(source):
+    c = convert.Converter()
+    c.reset()
+    with convert.open_history(source) as xml_f:
+        c.replay(xml_f)
+    c.lines()
+    return c
+
+def compile_ir(source) -> bytes:
+    return dumps(structured(source))
+
+## IRGraph : A loaded IR
+##     where buffer = the bytes of the IR, or any object with the buffer
+##                    interface such as an mmap (see IRGraph.open)
+##
+## Attributes:
+##     ids, kinds, texts, to, no, meet : the columns, indexed by node number
+##     first, last : the numbers of the starting and ending nodes
+##
+## Raises ValueError for a file which is not an IR of this version.
+
+class IRGraph:
+    def __init__(self, buffer):
+        self._mmap = None
+        self._view = memoryview(buffer)
+        self._views = [self._view]
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self):
+        if len(self._view) < HEADER.size:
+            raise ValueError("not a graph IR: too short")
+        magic, version, _, n, self.first, self.last, string_count, string_bytes = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            raise ValueError("not a graph IR")
+        if version != IR_VERSION:
+            raise ValueError("graph IR version {0}, expected {1}".format(version, IR_VERSION))
+
+        layout = (("i", n), ("B", n), ("I", n), ("i", n), ("i", n), ("i", n), ("I", string_count + 1))
+        sizes = [count * array(code).itemsize for code, count in layout]
+        if len(self._view) < HEADER.size + sum(_padded(x) for x in sizes) + string_bytes:
+            raise ValueError("not a graph IR: truncated")
+
+        offset = HEADER.size
+        columns = []
+        for (code, _), size in zip(layout, sizes):
+            columns.append(self._column(offset, size, code))
+            offset += _padded(size)
+        self.ids, self.kinds, self.texts, self.to, self.no, self.meet, self._offsets = columns
+        self._strings = offset
+
+        if self.string(0) != convert.CONVERTER_VERSION:
+            raise ValueError("graph IR made by converter version {0}, this is {1}".format(
+                self.string(0), convert.CONVERTER_VERSION))
+
+    def _column(self, offset:int, size:int, code:str):
+        data = self._view[offset:offset + size]
+        if sys.byteorder == "little":
+            column = data.cast(code)
+            self._views.extend((data, column))
+            return column
+        column = array(code)
+        column.frombytes(data)
+        column.byteswap()
+        data.release()
+        return column
+
+    ## open : Function(path)
+    ##
+    ## Functionality:
+    ##     Loads the IR file at [path] memory mapped, so only the pages
+    ##     which are read are ever loaded
+
+    @classmethod
+    def open(cls, path:str):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            graph = cls(mapped)
+        except Exception:
+            mapped.close()
+            raise
+        graph._mmap = mapped
+        return graph
+
+    ## close : Function()
+    ##
+    ## Functionality:
+    ##     Releases the columns and unmaps the file. The graph cannot be
+    ##     read after this.
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def string(self, k:int) -> str:
+        start = self._strings + self._offsets[k]
+        return str(self._view[start:self._strings + self._offsets[k + 1]], "utf-8")
+
+    def kind(self, i:int) -> Kind:
+        return Kind(self.kinds[i])
+
+    def text(self, i:int) -> str:
+        return self.string(self.texts[i])
+
+    ## elements : Function()
+    ##
+    ## Functionality:
+    ##     Returns the graph as {element id: convert.Node}, the same as the
+    ##     Elements of the Converter it was saved from
+
+    def elements(self) -> dict:
+        ids = self.ids
+        ref = lambda x: ids[x] if x >= 0 else None
+        Elements = {}
+        for i in range(len(ids)):
+            node = convert.Node(ids[i], Kind(self.kinds[i]), self.text(i))
+            node.to, node.no, node.meet = ref(self.to[i]), ref(self.no[i]), ref(self.meet[i])
+            Elements[node.id] = node
+        return Elements
+
+    ## converter : Function()
+    ##
+    ## Functionality:
+    ##     Returns a Converter holding the graph as if it had been replayed
+    ##     and structured, ready for Converter.build or codegen.build_module
+
+    def converter(self):
+        c = convert.Converter()
+        c.Elements = self.elements()
+        c.first_el = self.ids[self.first]
+        c.last_el = self.ids[self.last]
+        return c
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Save the structured graph of a model as IR, or print a saved one.")
+    parser.add_argument("input", help=".synergo model, or " + IR_SUFFIX + " file with --dump")
+    parser.add_argument("output", nargs="?", help="IR file to write (default: the input name with " + IR_SUFFIX + ")")
+    parser.add_argument("--dump", action="store_true", help="print the nodes of an IR file and its program")
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        with IRGraph.open(args.input) as graph:
+            for i in range(len(graph)):
+                print("{0:>4} {1:>6} {2:<10} to={3} no={4} meet={5} {6!r}".format(
+                    i, graph.ids[i], graph.kind(i).name, graph.to[i], graph.no[i], graph.meet[i], graph.text(i)))
+            c = graph.converter()
+            print("")
+            sys.stdout.write("".join(c.build(c.first_el, c.last_el, 0)))
+        return 0
+
+    output = args.output or os.path.splitext(args.input)[0] + IR_SUFFIX
+    save(structured(args.input), output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
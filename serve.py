@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Listen on localhost (HTTP) or on a Unix socket for .synergo uploads:
+#   POST the bytes of the file to /convert
+# - The conversions run on a pool of worker processes started once,
+#   with the converter already imported, so a request never pays for a
+#   new interpreter
+# - At most [workers] conversions run at once and at most [queue_size]
+#   more requests wait for a free worker. Anything above that is refused
+#   straight away with 503, before its upload is read, so a spike never
+#   piles up unbounded work or memory
+# - A conversion which takes longer than [timeout] seconds gets 504 and
+#   its worker is killed and replaced
+# - Replies:
+#     200 the generated Python text
+#     422 StructureError as JSON {"error", "er_id", "format", "elements",
+#         "errors", "message"}, "errors" listing every problem of the model
+#     400 a broken upload (not a .synergo archive), 413 too large
+#     500 the conversion failed or the worker died, 503 busy, 504 timeout
+#   GET /health returns the state of the pool as JSON
+# - request() is the client, for the LMS side and for tests
+
+import argparse
+import errno
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import convert
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+DEFAULT_QUEUE_SIZE = 16
+DEFAULT_TIMEOUT = 30.0
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+
+## ServerError : A reply of the server which is neither a program nor a
+##               StructureError
+##     where status = the HTTP status
+##           error = the "error" field of the reply ("Busy", "Timeout", ...)
+
+class ServerError(Exception):
+    def __init__(self, status:int, error:str, message:str = ""):
+        Exception.__init__(self, "{0} {1}: {2}".format(status, error, message) if message else "{0} {1}".format(status, error))
+        self.status = status
+        self.error = error
+        self.message = message
+
+## parse_address : Function(address)
+##
+## Functionality:
+##     Returns ("unix", path) for "unix:/path" or anything with a "/" in it,
+##     and ("tcp", (host, port)) for "host:port" or ":port"
+
+def parse_address(address:str):
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if "/" in address:
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+## _worker_main : Function(conn,cache_options)
+##
+## Functionality:
+##     The loop of a worker process: receives the bytes of a model on
+##     [conn] and sends back ("ok", text), ("structure", error fields),
+##     ("bad", message) when the bytes do not open as a .synergo archive
+##     or ("error", message) when the conversion itself failed
+
+def _worker_main(conn, cache_options):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    conversion_cache = None
+    if cache_options is not None:
+        import cache
+        conversion_cache = cache.ConversionCache(*cache_options)
+
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+
+        try:
+            with convert.open_history(data):
+                pass
+        except Exception as e:
+            conn.send(("bad", "{0}: {1}".format(type(e).__name__, e)))
+            continue
+
+        try:
+            if conversion_cache is None:
+                reply = ("ok", convert.convert(data))
+            else:
+                reply = ("ok", cache.convert_cached(data, conversion_cache))
+        except convert.StructureError as e:
+            reply = ("structure", dict(e.fields(), message=str(e)))
+        except Exception as e:
+            reply = ("error", "{0}: {1}".format(type(e).__name__, e))
+        conn.send(reply)
+
+## _Worker : A worker process and the parent end of its pipe
+
+class _Worker:
+    def __init__(self, context, cache_options):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, cache_options), daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+## WorkerPool : The warm worker processes
+##     where workers = the number of worker processes (default: number of cores)
+##           queue_size = how many requests may wait for a free worker
+##           timeout = seconds a single conversion may take
+##           cache_options = (cache directory, size limit) or None, see cache.py
+##
+## run(data) returns (status, payload) where status is "ok", "structure",
+## "bad" (the upload could not be read), "error" (the converter failed),
+## "crashed" (the worker died and was replaced), "busy" or "timeout".
+## The same is done in two steps by taking a slot() first and then
+## calling convert(data) while holding it.
+
+class WorkerPool:
+    def __init__(self, workers:int = None, queue_size:int = DEFAULT_QUEUE_SIZE, timeout:float = DEFAULT_TIMEOUT,
+                 cache_options = None):
+        self.size = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.cache_options = cache_options
+        ## New workers are forked from a server process which has the
+        ## converter imported already, never from the threads of this one
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context("forkserver")
+            self.context.set_forkserver_preload(["convert", "serve"])
+        else:
+            self.context = multiprocessing.get_context("spawn")
+
+        ## slots : one for every request running or waiting
+        ## idle : the workers free to take a request
+        self.slots = threading.BoundedSemaphore(self.size + queue_size)
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.restarts = 0
+        for _ in range(self.size):
+            self.idle.put(_Worker(self.context, cache_options))
+
+    def run(self, data:bytes):
+        with self.slot() as free:
+            if not free:
+                return "busy", None
+            return self.convert(data)
+
+    ## slot : Function()
+    ##
+    ## Functionality:
+    ##     Context manager taking the place of one request, running or
+    ##     waiting. Yields False straight away when every place is taken.
+
+    @contextmanager
+    def slot(self):
+        if not self.slots.acquire(blocking=False):
+            yield False
+            return
+
+        with self.lock:
+            self.pending += 1
+        try:
+            yield True
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+
+    ## convert : Function(data)
+    ##
+    ## Functionality:
+    ##     Converts [data] on the next free worker, waiting for one. The
+    ##     caller holds a slot().
+
+    def convert(self, data:bytes):
+        worker = self.idle.get()
+        try:
+            worker.conn.send_bytes(data)
+            if not worker.conn.poll(self.timeout):
+                worker = self._replace(worker)
+                return "timeout", None
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            return "crashed", "the worker process stopped"
+        finally:
+            self.idle.put(worker)
+
+    def _replace(self, worker:_Worker) -> _Worker:
+        worker.kill()
+        with self.lock:
+            self.restarts += 1
+        return _Worker(self.context, self.cache_options)
+
+    def stats(self) -> dict:
+        with self.lock:
+            pending = self.pending
+            restarts = self.restarts
+        return {"workers": self.size, "running": min(pending, self.size), "queued": max(0, pending - self.size),
+                "queue_size": self.queue_size, "restarts": restarts}
+
+    def close(self):
+        for _ in range(self.size):
+            self.idle.get().kill()
+
+## _Handler : The HTTP side, one thread per connection
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "synergo2python"
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, status:int, body:bytes, content_type:str, headers = ()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status:int, fields:dict, headers = ()):
+        self._reply(status, json.dumps(fields).encode("utf-8"), "application/json", headers)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._json(404, {"error": "NotFound", "message": self.path})
+            return
+        self._json(200, self.server.pool.stats())
+
+    def do_POST(self):
+        if self.path != "/convert":
+            self._json(404, {"error": "NotFound", "message": self.path})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._json(411, {"error": "LengthRequired"})
+            return
+        if length < 0:
+            self.close_connection = True
+            self._json(400, {"error": "BadRequest", "message": "negative Content-Length"})
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            self._json(413, {"error": "TooLarge", "message": "the limit is {0} bytes".format(MAX_UPLOAD_BYTES)})
+            return
+
+        ## A refused upload is never read, the connection is closed instead
+        with self.server.pool.slot() as free:
+            if not free:
+                self.close_connection = True
+                self._json(503, {"error": "Busy", "message": "too many requests are waiting"}, [("Retry-After", "1")])
+                return
+            data = self.rfile.read(length)
+            status, payload = self.server.pool.convert(data)
+
+        if status == "ok":
+            self._reply(200, payload.encode("utf-8"), "text/x-python; charset=utf-8")
+        elif status == "structure":
+            fields = {"error": "StructureError"}
+            fields.update(payload)
+            self._json(422, fields)
+        elif status == "timeout":
+            self._json(504, {"error": "Timeout", "message": "the conversion took longer than {0}s".format(
+                self.server.pool.timeout)})
+        elif status == "crashed":
+            self._json(500, {"error": "WorkerCrashed", "message": payload})
+        elif status == "bad":
+            self._json(400, {"error": "BadRequest", "message": payload})
+        else:
+            self._json(500, {"error": "ConversionFailed", "message": payload})
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+## _UnixServer : The server on a Unix socket
+##
+## A socket left at the path by an earlier server is replaced. Anything
+## else there (e.g. a file given by mistake) is never removed, binding
+## raises FileExistsError instead.
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        try:
+            mode = os.lstat(self.server_address).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(errno.EEXIST, "Not a socket, refusing to replace it", self.server_address)
+            os.unlink(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+## make_server : Function(address,pool,verbose)
+##
+## Functionality:
+##     Returns the server listening on [address] (see parse_address),
+##     answering with [pool]. Call serve_forever() on it, and shutdown()
+##     and pool.close() to stop it.
+
+def make_server(address:str, pool:WorkerPool, verbose:bool = False):
+    family, where = parse_address(address)
+    server_class = _UnixServer if family == "unix" else _TCPServer
+    server = server_class(where, _Handler)
+    server.pool = pool
+    server.verbose = verbose
+    return server
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+## serve : Function(address,workers,queue_size,timeout,cache_options)
+##
+## Functionality:
+##     Runs the server until interrupted (SIGINT or SIGTERM). Returns the
+##     exit status.
+
+def serve(address:str = DEFAULT_ADDRESS, workers:int = None, queue_size:int = DEFAULT_QUEUE_SIZE,
+          timeout:float = DEFAULT_TIMEOUT, cache_options = None, verbose:bool = False, stream = sys.stdout) -> int:
+    pool = WorkerPool(workers, queue_size, timeout, cache_options)
+    try:
+        server = make_server(address, pool, verbose)
+    except BaseException:
+        pool.close()
+        raise
+    print("Serving on {0} with {1} workers".format(address, pool.size), file=stream, flush=True)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, _UnixServer) and os.path.exists(server.server_address):
+            os.unlink(server.server_address)
+        pool.close()
+    return 0
+
+## _UnixHTTPConnection : http.client over a Unix socket
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path:str, timeout:float = None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def _connection(address:str, timeout:float):
+    family, where = parse_address(address)
+    if family == "unix":
+        return _UnixHTTPConnection(where, timeout)
+    return http.client.HTTPConnection(where[0], where[1], timeout=timeout)
+
+## request : Function(address,source,timeout)
+##     where source = path of the .synergo file or its bytes
+##
+## Functionality:
+##     Converts [source] on the server at [address] and returns the
+##     generated text. Raises convert.StructureError for a StructureError
+##     and ServerError for any other failure.
+
+def request(address:str, source, timeout:float = 60.0) -> str:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+
+    conn = _connection(address, timeout)
+    try:
+        conn.request("POST", "/convert", body=data, headers={"Content-Type": "application/octet-stream"})
+        response = conn.getresponse()
+        body = response.read()
+    finally:
+        conn.close()
+
+    if response.status == 200:
+        return body.decode("utf-8")
+
+    try:
+        fields = json.loads(body.decode("utf-8"))
+    except ValueError:
+        fields = {"error": response.reason, "message": body.decode("utf-8", "replace")}
+    if response.status == 422:
+        raise convert.StructureError.from_fields(fields)
+    raise ServerError(response.status, fields.get("error", ""), fields.get("message", ""))
+
+## health : Function(address)
+##
+## Functionality:
+##     Returns the /health reply of the server as a dict
+
+def health(address:str, timeout:float = 10.0) -> dict:
+    conn = _connection(address, timeout)
+    try:
+        conn.request("GET", "/health")
+        return json.loads(conn.getresponse().read().decode("utf-8"))
+    finally:
+        conn.close()
+
+## main : The client from the command line
+##     python serve.py ADDRESS model.synergo [output_file_basename]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a .synergo file on a running conversion server.")
+    parser.add_argument("address", help="host:port or the path of the Unix socket")
+    parser.add_argument("input_file_path")
+    parser.add_argument("output_file_basename", nargs="?", help="write the .py file here instead of printing it")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    try:
+        text = request(args.address, args.input_file_path, args.timeout)
+    except convert.StructureError as e:
+        print("StructureError: {0}".format(e), file=sys.stderr)
+        return 1
+    except (ServerError, OSError) as e:
+        print("Error: {0}".format(e), file=sys.stderr)
+        return 1
+
+    if args.output_file_basename:
+        convert.write_output(text, args.output_file_basename)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Small hand drawn models for the tests, written as .synergo bytes with
+#   the history writer of generate.py
+# - split_history cuts a generated history in two, for the tests of the
+#   incremental replay
+
+import random
+
+import generate
+
+START = (1, "Start-End", "Start")
+END = (2, "Start-End", "End")
+
+## model : Function(elements,edges,extra)
+##     where elements = list of (element id, kind, text)
+##           edges = list of (from, to, label) where label is "yes", "no" or None
+##           extra = (action, attribute) events written after the drawing
+##
+## Functionality:
+##     Returns the .synergo bytes of the drawing
+
+def model(elements, edges, extra = ()) -> bytes:
+    h = generate._History(random.Random(0))
+    for idd, kind, text in elements:
+        h.insert_entity(kind, idd)
+        if text:
+            h.entity_text(kind, idd, text)
+    kinds = {idd: kind for idd, kind, _ in elements}
+    for cid, (a, b, label) in enumerate(edges, 1):
+        h.insert_relationship(cid, kinds[a], a, kinds[b], b)
+        if label:
+            h.relationship_text(cid, label)
+    for action, attribute in extra:
+        h.event(action, attribute)
+    return generate.synergo_bytes(h.xml())
+
+## split_history : Function(elements,depth,loops,churn,seed,events)
+##
+## Functionality:
+##     Returns (.synergo bytes of the first [events] events, .synergo bytes
+##     of the whole history, expected program) of a generated model. The
+##     first archive holds the history as it was saved earlier, so the
+##     second one starts with the same bytes.
+
+def split_history(elements:int, depth:int, loops:int, churn:float, seed:int, events:int):
+    rnd = random.Random(seed)
+    program = generate.random_program(rnd, elements, depth, loops)
+    xml_text = generate.history_of(rnd, generate.flowchart_of(rnd, program), churn)
+
+    end = 0
+    for _ in range(events):
+        end = xml_text.index("</event>\n", end) + len("</event>\n")
+    earlier = xml_text[:end] + "</events>\n</log_file>\n"
+    return generate.synergo_bytes(earlier), generate.synergo_bytes(xml_text), generate.program_text(program)
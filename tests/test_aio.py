@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Conversions from asyncio code give the same results as convert.py
+# - as_completed never takes more sources than the limit ahead of the
+#   results it yielded
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aio
+import convert
+import generate
+from tests import models
+
+class AsyncConverterTest(unittest.TestCase):
+    def test_convert(self):
+        data, expected = generate.generate(60, 3, 1, 0.5, 1)
+        bad = models.model([models.START, models.END, (3, "Decision", "x > 1")], [(1, 3, None), (3, 2, "yes")])
+
+        async def main(path):
+            async with aio.AsyncConverter(workers=2) as converter:
+                texts = await asyncio.gather(converter.convert(data), converter.convert(path))
+                with self.assertRaises(convert.StructureErrors) as caught:
+                    await converter.convert(bad)
+                with self.assertRaises(ValueError):
+                    await converter.convert(b"not a zip")
+            return texts, caught.exception
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.synergo")
+            with open(path, "wb") as f:
+                f.write(data)
+            texts, error = asyncio.run(main(path))
+        self.assertEqual(texts, [expected, expected])
+        self.assertEqual([(x.er_id, x.elements) for x in error.errors], [(2, [3])])
+
+    def test_as_completed(self):
+        sources = [generate.generate(20 + i, 2, 1, 0.0, i) for i in range(12)]
+        sources.append((b"not a zip", None))
+
+        async def main():
+            taken = []
+            results = {}
+            ahead = 0
+
+            async def stream():
+                for data, _ in sources:
+                    taken.append(data)
+                    yield data
+
+            async with aio.AsyncConverter(workers=2, limit=3) as converter:
+                async for source, status, result in converter.as_completed(stream()):
+                    ahead = max(ahead, len(taken) - len(results))
+                    results[source] = (status, result)
+            return results, ahead
+
+        results, ahead = asyncio.run(main())
+        self.assertLessEqual(ahead, 3)
+        for data, expected in sources[:-1]:
+            self.assertEqual(results[data], ("ok", expected))
+        status, error = results[b"not a zip"]
+        self.assertEqual(status, "error")
+        self.assertIsInstance(error, ValueError)
+
+    def test_as_completed_sync(self):
+        data, expected = generate.generate(30, 2, 1, 0.0, 7)
+        bad = models.model([models.START, models.END, (3, "Decision", "x > 1")], [(1, 3, None), (3, 2, "yes")])
+
+        async def main():
+            async with aio.AsyncConverter(workers=2, limit=1) as converter:
+                return {source: (status, result) async for source, status, result in converter.as_completed([data, bad])}
+
+        results = asyncio.run(main())
+        self.assertEqual(results[data], ("ok", expected))
+        status, error = results[bad]
+        self.assertEqual(status, "structure")
+        self.assertIsInstance(error, convert.StructureError)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - A batch converts every file on a pool of workers, keeps the folders
+#   of the inputs under --out-dir, and a bad model never stops the rest
+
+import io
+import os
+import tempfile
+import unittest
+
+import batch
+import generate
+from tests import models
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+class BatchTest(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            folder, out = os.path.join(directory, "in"), os.path.join(directory, "out")
+            expected = {}
+            for seed, name in enumerate(("a/model", "b/model", "c/d/other")):
+                data, expected[name] = generate.generate(30 + seed * 10, 2, 1, 0.5, seed)
+                write(os.path.join(folder, name + ".synergo"), data)
+            write(os.path.join(folder, "bad.synergo"), models.model([models.START], [(1, 1, None)]))
+            write(os.path.join(folder, "broken.synergo"), b"not a zip")
+            write(os.path.join(folder, "notes.txt"), b"")
+
+            stream = io.StringIO()
+            status = batch.run([folder], out_dir=out, jobs=2, stream=stream)
+            self.assertEqual(status, 1)
+            self.assertIn("5 files: 3 converted, 1 StructureError, 1 other errors", stream.getvalue())
+            for name, text in expected.items():
+                with open(os.path.join(out, name + ".py"), encoding="utf-8") as f:
+                    self.assertEqual(f.read(), text)
+            self.assertFalse(os.path.exists(os.path.join(out, "bad.py")))
+
+    def test_collect_inputs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("a/x.synergo", "a/b/y.synergo", "c/z.synergo", "c/z.txt"):
+                write(os.path.join(directory, name), b"")
+            a, c = os.path.join(directory, "a"), os.path.join(directory, "c")
+            found = batch.collect_inputs([a, os.path.join(c, "*.synergo"), os.path.join(a, "x.synergo")])
+            self.assertEqual(found, sorted(os.path.normpath(os.path.join(directory, x))
+                                           for x in ("a/x.synergo", "a/b/y.synergo", "c/z.synergo")))
+
+    def test_output_path_for(self):
+        self.assertEqual(batch.output_path_for("in/a/model.synergo"), os.path.join("in", "a", "model"))
+        self.assertEqual(batch.output_path_for("in/a/model.synergo", "out", "in"), os.path.join("out", "a", "model"))
+        self.assertEqual(batch.output_path_for("elsewhere/model.synergo", "out", "in"), os.path.join("out", "model"))
+
+if __name__ == "__main__":
+    unittest.main()
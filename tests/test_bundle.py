@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Every .synergo member of a zip or tar class archive is converted into
+#   one output zip, in the order of the archive, with a manifest of the
+#   result of every member
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import bundle
+import generate
+from tests import models
+
+class BundleTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        self.members = []
+        self.expected = {}
+        for seed in range(7):
+            data, text = generate.generate(30 + seed * 5, 2, 1, 0.5, seed)
+            name = "class/student{0}/model.synergo".format(seed)
+            self.members.append((name, data))
+            self.expected["class/student{0}/model.py".format(seed)] = text
+        self.members.append(("class/bad.synergo", models.model([models.START], [(1, 1, None)])))
+        self.members.append(("class/broken.synergo", b"not a zip"))
+        self.members.append(("class/notes.txt", b"not a model"))
+
+    def check(self, archive_path, jobs):
+        output = os.path.join(self.directory, "out.zip")
+        status = bundle.run(archive_path, output, jobs=jobs, stream=io.StringIO())
+        self.assertEqual(status, 1)
+
+        with zipfile.ZipFile(output) as zip_f:
+            manifest = json.loads(zip_f.read(bundle.MANIFEST_NAME))
+            for name, text in self.expected.items():
+                self.assertEqual(zip_f.read(name).decode("utf-8"), text)
+            self.assertEqual(zip_f.namelist(), list(self.expected) + [bundle.MANIFEST_NAME])
+
+        self.assertEqual(manifest["counts"], {"ok": 7, "structure": 1, "error": 1})
+        self.assertEqual([x["member"] for x in manifest["files"]], [x[0] for x in self.members[:-1]])
+        self.assertEqual([x["status"] for x in manifest["files"][-2:]], ["structure", "error"])
+
+    def test_zip(self):
+        path = os.path.join(self.directory, "class.zip")
+        with zipfile.ZipFile(path, "w") as zip_f:
+            for name, data in self.members:
+                zip_f.writestr(name, data)
+        self.check(path, 1)
+        self.check(path, 3)
+
+    def test_tar(self):
+        path = os.path.join(self.directory, "class.tar.gz")
+        with tarfile.open(path, "w:gz") as tar_f:
+            for name, data in self.members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_f.addfile(info, io.BytesIO(data))
+        self.check(path, 2)
+
+if __name__ == "__main__":
+    unittest.main()
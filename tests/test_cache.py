@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - A hit returns the stored program, or raises the stored StructureError
+# - The lines streamed on a miss are stored only once they are all read
+# - The least recently used entries are evicted to keep the size limit
+
+import os
+import tempfile
+import unittest
+
+import cache
+import convert
+import generate
+from tests import models
+
+def failing(source):
+    raise AssertionError("converted again")
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_hit(self):
+        c = cache.ConversionCache(self.directory)
+        data, expected = generate.generate(40, 2, 1, 0.5, 1)
+        self.assertEqual(cache.convert_cached(data, c), expected)
+        self.assertEqual(cache.convert_cached(data, c, failing), expected)
+        self.assertEqual("".join(cache.iter_lines_cached(data, c, failing)), expected)
+
+    def test_structure_error(self):
+        c = cache.ConversionCache(self.directory)
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1")], [(1, 3, None), (3, 2, "yes")])
+        with self.assertRaises(convert.StructureError) as first:
+            cache.convert_cached(data, c)
+        with self.assertRaises(convert.StructureError) as second:
+            cache.convert_cached(data, c, failing)
+        self.assertEqual(second.exception.fields(), first.exception.fields())
+
+    def test_streamed_lines(self):
+        c = cache.ConversionCache(self.directory)
+        data, expected = generate.generate(40, 2, 1, 0.5, 2)
+        lines = cache.iter_lines_cached(data, c)
+        next(lines)
+        lines.close()
+        key = cache.history_digest(data)
+        self.assertIsNone(c.get(key))
+        self.assertEqual([x for _, _, x in c._entries()], [])
+
+        self.assertEqual("".join(cache.iter_lines_cached(data, c)), expected)
+        self.assertEqual(c.get(key), expected)
+
+    def test_home_directory(self):
+        home = os.environ.get("HOME")
+        os.environ["HOME"] = self.directory
+        try:
+            c = cache.ConversionCache(os.path.join("~", "synergo"))
+        finally:
+            if home is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = home
+        self.assertEqual(c.directory, os.path.join(self.directory, "synergo"))
+        self.assertTrue(os.path.isdir(c.directory))
+
+    def test_key(self):
+        data, _ = generate.generate(30, seed=3)
+        other, _ = generate.generate(30, seed=4)
+        self.assertEqual(cache.history_digest(data), cache.history_digest(generate.generate(30, seed=3)[0]))
+        self.assertNotEqual(cache.history_digest(data), cache.history_digest(other))
+
+    def test_eviction(self):
+        c = cache.ConversionCache(self.directory, max_bytes=2500)
+        ## Four entries of 600 bytes fit, the oldest is used again
+        for i in range(4):
+            c.put("{0:02d}key".format(i), "x = {0}\n".format(i) * 100)
+            os.utime(c._path("{0:02d}key".format(i), ".py"), (i, i))
+        c.get("00key")
+        c.put("04key", "x = 4\n" * 100)
+
+        self.assertLessEqual(sum(size for _, size, _ in c._entries()), 2500)
+        self.assertIsNone(c.get("01key"))
+        for i in (0, 2, 3, 4):
+            self.assertEqual(c.get("{0:02d}key".format(i)), "x = {0}\n".format(i) * 100)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Resuming from the checkpoint of an earlier save gives the same state,
+#   and program, as replaying the whole history
+# - A history which was not simply appended to is replayed in full
+
+import tempfile
+import unittest
+
+import checkpoint
+import convert
+from tests import models
+
+class ResumeTest(unittest.TestCase):
+    def test_resume_equals_full_replay(self):
+        for seed in range(20):
+            earlier, data, expected = models.split_history(30 + seed * 5, 1 + seed % 4, seed % 3, 0.5, seed, 20 + seed)
+            first, _, resumed = checkpoint.replay(convert.Converter(), earlier)
+            self.assertFalse(resumed)
+
+            _, total, _ = checkpoint.replay(convert.Converter(), data)
+            c = convert.Converter()
+            _, applied, resumed = checkpoint.replay(c, data, first)
+            with self.subTest(seed=seed):
+                self.assertTrue(resumed)
+                self.assertEqual(applied, total - (20 + seed))
+                self.assertEqual("".join(c.lines()), expected)
+                self.assertEqual("".join(c.lines()), convert.convert(data))
+
+    def test_changed_history_is_replayed_in_full(self):
+        earlier, _, _ = models.split_history(40, 2, 1, 0.5, 1, 30)
+        _, data, expected = models.split_history(40, 2, 1, 0.5, 2, 30)
+        first, _, _ = checkpoint.replay(convert.Converter(), earlier)
+        c = convert.Converter()
+        _, _, resumed = checkpoint.replay(c, data, first)
+        self.assertFalse(resumed)
+        self.assertEqual("".join(c.lines()), expected)
+
+    def test_store(self):
+        earlier, data, expected = models.split_history(40, 2, 1, 0.5, 3, 25)
+        with tempfile.TemporaryDirectory() as directory:
+            store = checkpoint.CheckpointStore(directory)
+            first, _, _ = checkpoint.replay(convert.Converter(), earlier)
+            store.put("model", first)
+            self.assertEqual(checkpoint.convert_incremental(data, store, key="model"), expected)
+            self.assertEqual(checkpoint.convert_incremental(data, store, key="model"), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The syntax tree of codegen is the tree of the written text, with the
+#   same line numbers
+# - Syntax errors name the element they were written in
+# - The bytecode cache returns the same code object
+
+import ast
+import tempfile
+import unittest
+
+import cache
+import codegen
+import convert
+import generate
+from tests import models
+
+def structured(data):
+    c = convert.Converter()
+    c.reset()
+    with convert.open_history(data) as xml_f:
+        c.replay(xml_f)
+    return c, "".join(c.lines())
+
+def statements(module):
+    return [(type(x).__name__, x.lineno) for x in ast.walk(module) if isinstance(x, ast.stmt)]
+
+class ModuleTest(unittest.TestCase):
+    def test_same_tree_and_lines_as_the_text(self):
+        for seed in range(40):
+            data, _ = generate.generate(10 + seed * 2, 1 + seed % 5, seed % 3, 0.3, seed)
+            c, text = structured(data)
+            module, expected = codegen.build_module(c), ast.parse(text)
+            with self.subTest(seed=seed):
+                self.assertEqual(ast.dump(module), ast.dump(expected))
+                self.assertEqual(statements(module), statements(expected))
+
+    def test_syntax_error_names_the_element(self):
+        for text, message in (("a = = 1", "invalid syntax"), ("break", "'break' outside loop")):
+            data = models.model([models.START, models.END, (4, "Process", text)], [(1, 4, None), (4, 2, None)])
+            with self.subTest(text=text):
+                with self.assertRaises(convert.StructureError) as caught:
+                    codegen.compile_flowchart(data)
+                self.assertEqual(caught.exception.er_id, 5)
+                self.assertEqual(caught.exception.format[:2], [4, message])
+                self.assertEqual(caught.exception.elements, [4])
+
+    def test_cached_code(self):
+        data, _ = generate.generate(40, 3, 1, 0.0, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            conversion_cache = cache.ConversionCache(directory)
+            first = codegen.compile_cached(data, conversion_cache)
+            second = codegen.compile_cached(data, conversion_cache)
+        self.assertEqual(first, second)
+        self.assertEqual(first, codegen.compile_flowchart(data))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Generated models convert back to the program they were drawn from,
+#   for every shape of nesting, loops and editing churn
+# - Loops which cannot be written as a "while" are rejected, and the
+#   code is never written forever
+# - A model converts the same from a path, its bytes or an open file
+# - Conversions running in several threads at once give the serial results
+# - Texts and labels with commas, quotes and brackets are read whole
+
+import io
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import codegen
+import convert
+import generate
+from tests import models
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+class RoundTripTest(unittest.TestCase):
+    def test_generated_models(self):
+        for seed in range(60):
+            data, expected = generate.generate(10 + seed * 3, depth=1 + seed % 6, loops=seed % 4,
+                                               churn=(seed % 3) * 0.5, seed=seed)
+            with self.subTest(seed=seed):
+                self.assertEqual(convert.convert(data), expected)
+
+    def test_large_model(self):
+        data, expected = generate.generate(5000, depth=8, loops=20, churn=1.0, seed=1)
+        self.assertEqual(convert.convert(data), expected)
+
+    def test_lines_and_text_agree(self):
+        for i in (1, 2, 3):
+            path = os.path.join(EXAMPLES, "model{0}.synergo".format(i))
+            with self.subTest(model=i):
+                self.assertEqual("".join(convert.iter_lines(path)), convert.convert(path))
+
+class SourceTest(unittest.TestCase):
+    def test_every_kind_of_source(self):
+        path = os.path.join(EXAMPLES, "model2.synergo")
+        expected = convert.convert(path)
+        with open(path, "rb") as f:
+            data = f.read()
+            f.seek(0)
+            self.assertEqual(convert.convert(f), expected)
+        sources = {"bytes": data, "bytearray": bytearray(data), "memoryview": memoryview(data),
+                   "BytesIO": io.BytesIO(data)}
+        for name, source in sources.items():
+            with self.subTest(source=name):
+                self.assertEqual(convert.convert(source), expected)
+
+class ThreadTest(unittest.TestCase):
+    def test_concurrent_conversions(self):
+        sources = [generate.generate(100 + seed * 20, depth=2 + seed % 4, loops=seed % 3, churn=0.5, seed=seed)[0]
+                   for seed in range(16)]
+        serial = [convert.convert(data) for data in sources]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(3):
+                self.assertEqual(list(executor.map(convert.convert, sources)), serial)
+
+class TextTest(unittest.TestCase):
+    ## Commas, quotes and brackets in element texts and road labels
+    ELEMENTS = [models.START, models.END, (3, "Decision", 's == "x, y"'), (4, "Process", 'print("a, b")'),
+                (5, "Process", "t = 'c, (d)'")]
+    EDGES = [(1, 3, None), (3, 4, "yes"), (3, 5, 'no, "stop"'), (4, 2, None), (5, 2, None)]
+
+    def test_texts_are_read_whole(self):
+        c = convert.Converter()
+        with convert.open_history(models.model(self.ELEMENTS, self.EDGES)) as xml_f:
+            c.replay(xml_f)
+        self.assertEqual((c.contents[3], c.contents[4], c.contents[5]), ('s == "x, y"', 'print("a, b")', "t = 'c, (d)'"))
+        self.assertEqual(c.connectors[3], [3, 5, 'no, "stop"'])
+
+    def test_program(self):
+        relabel = ("Change Concept Relationship text", "[qualitative (3), no, (x=1,y=2,w=41,h=33)]")
+        data = models.model(self.ELEMENTS, self.EDGES, [relabel])
+        self.assertEqual(convert.convert(data), 'if s == "x, y":\n\tprint("a, b")\nelse:\n\tt = \'c, (d)\'\n')
+
+## A do-while whose body starts with an "if"
+DO_WHILE = ([models.START, models.END, (3, "Process", "a = 1"), (4, "Decision", "c1"), (5, "Process", "b = 2"),
+             (6, "Process", "d = 3"), (7, "Connector", ""), (8, "Decision", "c2")],
+            [(1, 3, None), (3, 4, None), (4, 5, "yes"), (4, 6, "no"), (5, 7, None), (6, 7, None),
+             (7, 8, None), (8, 3, "yes"), (8, 2, "no")])
+
+class LoopTest(unittest.TestCase):
+    def test_do_while_is_rejected(self):
+        with self.assertRaises(convert.StructureError) as caught:
+            convert.convert(models.model(*DO_WHILE))
+        self.assertEqual((caught.exception.er_id, caught.exception.elements), (8, [3]))
+
+    def test_element_reached_again(self):
+        c = convert.Converter()
+        with convert.open_history(models.model(*DO_WHILE)) as xml_f:
+            c.replay(xml_f)
+        c.validate()
+        c.build_elements()
+        c.Elements[4].meet = 7
+        c.Elements[8].kind = convert.Kind.LOOP
+
+        with self.assertRaises(convert.StructureError) as caught:
+            list(c.build(c.first_el, c.last_el, 0))
+        self.assertEqual((caught.exception.er_id, caught.exception.elements), (8, [3]))
+        with self.assertRaises(convert.StructureError) as caught:
+            codegen.build_module(c)
+        self.assertEqual((caught.exception.er_id, caught.exception.elements), (8, [3]))
+
+    def test_loop_without_a_no_road_out(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Process", "a = 1")],
+                            [(1, 3, None), (3, 2, "yes"), (3, 4, "no"), (4, 3, None)])
+        with self.assertRaises(convert.StructureError) as caught:
+            convert.convert(data)
+        self.assertEqual((caught.exception.er_id, caught.exception.elements), (7, [3, 4]))
+
+    def test_loop_with_two_back_edges(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Decision", "y > 1"),
+                             (5, "Process", "a = 1"), (6, "Process", "b = 2")],
+                            [(1, 3, None), (3, 4, "yes"), (3, 2, "no"), (4, 5, "yes"), (4, 6, "no"),
+                             (5, 3, None), (6, 3, None)])
+        self.assertEqual(convert.convert(data), "while x > 1:\n\tif y > 1:\n\t\ta = 1\n\telse:\n\t\tb = 2\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The same flowchart drawn in another order, with other ids, other
+#   Connectors and other spacing has the same fingerprint
+# - A small edit is a near duplicate found through the LSH bands, an
+#   unrelated model is not
+# - The index is saved and loaded again, and never keeps invalid models
+
+import os
+import random
+import tempfile
+import unittest
+
+import convert
+import fingerprint
+import generate
+from tests import models
+
+def drawn(program, seed):
+    rnd = random.Random(seed)
+    return generate.synergo_bytes(generate.history_of(rnd, generate.flowchart_of(rnd, program), 0.5))
+
+def statements(block):
+    for st in block:
+        yield st
+        for inner in st.blocks:
+            yield from statements(inner)
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.program = generate.random_program(random.Random(1), 80, 4, 2)
+
+    def test_identical(self):
+        first = fingerprint.fingerprint_of(drawn(self.program, 1))
+        second = fingerprint.fingerprint_of(drawn(self.program, 2))
+        self.assertEqual(first.exact, second.exact)
+        self.assertEqual(first.signature, second.signature)
+
+        spaced = [models.START, models.END, (3, "Process", "W=w * w")]
+        plain = [models.START, models.END, (3, "Process", "w = w*w")]
+        edges = [(1, 3, None), (3, 2, None)]
+        self.assertEqual(fingerprint.fingerprint_of(models.model(spaced, edges)).exact,
+                         fingerprint.fingerprint_of(models.model(plain, edges)).exact)
+
+    def test_index(self):
+        original = drawn(self.program, 1)
+        for st in statements(self.program):
+            if st.kind == "s":
+                st.text = "edited = 1"
+                break
+        edited = drawn(self.program, 3)
+        other = drawn(generate.random_program(random.Random(2), 80, 4, 2), 4)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "class.json")
+            index = fingerprint.FingerprintIndex(path)
+            self.assertEqual(index.check(original, "a"), [])
+            self.assertEqual(index.check(drawn(generate.random_program(random.Random(1), 80, 4, 2), 5), "b"),
+                             [("a", 1.0, True)])
+            self.assertEqual(index.check(other, "c"), [])
+
+            [(name, s, identical)] = [x for x in index.check(edited, "d") if x[0] == "a"]
+            self.assertFalse(identical)
+            self.assertGreaterEqual(s, index.threshold)
+            self.assertLess(s, 1.0)
+            index.save()
+
+            loaded = fingerprint.FingerprintIndex(path)
+            self.assertEqual(set(loaded.entries), {"a", "b", "c", "d"})
+            self.assertEqual(loaded.groups(), [["a", "b", "d"]])
+
+            bad = models.model([models.START, models.END, (3, "Decision", "x > 1")], [(1, 3, None), (3, 2, "yes")])
+            with self.assertRaises(convert.StructureError):
+                loaded.check(bad, "a")
+            self.assertNotIn("a", loaded.entries)
+            self.assertEqual(loaded.groups(), [["b", "d"]])
+
+if __name__ == "__main__":
+    unittest.main()
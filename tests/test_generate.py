@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The generator writes models of the asked size, depth and loops, and
+#   refuses loops without the depth for them
+# - The benchmark checks every output against the generated program
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import bench
+import convert
+import generate
+
+class GenerateTest(unittest.TestCase):
+    def test_shape(self):
+        data, expected = generate.generate(200, depth=5, loops=3, churn=1.0, seed=4)
+        lines = expected.splitlines()
+        self.assertEqual(sum(x.lstrip().startswith("while ") for x in lines), 3)
+        self.assertEqual(max(len(x) - len(x.lstrip("\t")) for x in lines), 5)
+        self.assertEqual(convert.convert(data), expected)
+
+    def test_same_seed_same_model(self):
+        self.assertEqual(generate.generate(80, seed=9), generate.generate(80, seed=9))
+
+    def test_depth_0(self):
+        data, expected = generate.generate(30, depth=0, loops=0)
+        self.assertFalse(any(x.startswith(("if ", "while ")) for x in expected.splitlines()))
+        self.assertEqual(convert.convert(data), expected)
+        with self.assertRaises(ValueError):
+            generate.generate(30, depth=0, loops=1)
+
+    def test_command_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            out = os.path.join(directory, "out.synergo")
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as caught:
+                generate.main([out, "--depth", "0"])
+            self.assertEqual(caught.exception.code, 2)
+            self.assertFalse(os.path.exists(out))
+
+            expected = os.path.join(directory, "out.py")
+            self.assertEqual(generate.main([out, "-n", "40", "--expected", expected]), 0)
+            with open(expected, encoding="utf-8") as f:
+                self.assertEqual(convert.convert(out), f.read())
+
+class BenchTest(unittest.TestCase):
+    def test_output_is_checked(self):
+        data, expected = generate.generate(60, 3, 1, 0.5, 2)
+        self.assertEqual(set(bench.time_phases(data, expected)), set(bench.PHASES))
+        with self.assertRaises(AssertionError):
+            bench.time_phases(data, expected + "x = 1\n")
+
+    def test_rows(self):
+        rows = bench.run(sizes=(50, 100), shapes=("flat", "loops"), repeat=1)
+        self.assertEqual([(r["shape"], r["elements"]) for r in rows],
+                         [("flat", 50), ("flat", 100), ("loops", 50), ("loops", 100)])
+        self.assertTrue(all(r["events"] > 0 for r in rows))
+
+    def test_slope(self):
+        self.assertAlmostEqual(bench.slope([10, 100, 1000], [1.0, 10.0, 100.0]), 1.0)
+        self.assertAlmostEqual(bench.slope([10, 100, 1000], [1.0, 100.0, 10000.0]), 2.0)
+
+if __name__ == "__main__":
+    unittest.main()
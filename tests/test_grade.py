@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Models and programs are run against the cases and graded
+# - Every run is held to its CPU, memory and output limits, and its
+#   whole process group is killed after the timeout
+# - A run happens in an empty folder of its own
+
+import os
+import tempfile
+import time
+import unittest
+
+import grade
+from tests import models
+
+CASES = [{"name": "positive", "stdin": "3\n", "stdout": "pos\n"},
+         {"name": "negative", "stdin": "-1\n", "stdout": "neg\n"}]
+
+class GradeTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def program(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def run_one(self, text, **limits):
+        path = self.program("run.py", text)
+        return grade.run_case(path, {"name": "run", "stdin": "", "stdout": ""}, grade.Limits(**limits))
+
+    def test_grade(self):
+        model = os.path.join(self.directory, "model.synergo")
+        with open(model, "wb") as f:
+            f.write(models.model([models.START, models.END, (3, "Process", "x = int(input('x: '))"),
+                                  (4, "Decision", "x > 0"), (5, "Process", "print('pos')"),
+                                  (6, "Process", "print('neg')")],
+                                 [(1, 3, None), (3, 4, None), (4, 5, "yes"), (4, 6, "no"), (5, 2, None), (6, 2, None)]))
+        wrong = self.program("wrong.py", "input()\nprint('pos')\n")
+        broken = os.path.join(self.directory, "broken.synergo")
+        with open(broken, "wb") as f:
+            f.write(models.model([models.START, models.END, (3, "Process", "a = = 1")], [(1, 3, None), (3, 2, None)]))
+
+        reports = grade.grade([model, wrong, broken], CASES, jobs=4)
+        self.assertEqual([(r["status"], r["passed"]) for r in reports], [("pass", 2), ("fail", 1), ("structure", 0)])
+        self.assertEqual([x["status"] for x in reports[1]["cases"]], ["pass", "fail"])
+
+    def test_cpu(self):
+        self.assertEqual(self.run_one("while True:\n\tpass\n", cpu=1, timeout=30)["status"], "cpu")
+
+    def test_memory(self):
+        self.assertEqual(self.run_one("a = bytearray(512 * 1024 * 1024)\n", memory_mb=128)["status"], "memory")
+
+    def test_output(self):
+        self.assertEqual(self.run_one("while True:\n\tprint('x' * 1000)\n", output_kb=16)["status"], "output")
+
+    def test_timeout_kills_the_group(self):
+        flag = os.path.join(self.directory, "flag")
+        child = self.program("child.py", "import time\ntime.sleep(1)\nopen({0!r}, 'w').close()\n".format(flag))
+        text = ("import subprocess, sys, time\n"
+                "subprocess.Popen([sys.executable, {0!r}])\n"
+                "time.sleep(60)\n").format(child)
+        started = time.monotonic()
+        self.assertEqual(self.run_one(text, timeout=0.5)["status"], "timeout")
+        self.assertLess(time.monotonic() - started, 10)
+        time.sleep(1.5)
+        self.assertFalse(os.path.exists(flag))
+
+    def test_empty_folder(self):
+        result = self.run_one("import os\nassert os.listdir() == [], os.listdir()\n"
+                              "assert os.getcwd() != {0!r}\n".format(self.directory))
+        self.assertEqual(result["status"], "pass", result["detail"])
+
+    def test_unique_submissions(self):
+        self.assertEqual(grade.unique_submissions(["a.synergo", "a.py", "b.py"]), ["a.synergo", "b.py"])
+
+if __name__ == "__main__":
+    unittest.main()
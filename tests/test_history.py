@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The diagram after any event, rebuilt from the snapshots, is the one
+#   a replay of the history up to that event gives
+# - programs() steps through every different valid program
+
+import unittest
+
+import convert
+import history
+from tests import models
+
+class HistoryTest(unittest.TestCase):
+    def test_convert_at(self):
+        for seed in range(10):
+            events = 15 + seed * 7
+            earlier, data, expected = models.split_history(40 + seed * 5, 1 + seed % 4, seed % 3, 1.0, seed, events)
+            h = history.History(data, interval=8)
+            with self.subTest(seed=seed):
+                self.assertGreater(len(h.snapshots), 1)
+                self.assertEqual(h.convert_at(len(h)), expected)
+                try:
+                    self.assertEqual(h.convert_at(events), convert.convert(earlier))
+                except convert.StructureError as e:
+                    with self.assertRaises(convert.StructureError) as caught:
+                        convert.convert(earlier)
+                    self.assertEqual(caught.exception.fields(), e.fields())
+
+    def test_index_of(self):
+        _, data, _ = models.split_history(30, 2, 1, 0.5, 1, 10)
+        h = history.History(data)
+        self.assertEqual(h.index_of(h.ids[11]), 12)
+        self.assertEqual(h.converter_at(12).last_id_event, h.ids[11])
+        with self.assertRaises(KeyError):
+            h.index_of(-1)
+        with self.assertRaises(IndexError):
+            h.converter_at(len(h) + 1)
+
+    def test_programs(self):
+        data = models.model([models.START, models.END, (3, "Process", "a = 1"), (4, "Process", "b = 2")],
+                            [(1, 3, None), (3, 2, None), (3, 4, None), (4, 2, None)],
+                            [("Delete object", "[qualitative (2)]"), ("Move object", "[Process (4), (x=1,y=1,w=90,h=60)]"),
+                             ("Change Concept Entity text", "[Process (4), b = 3, (x=1,y=1,w=90,h=60)]")])
+        h = history.History(data)
+        ## A lone Start-End is the empty program
+        self.assertEqual(list(h.programs()), [(1, 1, ""), (13, 13, "a = 1\nb = 2\n"), (15, 15, "a = 1\nb = 3\n")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - A saved IR loads back to the same structured graph and program
+# - An IR of another format or converter version is refused
+
+import os
+import struct
+import tempfile
+import unittest
+
+import convert
+import generate
+import ir
+
+class IRTest(unittest.TestCase):
+    def test_round_trip(self):
+        data, expected = generate.generate(80, 3, 1, 0.5, 2)
+        c = ir.structured(data)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model" + ir.IR_SUFFIX)
+            ir.save(c, path)
+            with ir.IRGraph.open(path) as graph:
+                elements = graph.elements()
+                loaded = graph.converter()
+                text = "".join(loaded.build(loaded.first_el, loaded.last_el, 0))
+        self.assertEqual(text, expected)
+        self.assertEqual(list(elements), list(c.Elements))
+        for x, el in c.Elements.items():
+            node = elements[x]
+            self.assertEqual((node.kind, node.text, node.to, node.no, node.meet),
+                             (el.kind, el.text, el.to, el.no, el.meet))
+
+    def test_other_version(self):
+        data, _ = generate.generate(20, 2, 1, 0.0, 3)
+        blob = bytearray(ir.compile_ir(data))
+        struct.pack_into("<H", blob, 4, ir.IR_VERSION + 1)
+        with self.assertRaises(ValueError):
+            ir.IRGraph(bytes(blob))
+
+        version = convert.CONVERTER_VERSION
+        convert.CONVERTER_VERSION = version + "-other"
+        try:
+            blob = ir.compile_ir(data)
+        finally:
+            convert.CONVERTER_VERSION = version
+        with self.assertRaises(ValueError):
+            ir.IRGraph(blob)
+        with self.assertRaises(ValueError):
+            ir.IRGraph(b"SGIR")
+
+if __name__ == "__main__":
+    unittest.main()
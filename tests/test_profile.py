@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - A profiled conversion emits one record with every phase and count,
+#   whether it succeeds, fails or is not read to the end
+# - A cache hit emits a record of its own, a miss adds the lookup to the
+#   record of the conversion
+# - tracemalloc is stopped again when the Profiler started it
+
+import io
+import json
+import tempfile
+import tracemalloc
+import unittest
+
+import cache
+import convert
+import generate
+from tests import models
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.profiler = convert.Profiler(self.records.append)
+
+    def test_record(self):
+        data, expected = generate.generate(60, 3, 1, 0.5, 1)
+        self.assertEqual(convert.convert(data, self.profiler), expected)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        [record] = self.records
+        self.assertEqual(list(record["phases"]), ["open", "replay", "elements", "structure", "build"])
+        for stats in record["phases"].values():
+            self.assertGreaterEqual(stats["seconds"], 0)
+            self.assertGreaterEqual(stats["peak_bytes"], 0)
+        self.assertEqual(record["lines"], expected.count("\n"))
+        c = convert.Converter()
+        c.convert(data)
+        self.assertEqual((record["events"], record["nodes"], record["edges"]),
+                         (c.events_applied, len(c.Elements), len(c.connectors)))
+        self.assertNotIn("error", record)
+
+    def test_failure(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1")], [(1, 3, None), (3, 2, "yes")])
+        with self.assertRaises(convert.StructureError) as caught:
+            convert.convert(data, self.profiler)
+        [record] = self.records
+        self.assertEqual(record["error"], str(caught.exception))
+        self.assertNotIn("build", record["phases"])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_stopped(self):
+        data, _ = generate.generate(60, 3, 1, 0.5, 2)
+        lines = convert.iter_lines(data, self.profiler)
+        next(lines)
+        lines.close()
+        [record] = self.records
+        self.assertEqual((record["stopped"], record["lines"]), (True, 1))
+
+    def test_cache_hit(self):
+        data, expected = generate.generate(40, 2, 1, 0.0, 3)
+        with tempfile.TemporaryDirectory() as directory:
+            conversion_cache = cache.ConversionCache(directory)
+            for _ in range(2):
+                lines = cache.iter_lines_cached(data, conversion_cache, lambda x: convert.iter_lines(x, self.profiler),
+                                                self.profiler)
+                self.assertEqual("".join(lines), expected)
+        self.assertEqual(len(self.records), 2)
+        self.assertEqual((self.records[0]["cache"], list(self.records[0]["phases"])),
+                         ("miss", ["lookup", "open", "replay", "elements", "structure", "build"]))
+        self.assertEqual((self.records[1]["cache"], list(self.records[1]["phases"])), ("hit", ["lookup"]))
+
+    def test_json_lines(self):
+        out = io.StringIO()
+        data, _ = generate.generate(30, seed=4)
+        convert.convert(data, convert.Profiler(out, memory=False))
+        convert.convert(data, convert.Profiler(out, memory=False))
+        records = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 2)
+        self.assertNotIn("peak_bytes", records[0]["phases"]["replay"])
+
+if __name__ == "__main__":
+    unittest.main()
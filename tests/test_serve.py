@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The conversion server and its client, offline over a Unix socket:
+#   programs, StructureErrors and broken uploads
+# - A request refused as busy is answered before its upload is read
+# - Only a socket is replaced at the address, never a file
+
+import contextlib
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import zipfile
+
+import convert
+import generate
+import serve
+from tests import models
+
+class ServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.address = os.path.join(cls.directory, "serve.sock")
+        cls.pool = serve.WorkerPool(workers=2, queue_size=2, timeout=30)
+        cls.server = serve.make_server(cls.address, cls.pool)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.pool.close()
+        shutil.rmtree(cls.directory)
+
+    def test_program(self):
+        data, expected = generate.generate(60, 3, 2, 0.5, 7)
+        self.assertEqual(serve.request(self.address, data), expected)
+
+    def test_structure_error(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Process", "a = 1")],
+                            [(1, 3, None), (3, 4, "yes"), (3, 2, "yes"), (4, 2, None)])
+        with self.assertRaises(convert.StructureErrors) as caught:
+            serve.request(self.address, data)
+        self.assertEqual([(x.er_id, x.elements) for x in caught.exception.errors], [(2, [3])])
+
+    def test_not_an_archive(self):
+        with self.assertRaises(serve.ServerError) as caught:
+            serve.request(self.address, b"not a zip")
+        self.assertEqual(caught.exception.status, 400)
+
+    def test_converter_failure(self):
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w") as zip_f:
+            zip_f.writestr("model.history.xml", "<log_file><events><event>")
+        with self.assertRaises(serve.ServerError) as caught:
+            serve.request(self.address, out.getvalue())
+        self.assertEqual(caught.exception.status, 500)
+
+    def test_busy_upload_is_not_read(self):
+        with contextlib.ExitStack() as stack:
+            while stack.enter_context(self.pool.slot()):
+                pass
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(10)
+            with sock:
+                sock.connect(self.address)
+                ## Only the start of a body of a megabyte is sent: the reply
+                ## comes without the server waiting for the rest
+                sock.sendall(b"POST /convert HTTP/1.1\r\nHost: localhost\r\n"
+                             b"Content-Length: 1000000\r\n\r\n" + b"x" * 10)
+                reply = b""
+                while True:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    reply += chunk
+        self.assertTrue(reply.startswith(b"HTTP/1.1 503 "))
+        self.assertIn(b"Retry-After: 1", reply)
+        self.assertEqual(serve.health(self.address)["queued"], 0)
+
+    def test_health(self):
+        stats = serve.health(self.address)
+        self.assertEqual(stats["workers"], 2)
+        self.assertEqual(stats["queue_size"], 2)
+
+class AddressTest(unittest.TestCase):
+    def test_file_is_not_replaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "model.py")
+            with open(path, "w") as f:
+                f.write("a = 1\n")
+            with self.assertRaises(FileExistsError):
+                serve.make_server(path, None)
+            with open(path) as f:
+                self.assertEqual(f.read(), "a = 1\n")
+
+    def test_stale_socket_is_replaced(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "serve.sock")
+            serve.make_server(path, None).server_close()
+            self.assertTrue(os.path.exists(path))
+            server = serve.make_server(path, None)
+            server.server_close()
+
+if __name__ == "__main__":
+    unittest.main()
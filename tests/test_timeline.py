@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - The timeline is collected in the same pass as the replay
+# - Only the insertion of an element which was removed is a re-insertion
+# - A clock which goes back gives no gap, and the CSV has a numeric
+#   column for every action and every user
+
+import os
+import tempfile
+import unittest
+
+import convert
+import generate
+import timeline
+from tests import models
+
+def events_xml(events):
+    out = ["<log_file>\n<events>\n"]
+    for n, (clock, user, action, attribute) in enumerate(events, 1):
+        out.append("<event><id_event>{0}</id_event><time>{1}</time><user>{2}</user><action>{3}</action>"
+                   "<attribute>{4}</attribute></event>\n".format(n, clock, user, action, attribute))
+    out.append("</events>\n</log_file>\n")
+    return generate.synergo_bytes("".join(out))
+
+def metrics(data):
+    history = timeline.Timeline()
+    c = convert.Converter(timeline=history)
+    with convert.open_history(data) as xml_f:
+        c.replay(xml_f)
+    return history.metrics()
+
+def entity(idd):
+    return "[Process, (x=1,y=1,w=90,h=60), Process ({0}), {0}]".format(idd)
+
+class TimelineTest(unittest.TestCase):
+    def test_reinserted(self):
+        data = models.model([models.START, models.END, (3, "Process", "a = 1")], [(1, 3, None), (3, 2, None)],
+                            [("Insert Entity", entity(5)), ("Delete object", "[Process (5)]"),
+                             ("Insert Entity", entity(6)), ("Delete objects", "[Process (6), qualitative (9)]"),
+                             ("Insert Entity", entity(5)), ("Insert Entity", entity(9))])
+        row = metrics(data)
+        self.assertEqual((row["inserted"], row["removed"], row["reinserted"], row["final_elements"]), (7, 2, 1, 5))
+
+    def test_clock(self):
+        insert = lambda idd: "[Start-End, (x=1,y=1,w=90,h=60), Start-End ({0}), {0}]".format(idd)
+        data = events_xml([("10 : 00 : 00", "anna", "Insert Entity", insert(1)),
+                           ("10 : 00 : 30", "anna", "Move object", "[Start-End (1), (x=2,y=2,w=90,h=60)]"),
+                           ("09 : 00 : 00", "bob", "Move object", "[Start-End (1), (x=3,y=3,w=90,h=60)]"),
+                           ("09 : 10 : 00", "anna", "Insert Entity", insert(2))])
+        row = metrics(data)
+        self.assertEqual((row["active_seconds"], row["idle_seconds"], row["idle_gaps"], row["longest_gap"]),
+                         (30, 600, 1, 600))
+        self.assertEqual((row["user:anna"], row["user:bob"], row["top_user"], row["user_count"]), (3, 1, "anna", 2))
+
+    def test_columns(self):
+        rows = [dict(metrics(generate.generate(30, seed=1)[0]), source="a", status="ok"),
+                dict(metrics(models.model([models.START], [])), source="b", status="structure")]
+        rows[1]["user:other"] = rows[1].pop("user:generator")
+        table = timeline.columns(rows)
+        self.assertEqual(table["user:generator"], [rows[0]["user:generator"], 0])
+        self.assertEqual(table["user:other"], [0, 2])
+        self.assertEqual(table["action:Insert Concept Relationship"][1], 0)
+        for name, values in table.items():
+            if name not in ("source", "status", "top_user"):
+                with self.subTest(column=name):
+                    self.assertTrue(all(isinstance(x, (int, float)) for x in values))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "timeline.csv")
+            timeline.write_csv(rows, path)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(f.readline().rstrip("\n").split(","), list(table))
+
+if __name__ == "__main__":
+    unittest.main()
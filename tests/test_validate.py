@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Every structural problem of a model is reported by validate, before
+#   anything is built
+
+import unittest
+
+import convert
+from tests import models
+
+class ValidateTest(unittest.TestCase):
+    def codes(self, data):
+        with self.assertRaises(convert.StructureErrors) as caught:
+            convert.convert(data)
+        return [(x.er_id, x.elements) for x in caught.exception.errors]
+
+    def test_decision_without_no_road(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Process", "a = 1")],
+                            [(1, 3, None), (3, 4, "yes"), (3, 2, "yes"), (4, 2, None)])
+        self.assertEqual(self.codes(data), [(2, [3])])
+
+    def test_decision_with_three_roads(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Process", "a = 1"),
+                             (5, "Process", "b = 2")],
+                            [(1, 3, None), (3, 4, "yes"), (3, 5, "no"), (3, 2, "no"), (4, 2, None), (5, 2, None)])
+        self.assertEqual(self.codes(data), [(2, [3])])
+
+    def test_road_to_a_deleted_element(self):
+        data = models.model([models.START, models.END, (3, "Process", "a = 1"), (4, "Process", "b = 2")],
+                            [(1, 3, None), (3, 4, None), (4, 2, None)],
+                            [("Delete object", "[Process (4)]")])
+        self.assertEqual(self.codes(data), [(9, [3, 4])])
+
+    def test_every_problem_is_reported(self):
+        data = models.model([models.START, models.END, (3, "Process", "a = 1"), (4, "Process", "b = 2"),
+                             (5, "Process", "c = 3")],
+                            [(1, 3, None), (3, 2, None), (3, 4, None), (5, 4, None)])
+        self.assertEqual(self.codes(data), [(1, [1, 5]), (3, [5]), (1, [2, 4]), (3, [4]), (4, [3])])
+
+    def test_loop_without_decision(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1"), (4, "Process", "a = 1"),
+                             (5, "Process", "b = 2")],
+                            [(1, 3, None), (3, 4, "yes"), (4, 5, None), (5, 4, None), (3, 2, "no")])
+        self.assertEqual(self.codes(data), [(6, [4, 5])])
+
+    def test_part_drawn_apart(self):
+        data = models.model([models.START, models.END, (4, "Process", "a = 1"), (5, "Process", "b = 2"),
+                             (6, "Process", "c = 3")],
+                            [(1, 6, None), (6, 2, None), (4, 5, None), (5, 4, None)])
+        self.assertEqual(self.codes(data), [(6, [4, 5])])
+
+    def test_deleted_road_out_of_the_end(self):
+        data = models.model([models.START, models.END, (4, "Process", "a = 1")],
+                            [(1, 4, None), (4, 2, None), (2, 4, None)],
+                            [("Delete object", "[qualitative (3)]")])
+        self.assertEqual(convert.convert(data), "a = 1\n")
+
+    def test_error_fields_round_trip(self):
+        data = models.model([models.START, models.END, (3, "Decision", "x > 1")],
+                            [(1, 3, None), (3, 2, "yes")])
+        with self.assertRaises(convert.StructureError) as caught:
+            convert.convert(data)
+        fields = caught.exception.fields()
+        self.assertEqual(convert.StructureError.from_fields(fields).fields(), fields)
+
+if __name__ == "__main__":
+    unittest.main()
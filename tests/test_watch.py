@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Files saved in the watched folder are converted, the ones there at
+#   start-up only once they change
+# - Starting the watch reads no file, a file is only hashed once it
+#   changes
+# - A file there at start-up and saved again unchanged is not converted
+#   when the cache holds its output
+
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import cache
+import convert
+import generate
+import watch
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def wait_for(path, timeout = 30.0):
+    end = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > end:
+            raise AssertionError("{0} was never written".format(path))
+        time.sleep(0.05)
+    time.sleep(0.1)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+class WatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.folder = os.path.join(self.directory.name, "in")
+        self.out = os.path.join(self.directory.name, "out")
+        os.makedirs(os.path.join(self.folder, "class"))
+        self.old = os.path.join(self.folder, "old.synergo")
+        self.old_data, self.old_expected = generate.generate(30, 2, 1, 0.0, 1)
+        write(self.old, self.old_data)
+
+    def watcher(self, use_inotify):
+        w = watch.Watcher(self.folder, out_dir=self.out, jobs=1, debounce=0.1, poll_interval=0.1,
+                          stream=io.StringIO(), use_inotify=use_inotify)
+        thread = threading.Thread(target=w.run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(w.stop)
+        return w
+
+    def check_saved_files(self, use_inotify):
+        self.watcher(use_inotify)
+        data, expected = generate.generate(40, 3, 1, 0.5, 2)
+        write(os.path.join(self.folder, "class", "new.synergo"), data)
+        self.assertEqual(wait_for(os.path.join(self.out, "class", "new.py")), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.out, "old.py")))
+
+        data, expected = generate.generate(50, 2, 0, 0.0, 4)
+        write(self.old, data)
+        self.assertEqual(wait_for(os.path.join(self.out, "old.py")), expected)
+
+    def test_inotify(self):
+        self.check_saved_files(True)
+
+    def test_polling(self):
+        self.check_saved_files(False)
+
+    def test_start_up_reads_no_file(self):
+        w = watch.Watcher(self.folder, out_dir=self.out, jobs=1, stream=io.StringIO(), use_inotify=False)
+        try:
+            self.assertEqual(set(w.stamps), {self.old})
+            self.assertEqual(w.digests, {})
+
+            ## An event for a file which did not change is not read
+            w._submit(self.old)
+            self.assertEqual((w.digests, w.running), ({}, set()))
+
+            ## Touched, with no cache to tell its output is up to date, it
+            ## is hashed and converted
+            os.utime(self.old, ns=(0, 0))
+            w._submit(self.old)
+            self.assertEqual(set(w.digests), {self.old})
+            self.assertEqual(w.running, {self.old})
+        finally:
+            w.executor.shutdown(wait=True)
+            w.source.close()
+
+    def test_identical_save_is_not_converted(self):
+        cache_options = (os.path.join(self.directory.name, "cache"), cache.DEFAULT_MAX_BYTES)
+        text = cache.convert_cached(self.old, cache.ConversionCache(*cache_options))
+        os.makedirs(self.out)
+        convert.write_output(text, os.path.join(self.out, "old"))
+
+        w = watch.Watcher(self.folder, out_dir=self.out, jobs=1, stream=io.StringIO(), use_inotify=False,
+                          cache_options=cache_options)
+        try:
+            ## Saved again with the same contents, its output is up to date
+            write(self.old, self.old_data)
+            os.utime(self.old, ns=(0, 0))
+            w._submit(self.old)
+            self.assertEqual(set(w.digests), {self.old})
+            self.assertEqual(w.running, set())
+
+            ## Saved with other contents, it is converted
+            data, expected = generate.generate(50, 2, 0, 0.0, 4)
+            write(self.old, data)
+            w._submit(self.old)
+            self.assertEqual(w.running, {self.old})
+        finally:
+            w.executor.shutdown(wait=True)
+            w.source.close()
+        self.assertEqual(wait_for(os.path.join(self.out, "old.py")), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Collect how a model was made while the Converter replays its history,
+#   in the same pass over the events: a Converter given a Timeline hands
+#   it every <event> after applying it, one without does no extra work
+# - The clock of an event is its <time> ("HH : MM : SS"). The gaps between
+#   events up to [idle_seconds] are active editing time, longer gaps are
+#   idle. A clock which goes back gives a gap of 0.
+# - Count the events of every action, the events of every user, and the
+#   elements inserted, removed and inserted again after their removal
+#   (churn)
+# - Write the metrics of a whole batch as one CSV, a row per model and a
+#   column per metric, or as {column: list} ready for numpy.asarray
+
+import csv
+import re
+import sys
+
+IDLE_SECONDS = 120
+
+## _IDS : The "(id)" of the objects named by an <attribute>
+_IDS = re.compile(r'\((\d+)\)')
+
+## parse_clock : Function(text)
+##
+## Functionality:
+##     Returns the seconds since midnight of "HH : MM : SS", or None when
+##     [text] is empty or not a time
+
+def parse_clock(text):
+    if not text:
+        return None
+    try:
+        h, m, s = (int(x) for x in text.split(":"))
+    except ValueError:
+        return None
+    return h * 3600 + m * 60 + s
+
+## Timeline : The editing timeline of a single model
+##     where idle_seconds = the longest gap between two events which is
+##                          still active editing time
+##
+## event(el, action, converter) is called by Converter.replay after the
+## event [el] has been applied. When the number of elements changed, the
+## ids named by its attribute which appeared or disappeared are the
+## elements inserted or removed, so the handlers need not know about the
+## Timeline. Converter.reset resets it.
+
+class Timeline:
+    def __init__(self, idle_seconds:int = IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.reset()
+
+    def reset(self):
+        self.events = 0
+        self.actions = {}
+        self.users = {}
+        self.clock = None
+        self.active_seconds = 0
+        self.idle_seconds_total = 0
+        self.idle_gaps = 0
+        self.longest_gap = 0
+        self.present = set()
+        self.removed_ids = set()
+        self.inserted = 0
+        self.removed = 0
+        self.reinserted = 0
+
+    def event(self, el, action, converter):
+        self.events += 1
+        self.actions[action] = self.actions.get(action, 0) + 1
+        user = el.findtext("user") or ""
+        self.users[user] = self.users.get(user, 0) + 1
+
+        clock = parse_clock(el.findtext("time") or el.findtext("time1"))
+        if clock is not None:
+            if self.clock is not None:
+                gap = max(0, clock - self.clock)
+                if gap > self.idle_seconds:
+                    self.idle_seconds_total += gap
+                    self.idle_gaps += 1
+                else:
+                    self.active_seconds += gap
+                self.longest_gap = max(self.longest_gap, gap)
+            self.clock = clock
+
+        ## An insertion of an element removed earlier is a re-insertion
+        elements = converter.elements
+        if len(elements) != len(self.present):
+            for idd in set(int(x) for x in _IDS.findall(el.findtext("attribute") or "")):
+                if idd in elements and idd not in self.present:
+                    self.present.add(idd)
+                    self.inserted += 1
+                    if idd in self.removed_ids:
+                        self.removed_ids.discard(idd)
+                        self.reinserted += 1
+                elif idd in self.present and idd not in elements:
+                    self.present.discard(idd)
+                    self.removed_ids.add(idd)
+                    self.removed += 1
+
+    ## metrics : Function()
+    ##
+    ## Functionality:
+    ##     Returns the metrics as a flat dict. The count of every action is
+    ##     under "action:<action>", the events of every user under
+    ##     "user:<name>".
+
+    def metrics(self) -> dict:
+        users = sorted(self.users.items(), key=lambda x: -x[1])
+        row = {
+            "events": self.events,
+            "active_seconds": self.active_seconds,
+            "idle_seconds": self.idle_seconds_total,
+            "idle_gaps": self.idle_gaps,
+            "longest_gap": self.longest_gap,
+            "inserted": self.inserted,
+            "removed": self.removed,
+            "reinserted": self.reinserted,
+            "final_elements": len(self.present),
+            "user_count": len(users),
+            "top_user": users[0][0] if users else "",
+            "top_user_share": round(users[0][1] / self.events, 4) if users else 0.0,
+        }
+        for action, n in sorted(self.actions.items()):
+            row["action:" + str(action)] = n
+        for user, n in sorted(self.users.items()):
+            row["user:" + user] = n
+        return row
+
+## COLUMNS : The columns every row has, in order. The action and then the
+##           user columns of the batch follow them.
+COLUMNS = ("source", "status", "events", "active_seconds", "idle_seconds", "idle_gaps", "longest_gap",
+           "inserted", "removed", "reinserted", "final_elements", "user_count", "top_user",
+           "top_user_share")
+COUNTED = ("action:", "user:")
+
+## columns : Function(rows)
+##     where rows = list of {"source", "status", metrics...}
+##
+## Functionality:
+##     Returns {column: list of values}, one value per row in every column.
+##     A row without a column (an action or a user it never had) gets 0.
+
+def columns(rows) -> dict:
+    names = list(COLUMNS)
+    for prefix in COUNTED:
+        names.extend(sorted({x for row in rows for x in row if x.startswith(prefix)}))
+    return {name: [row.get(name, 0 if name.startswith(COUNTED) else "") for row in rows] for name in names}
+
+## write_csv : Function(rows,path)
+##
+## Functionality:
+##     Writes the rows as CSV to the file at [path] ("-" for stdout)
+
+def write_csv(rows, path:str):
+    table = columns(rows)
+    names = list(table)
+    f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    try:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(table[x] for x in names)))
+    finally:
+        if f is not sys.stdout:
+            f.close()
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+# - Watch a folder (and its sub-folders) for saved .synergo files, with
+#   inotify where the system has it and by polling the modification
+#   times otherwise
+# - Bursts of saves of the same file are collapsed: a file is converted
+#   once it has not changed for [debounce] seconds
+# - A file is only converted when its contents really changed (sha256).
+#   It is only read and hashed when its modification time or size differ
+#   from the ones recorded for it
+# - Conversions run on a pool of worker processes, so a slow file never
+#   blocks the others. A file which changes while it is being converted
+#   is converted again after that
+# - Files already in the folder at start-up are not converted until they
+#   change: only their modification times and sizes are recorded when the
+#   watch starts, so starting never reads a whole folder of models. When
+#   one is saved again, it is not converted if its output already holds
+#   the conversion of its contents found in the conversion cache
+
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import batch
+import cache
+
+DEFAULT_DEBOUNCE = 0.5
+DEFAULT_POLL_INTERVAL = 1.0
+
+## _walk : Function(directory)
+##
+## Functionality:
+##     Yields the DirEntry of every file under [directory]
+
+def _walk(directory:str):
+    stack = [directory]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file():
+                yield entry
+
+## _stamp : Function(path)
+##
+## Functionality:
+##     The (modification time, size) of the file at [path], or None when
+##     it is gone
+
+def _stamp(path:str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+## _stamps : Function(directory)
+##
+## Functionality:
+##     {path: (modification time, size)} of every .synergo file under
+##     [directory], from the directory entries alone
+
+def _stamps(directory:str) -> dict:
+    stamps = {}
+    for entry in _walk(directory):
+        if entry.name.endswith(batch.SYNERGO_SUFFIX):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            stamps[entry.path] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+## _digest : Function(path)
+##
+## Functionality:
+##     The sha256 of the contents of the file at [path], or None when it
+##     cannot be read
+
+def _digest(path:str):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).digest()
+    except OSError:
+        return None
+
+## _Poller : Notices changed files by comparing modification times and
+##           sizes between scans of the folder
+##
+## wait(timeout) returns the set of files which are new or changed since
+## the previous call.
+
+class _Poller:
+    def __init__(self, directory:str, interval:float = DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.seen = _stamps(directory)
+
+    def wait(self, timeout:float) -> set:
+        time.sleep(min(timeout, self.interval))
+        seen = _stamps(self.directory)
+        changed = {path for path, stamp in seen.items() if self.seen.get(path) != stamp}
+        self.seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+## _Inotify : Notices changed files with the inotify interface of Linux,
+##            called through ctypes
+##
+## Every folder under the watched one gets its own watch, folders created
+## later included. Raises OSError where inotify is not available.
+
+class _Inotify:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory:str):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directory = directory
+        self.watches = {}
+        self._add_tree(directory)
+
+    def _add(self, path:str):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+
+    def _add_tree(self, directory:str) -> set:
+        files = set()
+        self._add(directory)
+        stack = [directory]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._add(entry.path)
+                    stack.append(entry.path)
+                elif entry.name.endswith(batch.SYNERGO_SUFFIX):
+                    files.add(entry.path)
+        return files
+
+    def wait(self, timeout:float) -> set:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                ## Events were lost, every file may have changed
+                changed.update(e.path for e in _walk(self.directory) if e.name.endswith(batch.SYNERGO_SUFFIX))
+                continue
+
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.update(self._add_tree(path))
+            elif path.endswith(batch.SYNERGO_SUFFIX):
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+## Watcher : Converts the .synergo files of a folder again whenever they change
+##     where directory = the watched folder
+##           out_dir = where the .py files are written (default: next to each input)
+##           jobs = the number of worker processes (default: number of cores)
+##           debounce = seconds a file must stay unchanged before it is converted
+##           cache_options, checkpoint_dir, profile_path = see batch.run
+##           use_inotify = False to always poll
+
+class Watcher:
+    def __init__(self, directory:str, out_dir:str = None, jobs:int = None, debounce:float = DEFAULT_DEBOUNCE,
+                 poll_interval:float = DEFAULT_POLL_INTERVAL, cache_options = None, checkpoint_dir:str = None,
+                 stream = sys.stdout, use_inotify:bool = True, profile_path:str = None):
+        self.directory = directory
+        self.out_dir = out_dir
+        self.debounce = debounce
+        self.cache_options = cache_options
+        self.checkpoint_dir = checkpoint_dir
+        self.profile_path = profile_path
+        self.stream = stream
+        self.stop_event = threading.Event()
+
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = _Inotify(directory)
+            except (OSError, AttributeError):
+                self.source = None
+        if self.source is None:
+            self.source = _Poller(directory, poll_interval)
+
+        self.executor = ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+        self.cache = cache.ConversionCache(*cache_options) if cache_options else None
+
+        ## due : {path: time when it can be converted}
+        ## stamps : {path: (modification time, size) when it was last looked at}
+        ## digests : {path: sha256 of the contents last converted}
+        ## running : paths being converted now
+        ## dirty : paths which changed while being converted
+        ## done : results sent back by the workers
+        self.due = {}
+        self.stamps = dict(self.source.seen) if isinstance(self.source, _Poller) else _stamps(directory)
+        self.digests = {}
+        self.running = set()
+        self.dirty = set()
+        self.done = queue.Queue()
+
+    def stop(self):
+        self.stop_event.set()
+
+    ## run : Function()
+    ##
+    ## Functionality:
+    ##     Watches until stop() is called (or KeyboardInterrupt)
+
+    def run(self):
+        print("Watching {0} ({1})".format(self.directory, type(self.source).__name__.strip("_")), file=self.stream)
+        try:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                timeout = min([self.debounce] + [t - now for t in self.due.values()])
+                for path in self.source.wait(max(timeout, 0.01)):
+                    self.due[path] = time.monotonic() + self.debounce
+
+                now = time.monotonic()
+                for path in [p for p, t in self.due.items() if t <= now]:
+                    del self.due[path]
+                    self._submit(path)
+
+                self._collect()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self._collect()
+            self.source.close()
+
+    def _submit(self, path:str):
+        if path in self.running:
+            self.dirty.add(path)
+            return
+
+        stamp = _stamp(path)
+        if stamp is None:
+            self.stamps.pop(path, None)
+            self.digests.pop(path, None)
+            return
+        if self.stamps.get(path) == stamp:
+            return
+
+        digest = _digest(path)
+        if digest is None:
+            return
+        self.stamps[path] = stamp
+        known = path in self.digests
+        if self.digests.get(path) == digest:
+            return
+        self.digests[path] = digest
+
+        output_path = batch.output_path_for(path, self.out_dir, self.directory)
+        if not known and self._up_to_date(path, output_path):
+            return
+
+        self.running.add(path)
+        os.makedirs(os.path.dirname(output_path) or os.curdir, exist_ok=True)
+        job = (path, output_path, self.cache_options, self.checkpoint_dir, self.profile_path, False)
+        future = self.executor.submit(batch._convert_one, job)
+        future.add_done_callback(lambda f, path=path: self.done.put((path, f)))
+
+    ## _up_to_date : Function(path,output_path)
+    ##
+    ## Functionality:
+    ##     True when the .py file of [output_path] already holds the cached
+    ##     conversion of [path]. A file never hashed before (one there at
+    ##     start-up) and saved again unchanged is found this way.
+
+    def _up_to_date(self, path:str, output_path:str) -> bool:
+        if self.cache is None:
+            return False
+        try:
+            text = self.cache.get(cache.history_digest(path))
+            if text is None:
+                return False
+            with open(output_path + ".py", encoding="utf-8") as f:
+                return f.read() == text
+        except Exception:
+            ## A broken model or a cached StructureError is left to the
+            ## conversion, which reports it
+            return False
+
+    def _collect(self):
+        while True:
+            try:
+                path, future = self.done.get_nowait()
+            except queue.Empty:
+                return
+
+            self.running.discard(path)
+            if future.cancelled():
+                continue
+            try:
+                _, status, message, _ = future.result()
+            except Exception as e:
+                status, message = "error", "{0}: {1}".format(type(e).__name__, e)
+
+            label = {"ok": "OK", "structure": "StructureError", "error": "Error"}[status]
+            print("[{0}] {1}: {2}".format(label, path, message), file=self.stream, flush=True)
+
+            if path in self.dirty:
+                self.dirty.discard(path)
+                self.due[path] = time.monotonic() + self.debounce
+
+## run : Function(directory, ...)
+##
+## Functionality:
+##     Watches [directory] until interrupted (see Watcher)
+
+def run(directory:str, **options) -> int:
+    if not os.path.isdir(directory):
+        print("Not a directory: {0}".format(directory), file=sys.stderr)
+        return 1
+    Watcher(directory, **options).run()
+    return 0